@@ -0,0 +1,241 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .database import get_conn, to_array
+
+
+LOAD_SQL = """
+  select v.id, v.title, v.lang, v.channel_id, e.embedding
+  from video_embeddings e join videos v on v.id=e.video_id
+"""
+
+# Rows scored per matmul when the matrix is float16, so the float32 upcast
+# never materializes the whole matrix
+_CHUNK = 2048
+
+
+class _Codes:
+    """Interns filter values (lang, channel_id) as small ints for vector masks."""
+
+    def __init__(self):
+        self._codes: Dict[Optional[str], int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        c = self._codes.get(value)
+        if c is None:
+            c = self._codes[value] = len(self._codes)
+        return c
+
+    def lookup(self, value: Optional[str]) -> int:
+        return self._codes.get(value, -1)
+
+
+class _State:
+    """One generation of the index arrays; `reload` builds a new one and swaps it in."""
+
+    def __init__(self, dim: int, dtype: np.dtype, capacity: int = 0):
+        self.dim = dim
+        self.dtype = dtype
+        self.matrix = np.zeros((capacity, dim), dtype=dtype)
+        self.lang = np.zeros(capacity, dtype=np.int32)
+        self.channel = np.zeros(capacity, dtype=np.int32)
+        self.ids: List[str] = []
+        self.titles: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.langs = _Codes()
+        self.channels = _Codes()
+
+    def grow(self, need: int) -> None:
+        cap = self.matrix.shape[0]
+        if need <= cap:
+            return
+        new_cap = max(need, cap * 2, 1024)
+        matrix = np.zeros((new_cap, self.dim), dtype=self.dtype)
+        matrix[:cap] = self.matrix
+        lang = np.zeros(new_cap, dtype=np.int32)
+        lang[:cap] = self.lang
+        channel = np.zeros(new_cap, dtype=np.int32)
+        channel[:cap] = self.channel
+        self.matrix, self.lang, self.channel = matrix, lang, channel
+
+    def put(self, video_id: str, emb: np.ndarray, title: str, lang: Optional[str], channel_id: Optional[str]) -> None:
+        emb = np.asarray(emb, dtype=np.float32)
+        norm = float(np.linalg.norm(emb))
+        if norm > 0:
+            emb = emb / norm
+        row = self.rows.get(video_id)
+        if row is None:
+            row = len(self.ids)
+            self.grow(row + 1)
+            self.ids.append(video_id)
+            self.titles.append(title)
+            self.rows[video_id] = row
+        else:
+            self.titles[row] = title
+        self.matrix[row] = emb
+        self.lang[row] = self.langs.code(lang)
+        self.channel[row] = self.channels.code(channel_id)
+
+
+class MemoryIndex:
+    """
+    Exact in-process k-NN over all video embeddings.
+
+    Rows live in one contiguous matrix (float32, or float16 to halve memory)
+    scored with a single matrix-vector product plus `argpartition`, which for
+    a corpus of this size beats an ivfflat round trip by orders of magnitude.
+    `/ingest` keeps it current via `upsert`; `reload` rebuilds it from the DB
+    and swaps it in atomically, replaying upserts that raced the reload.
+    """
+
+    def __init__(self, dim: int = 384, dtype: str = "float32"):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self._state = _State(dim, self.dtype)
+        self._replay: Optional[List[tuple]] = None
+        self.loaded = False
+        self.loaded_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._state.ids)
+
+    def upsert(self, video_id: str, emb: np.ndarray, title: str = "", lang: Optional[str] = None, channel_id: Optional[str] = None) -> None:
+        with self._lock:
+            self._state.put(video_id, emb, title, lang, channel_id)
+            if self._replay is not None:
+                self._replay.append((video_id, emb, title, lang, channel_id))
+
+    def load(self, rows: List[Tuple[str, str, Optional[str], Optional[str], Any]]) -> None:
+        """Replaces the whole index with `rows` of (id, title, lang, channel_id, embedding)."""
+        fresh = _State(self.dim, self.dtype)
+        fresh.grow(len(rows))
+        for vid, title, lang, channel_id, emb in rows:
+            fresh.put(vid, to_array(emb), title or "", lang, channel_id)
+        with self._lock:
+            for args in self._replay or ():
+                fresh.put(*args)
+            self._replay = None
+            self._state = fresh
+            self.loaded = True
+            self.loaded_at = time.time()
+
+    def reload(self) -> int:
+        with self._lock:
+            # Upserts from here on may be missing from the snapshot we read
+            self._replay = []
+        try:
+            with get_conn() as conn, conn.cursor(name="allie_index_load", binary=True) as cur:
+                cur.itersize = 5000
+                cur.execute(LOAD_SQL)
+                rows = list(cur)
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+        self.load(rows)
+        return len(rows)
+
+    def search(self, seed_id: str, k: int, lang: Optional[str] = None, channel_id: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """Returns None when the seed isn't indexed, so callers can fall back."""
+        with self._lock:
+            st = self._state
+            seed_row = st.rows.get(seed_id)
+            if seed_row is None:
+                return None
+            n = len(st.ids)
+            matrix = st.matrix[:n]
+            q = matrix[seed_row].astype(np.float32)
+            mask = np.ones(n, dtype=bool)
+            mask[seed_row] = False
+            if lang is not None:
+                mask &= st.lang[:n] == st.langs.lookup(lang)
+            if channel_id is not None:
+                mask &= st.channel[:n] == st.channels.lookup(channel_id)
+            ids, titles = st.ids, st.titles
+
+        if matrix.dtype == np.float32:
+            sims = matrix @ q
+        else:
+            sims = np.empty(n, dtype=np.float32)
+            for start in range(0, n, _CHUNK):
+                sims[start:start + _CHUNK] = matrix[start:start + _CHUNK].astype(np.float32) @ q
+        sims[~mask] = -np.inf
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return [{"video_id": ids[i], "title": titles[i], "sim": float(sims[i])} for i in top]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            st = self._state
+            n = len(st.ids)
+            return {
+                "loaded": self.loaded,
+                "loaded_at": self.loaded_at,
+                "size": n,
+                "dtype": self.dtype.name,
+                "matrix_bytes": int(st.matrix[:n].nbytes),
+                "capacity_bytes": int(st.matrix.nbytes),
+            }
+
+
+_index: Optional[MemoryIndex] = None
+_index_lock = threading.Lock()
+_reconciler: Optional[threading.Thread] = None
+
+
+def index_enabled() -> bool:
+    return os.getenv("ALLIE_INDEX_MODE", "pg").lower() == "memory"
+
+
+def get_index() -> MemoryIndex:
+    global _index
+    if _index is not None:
+        return _index
+    with _index_lock:
+        if _index is None:
+            try:
+                dim = int(os.getenv("ALLIE_EMBED_DIM", "384"))
+            except ValueError:
+                dim = 384
+            dtype = os.getenv("ALLIE_INDEX_DTYPE", "float32")
+            if dtype not in ("float32", "float16"):
+                dtype = "float32"
+            _index = MemoryIndex(dim=dim, dtype=dtype)
+    return _index
+
+
+def _reconcile_loop(interval: float) -> None:
+    index = get_index()
+    while True:
+        try:
+            n = index.reload()
+            logging.info("In-memory index reloaded: %d vectors", n)
+        except Exception:
+            logging.exception("In-memory index reload failed")
+        if interval <= 0:
+            return
+        time.sleep(interval)
+
+
+def start_index() -> None:
+    """Bulk-loads the index in the background and re-syncs it every ALLIE_INDEX_RECONCILE_S."""
+    global _reconciler
+    if _reconciler is not None:
+        return
+    try:
+        interval = float(os.getenv("ALLIE_INDEX_RECONCILE_S", "300"))
+    except ValueError:
+        interval = 300.0
+    _reconciler = threading.Thread(
+        target=_reconcile_loop, args=(interval,), name="allie-index-reconcile", daemon=True
+    )
+    _reconciler.start()
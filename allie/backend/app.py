@@ -1,12 +1,49 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any
 import os, numpy as np
 from dotenv import load_dotenv
-from .model import embed_text, get_model_name, get_embed_dim, warmup
-from .database import get_conn
+from .model import get_backend_name, get_model_name, get_embed_dim
+from .database import get_async_conn, pool_stats, close_pool
+from .concurrency import encode_admission, similar_admission, run_encode, shutdown_executor
+from .batcher import get_batcher
+from .cache import get_similar_cache
+from .embed_cache import cached_embed_texts, get_embedding_cache
+from .encode_pool import get_pool, shutdown_pool
+from .segments import embed_segments, pool_vectors, segments_enabled, split
+from .ann_index import get_index, index_enabled, start_index
+from . import startup
+from instrumentation import in_flight_gauge, instrument_fastapi, observe_batch, queue_gauge, span
 import logging
 load_dotenv()
-app = FastAPI(title="Allie Embed API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if index_enabled():
+        start_index()
+    # ALLIE_STARTUP=preload/blocking: warm the model before /readyz passes
+    await startup.on_startup()
+    yield
+    await close_pool()
+    shutdown_executor()
+    shutdown_pool()
+
+app = FastAPI(title="Allie Embed API", lifespan=lifespan)
+instrument_fastapi(app)
+for _name, _adm in (("encode", encode_admission), ("similar", similar_admission)):
+    queue_gauge(f"{_name}_admission", lambda a=_adm: a.waiting)
+    in_flight_gauge(f"{_name}_admission", lambda a=_adm: a.in_flight)
+
+# Upper bound on videos per /ingest/batch call (keeps one transaction bounded)
+MAX_INGEST_BATCH = int(os.getenv("ALLIE_INGEST_MAX_BATCH", "1000"))
+
+class Cue(BaseModel):
+    text: str
+    start: float
+    duration: float = 0.0
 
 class IngestReq(BaseModel):
     youtube_id: str
@@ -16,80 +53,323 @@ class IngestReq(BaseModel):
     published_at: str | None = None
     lang: str = "en"
     duration_s: int | None = None
+    # Timed captions; when given, stored segments carry timestamps
+    segments: list[Cue] | None = None
+
+class IngestBatchReq(BaseModel):
+    # Items are validated one by one so a bad row is reported, not fatal
+    items: list[dict[str, Any]] = Field(min_length=1, max_length=MAX_INGEST_BATCH)
+    batch_size: int | None = Field(default=None, ge=1)
 
 class SimilarReq(BaseModel):
     seed_id: str
     k: int = 20
+    # Optional filters; part of the result-cache key
+    lang: str | None = None
+    channel_id: str | None = None
+    # Attach each result's segment closest to the seed video
+    segments: bool = False
+
+DELETE_SEGMENTS = "delete from video_segments where video_id = any(%s::text[])"
 
-def vec_sql(v):
-    return "[" + ",".join(f"{float(x):.6f}" for x in v.tolist()) + "]"
+INSERT_SEGMENTS = """
+  insert into video_segments (video_id, seg_no, start_s, end_s, text, embedding)
+  select * from unnest(%s::text[], %s::int[], %s::real[], %s::real[], %s::text[], %s::vector[])
+"""
+
+async def _write_segments(cur, video_ids: list[str], segs: list[tuple[list, np.ndarray]]) -> None:
+    # Replaces each video's segments; a re-ingest may produce fewer windows
+    rows = [(vid, s, e) for vid, (ss, es) in zip(video_ids, segs) for s, e in zip(ss, es)]
+    with span("db_query"):
+        await cur.execute(DELETE_SEGMENTS, (video_ids,))
+        await cur.execute(INSERT_SEGMENTS, (
+            [vid for vid, _, _ in rows],
+            [s.seg_no for _, s, _ in rows],
+            [s.start_s for _, s, _ in rows],
+            [s.end_s for _, s, _ in rows],
+            [s.text for _, s, _ in rows],
+            [e for _, _, e in rows],
+        ))
 
 @app.post("/ingest")
-def ingest(req: IngestReq):
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
-          insert into videos (id,title,channel_id,published_at,lang,duration_s)
-          values (%s,%s,%s,%s,%s,%s)
-          on conflict (id) do update set
-            title=excluded.title, channel_id=excluded.channel_id,
-            published_at=excluded.published_at, lang=excluded.lang, duration_s=excluded.duration_s
-        """,(req.youtube_id, req.title, req.channel_id, req.published_at, req.lang, req.duration_s))
-        emb = embed_text(req.transcript).astype(np.float32)
-        emb_sql = vec_sql(emb)
-        cur.execute("""
-          insert into video_embeddings (video_id, embedding)
-          values (%s, %s::vector)
-          on conflict (video_id) do update set embedding=%s::vector
-        """,(req.youtube_id, emb_sql, emb_sql))
+async def ingest(req: IngestReq):
+    # Coalesced with concurrent /ingest calls into one forward pass on the
+    # batcher thread; encode before checking out a connection so the batching
+    # window doesn't hold it
+    segs = None
+    async with encode_admission:
+        if segments_enabled():
+            # Tokenizing an hour-long transcript is too slow for the event loop
+            windows = await run_encode(split, req.transcript, req.segments)
+            with span("encode_wait"):
+                seg_embs = await asyncio.wrap_future(get_batcher().submit([w.text for w in windows]))
+            segs = (windows, seg_embs)
+            emb = pool_vectors(seg_embs, windows)
+        else:
+            with span("encode_wait"):
+                emb = await asyncio.wrap_future(get_batcher().submit([req.transcript]))
+            emb = emb[0]
+    emb = emb.astype(np.float32)
+    async with get_async_conn() as conn, conn.cursor() as cur:
+        with span("db_query"):
+            await cur.execute("""
+              insert into videos (id,title,channel_id,published_at,lang,duration_s)
+              values (%s,%s,%s,%s,%s,%s)
+              on conflict (id) do update set
+                title=excluded.title, channel_id=excluded.channel_id,
+                published_at=excluded.published_at, lang=excluded.lang, duration_s=excluded.duration_s
+            """,(req.youtube_id, req.title, req.channel_id, req.published_at, req.lang, req.duration_s))
+            await cur.execute("""
+              insert into video_embeddings (video_id, embedding)
+              values (%s, %s)
+              on conflict (video_id) do update set embedding=excluded.embedding
+            """,(req.youtube_id, emb))
+        if segs is not None:
+            await _write_segments(cur, [req.youtube_id], [segs])
+    get_similar_cache().invalidate([req.youtube_id])
+    if index_enabled():
+        get_index().upsert(req.youtube_id, emb, req.title, req.lang, req.channel_id)
     return {"ok": True, "video_id": req.youtube_id}
 
+UPSERT_VIDEOS_BATCH = """
+  insert into videos (id,title,channel_id,published_at,lang,duration_s)
+  select * from unnest(%s::text[], %s::text[], %s::text[], %s::timestamptz[], %s::text[], %s::int[])
+  on conflict (id) do update set
+    title=excluded.title, channel_id=excluded.channel_id,
+    published_at=excluded.published_at, lang=excluded.lang, duration_s=excluded.duration_s
+"""
+
+UPSERT_EMBEDDINGS_BATCH = """
+  insert into video_embeddings (video_id, embedding)
+  select t.video_id, t.embedding
+  from unnest(%s::text[], %s::vector[]) as t(video_id, embedding)
+  on conflict (video_id) do update set embedding=excluded.embedding
+"""
+
+async def _upsert_batch(cur, reqs: list[IngestReq], embs: list[np.ndarray], segs: list | None = None) -> None:
+    with span("db_query"):
+        await cur.execute(UPSERT_VIDEOS_BATCH, (
+            [r.youtube_id for r in reqs],
+            [r.title for r in reqs],
+            [r.channel_id for r in reqs],
+            [r.published_at for r in reqs],
+            [r.lang for r in reqs],
+            [r.duration_s for r in reqs],
+        ))
+        await cur.execute(UPSERT_EMBEDDINGS_BATCH, ([r.youtube_id for r in reqs], embs))
+    if segs is not None:
+        await _write_segments(cur, [r.youtube_id for r in reqs], segs)
+
+@app.post("/ingest/batch")
+async def ingest_batch(req: IngestBatchReq):
+    results: list[dict[str, Any]] = [
+        {"video_id": raw.get("youtube_id"), "ok": False} for raw in req.items
+    ]
+    pending: dict[str, int] = {}
+    for i, raw in enumerate(req.items):
+        try:
+            IngestReq.model_validate(raw)
+        except ValidationError as e:
+            results[i]["error"] = "; ".join(
+                f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            continue
+        prev = pending.get(raw["youtube_id"])
+        if prev is not None:
+            # A single upsert cannot touch the same row twice; last one wins
+            results[prev]["error"] = "superseded by a later item with the same youtube_id"
+        pending[raw["youtube_id"]] = i
+
+    idx = sorted(pending.values())
+    reqs = [IngestReq.model_validate(req.items[i]) for i in idx]
+    if reqs:
+        observe_batch("ingest_batch", len(reqs))
+        segs = None
+        try:
+            async with encode_admission:
+                if segments_enabled():
+                    # Every window of every video in one encode call
+                    encoded = await run_encode(
+                        embed_segments, [(r.transcript, r.segments) for r in reqs], batch_size=req.batch_size
+                    )
+                    segs = [(windows, rows) for windows, rows, _ in encoded]
+                    embs = [vec for _, _, vec in encoded]
+                else:
+                    embs = await run_encode(
+                        cached_embed_texts, [r.transcript for r in reqs], batch_size=req.batch_size
+                    )
+        except HTTPException:
+            # Admission rejected the whole batch; the client should retry it
+            raise
+        except Exception:
+            logging.exception("Batch embedding failed")
+            for i in idx:
+                results[i]["error"] = "embedding failed"
+            return {"ok": False, "ingested": 0, "results": results}
+        rows = list(embs)
+
+        async with get_async_conn() as conn:
+            try:
+                async with conn.transaction(), conn.cursor() as cur:
+                    await _upsert_batch(cur, reqs, rows, segs)
+                for i in idx:
+                    results[i]["ok"] = True
+            except Exception:
+                # Set-based upsert rejected the batch; retry row by row inside
+                # savepoints so only the offending items are reported
+                logging.warning("Batch upsert failed; isolating bad rows", exc_info=True)
+                async with conn.transaction():
+                    for n, (i, r, e) in enumerate(zip(idx, reqs, rows)):
+                        try:
+                            async with conn.transaction(), conn.cursor() as cur:
+                                await _upsert_batch(cur, [r], [e], None if segs is None else [segs[n]])
+                            results[i]["ok"] = True
+                        except Exception as exc:
+                            results[i]["error"] = (str(exc).splitlines() or [type(exc).__name__])[0]
+
+        if index_enabled():
+            index = get_index()
+            for i, r, e in zip(idx, reqs, rows):
+                if results[i]["ok"]:
+                    index.upsert(r.youtube_id, e, r.title, r.lang, r.channel_id)
+
+    get_similar_cache().invalidate(r["video_id"] for r in results if r["ok"])
+    ingested = sum(1 for r in results if r["ok"])
+    return {"ok": ingested == len(results), "ingested": ingested, "results": results}
+
+# The seed vector never leaves the server: scalar subqueries over the
+# materialized CTE become InitPlans, so the ivfflat index still drives the
+# ORDER BY, and the EXISTS gate returns no rows for an unknown seed.
+SIMILAR_SQL = """
+  with seed as materialized (
+    select embedding from video_embeddings where video_id=%(seed_id)s
+  )
+  select v.id, v.title, 1 - (e.embedding <=> (select embedding from seed)) as cosine_sim
+  from video_embeddings e join videos v on v.id=e.video_id
+  where exists (select 1 from seed)
+    and e.video_id <> %(seed_id)s
+    and (%(lang)s::text is null or v.lang = %(lang)s)
+    and (%(channel_id)s::text is null or v.channel_id = %(channel_id)s)
+  order by e.embedding <-> (select embedding from seed)
+  limit %(k)s
+"""
+
+# Per result video, its stored window nearest the seed's pooled vector: only
+# vectors already in video_segments are compared, no text is re-encoded. Each
+# lateral reads one video's segments through the primary key.
+BEST_SEGMENTS_SQL = """
+  with seed as materialized (
+    select embedding from video_embeddings where video_id=%(seed_id)s
+  )
+  select r.video_id, s.seg_no, s.start_s, s.end_s, s.text,
+         1 - (s.embedding <=> (select embedding from seed)) as cosine_sim
+  from unnest(%(ids)s::text[]) as r(video_id)
+  cross join lateral (
+    select seg_no, start_s, end_s, text, embedding from video_segments
+    where video_id = r.video_id
+    order by embedding <-> (select embedding from seed)
+    limit 1
+  ) s
+"""
+
+async def _best_segments(seed_id: str, ids: list[str]) -> dict[str, dict[str, Any]]:
+    async with similar_admission, get_async_conn() as conn, conn.cursor() as cur:
+        with span("db_query"):
+            await cur.execute(BEST_SEGMENTS_SQL, {"seed_id": seed_id, "ids": ids})
+            rows = await cur.fetchall()
+    return {
+        r[0]: {"seg_no": r[1], "start_s": r[2], "end_s": r[3], "text": r[4], "sim": float(r[5])}
+        for r in rows
+    }
+
 @app.post("/similar")
-def similar(req: SimilarReq):
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("select embedding from video_embeddings where video_id=%s",(req.seed_id,))
-        row = cur.fetchone()
-        if not row: return {"results":[]}
-        seed = row[0]
-        if isinstance(seed, str):
-            seed = seed.strip("[]")
-            seed = np.array([float(x) for x in seed.split(",")], dtype=np.float32)
-        else:
-            seed = np.array(seed, dtype=np.float32)
-        seed_sql = vec_sql(seed)
-        cur.execute("""
-          select v.id, v.title, 1 - (e.embedding <=> %s::vector) as cosine_sim
-          from video_embeddings e join videos v on v.id=e.video_id
-          where v.id <> %s
-          order by e.embedding <-> %s::vector
-          limit %s
-        """,(seed_sql, req.seed_id, seed_sql, req.k+50))
-        rows = cur.fetchall()
-    out = [{"video_id": r[0], "title": r[1], "sim": float(r[2])} for r in rows[:req.k]]
+async def similar(req: SimilarReq):
+    cache = get_similar_cache()
+    key = (req.seed_id, req.k, req.lang, req.channel_id, req.segments)
+    # Read before the query: an /ingest finishing meanwhile makes the result stale
+    generation = cache.generation
+    out = cache.get(key)
+    if out is not None:
+        return {"results": out}
+    if index_enabled() and get_index().loaded:
+        # None means the seed isn't mirrored yet; Postgres still has it. The
+        # scan touches the whole matrix, so it runs off the event loop and is
+        # bounded like the Postgres path
+        async with similar_admission:
+            with span("index_search"):
+                out = await asyncio.to_thread(get_index().search, req.seed_id, req.k, req.lang, req.channel_id)
+    if out is None:
+        async with similar_admission, get_async_conn() as conn, conn.cursor() as cur:
+            with span("db_query"):
+                await cur.execute(SIMILAR_SQL, req.model_dump(include={"seed_id", "k", "lang", "channel_id"}))
+                rows = await cur.fetchall()
+        with span("postprocess"):
+            out = [{"video_id": r[0], "title": r[1], "sim": float(r[2])} for r in rows]
+    if req.segments and out and segments_enabled():
+        best = await _best_segments(req.seed_id, [r["video_id"] for r in out])
+        out = [{**r, "segment": best.get(r["video_id"])} for r in out]
+    cache.put(key, req.seed_id, out, generation)
     return {"results": out}
 
 
 @app.get("/healthz")
-def healthz():
-    # Lightweight readiness info; does not force model load
+async def healthz():
+    # Liveness plus readiness info; does not force model load
     return {
         "ok": True,
+        "ready": startup.is_ready(),
+        "startup": startup.stats(),
         "model": get_model_name(),
         "db": bool(os.environ.get("SUPABASE_DB_URL")),
+        "pool": pool_stats(),
+        "admission": {"encode": encode_admission.stats(), "similar": similar_admission.stats()},
     }
 
 
+@app.get("/readyz")
+async def readyz():
+    # 503 until the warmup encode has run (always 200 with ALLIE_STARTUP=lazy)
+    info = startup.stats()
+    return JSONResponse(info, status_code=200 if info["ready"] else 503)
+
+
 @app.get("/model")
-def model_info():
-    # Forces a tiny load to report dimension accurately
+async def model_info():
+    # Forces a tiny load to report dimension accurately; off the event loop
     try:
-        dim = get_embed_dim()
+        dim = await run_encode(get_embed_dim)
     except Exception as e:
         logging.exception("Error while getting embedding dimension")
         return {"model": get_model_name(), "error": "Internal error"}
-    return {"model": get_model_name(), "dimension": dim}
+    pool = get_pool()
+    return {
+        "model": get_model_name(),
+        "backend": get_backend_name(),
+        "dimension": dim,
+        "cache": get_embedding_cache().stats(),
+        "pool": pool.stats() if pool is not None else None,
+    }
+
+
+@app.get("/cache")
+async def cache_stats():
+    return {"similar": get_similar_cache().stats(), "embeddings": get_embedding_cache().stats()}
+
+
+@app.get("/index")
+async def index_stats():
+    if not index_enabled():
+        return {"mode": "pg"}
+    return {"mode": "memory", **get_index().stats()}
+
+
+@app.get("/batcher")
+async def batcher_stats():
+    # Queue depth and batch-size distribution of the /ingest micro-batcher
+    return get_batcher().stats()
 
 
 @app.post("/warmup")
-def warmup_model():
-    warmup()
-    return {"ok": True, "model": get_model_name()}
+async def warmup_model():
+    await run_encode(startup.warm)
+    return {"ok": True, "model": get_model_name(), "startup": startup.stats()}
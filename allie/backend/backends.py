@@ -0,0 +1,267 @@
+"""
+Inference backends for the embedding model, selected by ALLIE_BACKEND.
+
+Every backend returns an object with the subset of the SentenceTransformer
+interface `model.py` relies on: `encode(texts, batch_size,
+normalize_embeddings)`, a settable `max_seq_length` and
+`get_sentence_embedding_dimension()`.
+
+- `torch`       full-precision SentenceTransformer (default)
+- `torch-int8`  SentenceTransformer with dynamically quantized Linear layers
+- `onnx`        ONNX Runtime + `tokenizers`; never imports torch
+- `onnx-int8`   as `onnx`, with int8 dynamically quantized weights
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+def load_backend(name: str, model_name: str, device: Optional[str] = None) -> Any:
+    if name == "torch":
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device=device)
+        return _shared_weights(model) if device in (None, "cpu") else model
+    if name == "torch-int8":
+        import torch
+        from sentence_transformers import SentenceTransformer
+        # Dynamic int8 quantization is CPU-only; the quantized Linear weights
+        # are private, but embeddings and norms stay on the shared mapping
+        model = _shared_weights(SentenceTransformer(model_name, device="cpu"))
+        # In place: the default deep copy would read every shared page into private memory
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxEncoder(model_name, quantize=name == "onnx-int8", device=device)
+    raise ValueError(f"Unknown ALLIE_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def prefetch(name: str, model_name: str) -> None:
+    """Download (and for `onnx-int8`, quantize) model files without creating a session."""
+    if name not in ("onnx", "onnx-int8"):
+        from sentence_transformers import SentenceTransformer  # noqa: F401 - import cost only
+        return
+    import onnxruntime  # noqa: F401
+    import tokenizers  # noqa: F401
+
+    root = _model_dir(model_name)
+    if name == "onnx-int8" and not os.getenv("ALLIE_ONNX_PATH"):
+        OnnxEncoder._quantized(os.path.join(root, "onnx", "model.onnx"), model_name)
+
+
+def shared_torch_state(model_name: str) -> str:
+    """Where `_shared_weights` keeps the model's state dict for worker processes."""
+    return os.path.join(_cache_dir(model_name), "torch_state.pt")
+
+
+def _shared_weights(model: Any) -> Any:
+    """
+    With ALLIE_TORCH_SHARED_STATE set, swap the model's parameters for
+    tensors mmapped from that state-dict file (written by the first process
+    that needs it). Every process doing this maps the same page-cache
+    pages, so the weights are held once however many workers load them.
+    """
+    path = os.getenv("ALLIE_TORCH_SHARED_STATE")
+    if not path:
+        return model
+    import torch
+
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        torch.save(model.state_dict(), tmp)
+        os.replace(tmp, path)
+    state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    # assign=True keeps the mmapped tensors instead of copying into the old ones
+    model.load_state_dict(state, assign=True)
+    return model
+
+
+def load_tokenizer(model_name: str) -> Any:
+    """The model's fast tokenizer (`tokenizers.Tokenizer`), without loading any weights."""
+    from tokenizers import Tokenizer
+
+    if os.path.isdir(model_name):
+        path = os.path.join(model_name, "tokenizer.json")
+    else:
+        from huggingface_hub import hf_hub_download
+        path = hf_hub_download(model_name, "tokenizer.json")
+    tokenizer = Tokenizer.from_file(path)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+
+def _cache_dir(model_name: str) -> str:
+    root = os.getenv("ALLIE_ONNX_CACHE_DIR", os.path.expanduser("~/.cache/allie/onnx"))
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def shared_onnx_model(name: str, model_name: str) -> Tuple[str, str]:
+    """
+    (model dir, .onnx path) for worker processes that should share weights.
+
+    The graph is re-saved once with every initializer in a single external
+    data file. ONNX Runtime mmaps external data read-only, so all processes
+    loading this copy map the same page-cache pages instead of each holding
+    a private copy of the weights.
+    """
+    import onnx
+
+    root = _model_dir(model_name)
+    src = os.getenv("ALLIE_ONNX_PATH") or os.path.join(root, "onnx", "model.onnx")
+    if name == "onnx-int8" and not os.getenv("ALLIE_ONNX_PATH"):
+        src = OnnxEncoder._quantized(src, model_name)
+    stem = os.path.splitext(os.path.basename(src))[0]
+    dst = os.path.join(_cache_dir(model_name), f"{stem}_shared.onnx")
+    if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        data = f"{stem}_shared.bin"
+        if os.path.exists(os.path.join(os.path.dirname(dst), data)):
+            # onnx appends to an existing data file
+            os.remove(os.path.join(os.path.dirname(dst), data))
+        tmp = dst + ".tmp"
+        onnx.save_model(
+            onnx.load(src),
+            tmp,
+            save_as_external_data=True,
+            all_tensors_to_one_file=True,
+            location=data,
+            size_threshold=1024,
+        )
+        os.replace(tmp, dst)
+    return root, dst
+
+
+def _model_dir(model_name: str) -> str:
+    if os.path.isdir(model_name):
+        return model_name
+    from huggingface_hub import snapshot_download
+    return snapshot_download(
+        model_name,
+        allow_patterns=[
+            "onnx/model.onnx",
+            "tokenizer.json",
+            "config.json",
+            "sentence_bert_config.json",
+            "1_Pooling/config.json",
+        ],
+    )
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class OnnxEncoder:
+    """
+    Sentence embedding with ONNX Runtime, matching SentenceTransformer output.
+
+    Uses the model repo's exported `onnx/model.onnx` and `tokenizer.json`,
+    and the pooling mode from `1_Pooling/config.json` (CLS for the bge
+    family, mean otherwise). With `quantize=True` the graph is dynamically
+    quantized to int8 once and cached under ALLIE_ONNX_CACHE_DIR, unless
+    ALLIE_ONNX_PATH points at a prebuilt model.
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False, device: Optional[str] = None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        root = _model_dir(model_name)
+        onnx_path = os.getenv("ALLIE_ONNX_PATH") or os.path.join(root, "onnx", "model.onnx")
+        if quantize and not os.getenv("ALLIE_ONNX_PATH"):
+            onnx_path = self._quantized(onnx_path, model_name)
+
+        st_config = _read_json(os.path.join(root, "sentence_bert_config.json"))
+        pooling = _read_json(os.path.join(root, "1_Pooling", "config.json"))
+        self.pooling = "mean" if pooling.get("pooling_mode_mean_tokens") else "cls"
+        self._dim = int(pooling.get("word_embedding_dimension") or 0) or None
+
+        with open(os.path.join(root, "tokenizer.json"), encoding="utf-8") as f:
+            self._tokenizer_spec = f.read()
+        self._config_lock = threading.Lock()
+        self.tokenizer: Any = Tokenizer.from_str(self._tokenizer_spec)
+        self.max_seq_length = int(st_config.get("max_seq_length", 512))
+        opts = ort.SessionOptions()
+        threads = os.getenv("ALLIE_ONNX_THREADS")
+        if threads:
+            opts.intra_op_num_threads = int(threads)
+        if os.getenv("ALLIE_ONNX_PREPACK", "1").lower() in ("0", "false", "no"):
+            # Prepacked copies of MatMul weights would be private to the process
+            opts.add_session_config_entry("session.disable_prepacking", "1")
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda":
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(onnx_path, sess_options=opts, providers=providers)
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def _quantized(src: str, model_name: str) -> str:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        dst = os.path.join(_cache_dir(model_name), "model_qint8.onnx")
+        if not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            tmp = dst + ".tmp"
+            quantize_dynamic(src, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, dst)
+        return dst
+
+    @property
+    def max_seq_length(self) -> int:
+        return self._max_seq_length
+
+    @max_seq_length.setter
+    def max_seq_length(self, value: int) -> None:
+        from tokenizers import Tokenizer
+
+        # Configure a fresh tokenizer and swap it in: calling enable_* on the
+        # one other threads are encoding with fails with "Already borrowed"
+        with self._config_lock:
+            tokenizer = Tokenizer.from_str(self._tokenizer_spec)
+            tokenizer.enable_truncation(max_length=int(value))
+            tokenizer.enable_padding()
+            self._max_seq_length = int(value)
+            self.tokenizer = tokenizer
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            self._dim = int(self.encode(["hello"]).shape[-1])
+        return self._dim
+
+    def _forward(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feed = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.array([e.type_ids for e in enc], dtype=np.int64)
+        hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self._inputs})[0]
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        m = mask[..., None].astype(hidden.dtype)
+        return (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts: List[str], batch_size: int = 32, normalize_embeddings: bool = False, **_: Any) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self._dim or 0), dtype=np.float32)
+        # Like SentenceTransformer: length-sorted batches keep padding low
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        out: List[np.ndarray] = [None] * len(texts)  # type: ignore[list-item]
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            emb = self._forward([texts[i] for i in chunk]).astype(np.float32)
+            if normalize_embeddings:
+                emb /= np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+            for i, row in zip(chunk, emb):
+                out[i] = row
+        return np.stack(out)
@@ -0,0 +1,194 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from instrumentation import observe_batch, queue_gauge
+
+from .embed_cache import cached_embed_texts
+
+
+class _Pending:
+    __slots__ = ("texts", "future", "enqueued_at")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+def _settle(future: Future, result: Optional[np.ndarray] = None, exc: Optional[BaseException] = None) -> None:
+    try:
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass  # already settled or cancelled
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent embedding requests into shared forward passes.
+
+    Callers block in `embed()` while a single worker thread drains the queue:
+    it waits up to `window_ms` after the first request (or until `max_batch`
+    texts are queued), sorts the gathered texts by length to cut padding,
+    runs one `encode_fn` call and hands each caller back its own rows.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray] = cached_embed_texts,
+        window_ms: float = 5.0,
+        max_batch: int = 64,
+    ):
+        self.encode_fn = encode_fn
+        self.window_s = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._queued_texts = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._texts = 0
+        self._requests = 0
+        self._last_batch = 0
+        self._max_seen = 0
+        self._wait_s_total = 0.0
+        self._size_hist: Dict[int, int] = {}
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                t = threading.Thread(target=self._run, name="allie-batcher", daemon=True)
+                t.start()
+                self._thread = t
+
+    def submit(self, texts: List[str]) -> Future:
+        self._ensure_worker()
+        item = _Pending(list(texts))
+        with self._stats_lock:
+            self._queued_texts += len(item.texts)
+        self._queue.put(item)
+        return item.future
+
+    def embed(self, texts: List[str], timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(texts).result(timeout=timeout)
+
+    def embed_one(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        return self.embed([text], timeout=timeout)[0]
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        n = len(batch[0].texts)
+        deadline = time.monotonic() + self.window_s
+        while n < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            n += len(item.texts)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as exc:
+                # Never let one bad batch end the only worker thread
+                logging.exception("Micro-batcher failed a batch")
+                for item in batch:
+                    _settle(item.future, exc=exc)
+
+    def _process(self, batch: List[_Pending]) -> None:
+        started = time.monotonic()
+        with self._stats_lock:
+            self._queued_texts -= sum(len(item.texts) for item in batch)
+        # Callers that gave up (e.g. a disconnected client cancelling the
+        # wrapped future) are dropped; the rest can no longer be cancelled
+        batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = [t for item in batch for t in item.texts]
+        with self._stats_lock:
+            self._record(batch, len(texts), started)
+        try:
+            order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+            sorted_emb = np.asarray(self.encode_fn([texts[i] for i in order]), dtype=np.float32)
+            emb = np.empty_like(sorted_emb)
+            emb[order] = sorted_emb
+        except Exception as exc:
+            for item in batch:
+                _settle(item.future, exc=exc)
+            return
+        offset = 0
+        for item in batch:
+            k = len(item.texts)
+            _settle(item.future, result=emb[offset:offset + k])
+            offset += k
+
+    def _record(self, batch: List[_Pending], size: int, started: float) -> None:
+        observe_batch("batcher", size)
+        self._batches += 1
+        self._requests += len(batch)
+        self._texts += size
+        self._last_batch = size
+        self._max_seen = max(self._max_seen, size)
+        self._wait_s_total += sum(started - item.enqueued_at for item in batch)
+        # Power-of-two buckets: 1, 2, 4, ... max_batch and above
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        self._size_hist[bucket] = self._size_hist.get(bucket, 0) + 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._stats_lock:
+            return {
+                "window_ms": self.window_s * 1000.0,
+                "max_batch": self.max_batch,
+                "queue_depth": self._queue.qsize(),
+                "queued_texts": self._queued_texts,
+                "batches": self._batches,
+                "requests": self._requests,
+                "texts": self._texts,
+                "last_batch_size": self._last_batch,
+                "max_batch_size": self._max_seen,
+                "avg_batch_size": (self._texts / self._batches) if self._batches else 0.0,
+                "avg_queue_wait_ms": (self._wait_s_total / self._requests * 1000.0) if self._requests else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._size_hist.items())},
+            }
+
+
+_batcher: Optional[MicroBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> MicroBatcher:
+    global _batcher
+    if _batcher is not None:
+        return _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            try:
+                window_ms = float(os.getenv("ALLIE_BATCH_WINDOW_MS", "5"))
+            except ValueError:
+                window_ms = 5.0
+            try:
+                max_batch = int(os.getenv("ALLIE_BATCH_MAX_SIZE", "64"))
+            except ValueError:
+                max_batch = 64
+            _batcher = MicroBatcher(window_ms=window_ms, max_batch=max_batch)
+            queue_gauge("batcher", _batcher._queue.qsize)
+    return _batcher
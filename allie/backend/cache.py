@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+
+class SimilarCache:
+    """
+    LRU cache with a TTL for `/similar` result lists.
+
+    Besides the key -> results map it keeps a reverse index of every video id
+    that appears in a cached entry (as seed or as a result), so `/ingest` can
+    drop exactly the entries a rewritten video could have changed. Entries
+    that a newly ingested video *would* now rank into are only refreshed by
+    the TTL.
+
+    A query that was running while `invalidate` ran may have read the old
+    rows, so callers read `generation` before the query and pass it to
+    `put`, which drops the write if any invalidation happened since.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, List[Dict[str, Any]], Set[str]]]" = OrderedDict()
+        self._refs: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+        self.generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def get(self, key: Hashable) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(
+        self, key: Hashable, seed_id: str, results: List[Dict[str, Any]], generation: Optional[int] = None
+    ) -> None:
+        if not self.enabled:
+            return
+        ids = {seed_id, *(r["video_id"] for r in results)}
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stale_puts += 1
+                return
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, results, ids)
+            for vid in ids:
+                self._refs.setdefault(vid, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def invalidate(self, video_ids: Iterable[str]) -> int:
+        video_ids = list(video_ids)
+        if not video_ids:
+            return 0
+        dropped = 0
+        with self._lock:
+            self.generation += 1
+            for vid in video_ids:
+                for key in list(self._refs.get(vid, ())):
+                    self._drop(key)
+                    dropped += 1
+            self.invalidations += dropped
+        return dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+            self._refs.clear()
+
+    def _drop(self, key: Hashable) -> None:
+        _, _, ids = self._data.pop(key)
+        for vid in ids:
+            keys = self._refs.get(vid)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._refs[vid]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "stale_puts": self.stale_puts,
+            }
+
+
+_similar_cache: Optional[SimilarCache] = None
+_similar_cache_lock = threading.Lock()
+
+
+def get_similar_cache() -> SimilarCache:
+    global _similar_cache
+    if _similar_cache is not None:
+        return _similar_cache
+    with _similar_cache_lock:
+        if _similar_cache is None:
+            try:
+                size = int(os.getenv("ALLIE_SIMILAR_CACHE_SIZE", "10000"))
+            except ValueError:
+                size = 10000
+            try:
+                ttl = float(os.getenv("ALLIE_SIMILAR_CACHE_TTL", "300"))
+            except ValueError:
+                ttl = 300.0
+            _similar_cache = SimilarCache(maxsize=size, ttl=ttl)
+    return _similar_cache
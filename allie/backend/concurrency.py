@@ -0,0 +1,113 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from fastapi import HTTPException
+
+
+T = TypeVar("T")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class Admission:
+    """
+    Bounded admission for one class of requests.
+
+    Up to `limit` requests run at once and up to `max_waiting` more queue;
+    anything beyond that is rejected immediately with 503 so a backlog of one
+    kind of work (embedding) can't occupy the whole server.
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)
+        self._sem = asyncio.Semaphore(self.limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def __aenter__(self) -> "Admission":
+        if self._sem.locked():
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{self.name} capacity exhausted; retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self.waiting += 1
+            try:
+                await self._sem.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._sem.acquire()
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.in_flight -= 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "rejected": self.rejected,
+        }
+
+
+# Embedding requests get a small slice of the server; similarity lookups are
+# sized to the DB pool. /healthz and /model info are never gated.
+encode_admission = Admission(
+    "encode",
+    _env_int("ALLIE_ENCODE_CONCURRENCY", 32),
+    _env_int("ALLIE_ENCODE_QUEUE", 64),
+)
+similar_admission = Admission(
+    "similar",
+    _env_int("ALLIE_SIMILAR_CONCURRENCY", 64),
+    _env_int("ALLIE_SIMILAR_QUEUE", 256),
+)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_encode_executor() -> ThreadPoolExecutor:
+    """Dedicated threads for model work, separate from Starlette's default pool."""
+    global _executor
+    if _executor is not None:
+        return _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, _env_int("ALLIE_ENCODE_WORKERS", 2)),
+                thread_name_prefix="allie-encode",
+            )
+    return _executor
+
+
+async def run_encode(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_encode_executor(), lambda: fn(*args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -1,5 +1,23 @@
 import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import numpy as np
 import psycopg
+from pgvector.psycopg import register_vector, register_vector_async
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+from instrumentation import in_flight_gauge, observe_span, queue_gauge
+
+
+# Sync pool: background threads (micro-batcher, embedding cache, index
+# reload). Async pool: request handlers on the event loop.
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+_async_pool: Optional[AsyncConnectionPool] = None
 
 
 def _get_db_url() -> str:
@@ -15,8 +33,205 @@ def _get_db_url() -> str:
     return url
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _split_pgbouncer_flag(url: str) -> tuple[str, bool]:
+    """
+    Strips the Prisma/Supabase-style `pgbouncer=true` query flag, which libpq
+    rejects, and reports whether the URL points at a transaction pooler.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    flag = any(k == "pgbouncer" and v.lower() in ("1", "true") for k, v in query)
+    query = [(k, v) for k, v in query if k != "pgbouncer"]
+    behind_pooler = flag or parts.port == 6543  # Supabase/Supavisor transaction mode
+    env = os.getenv("ALLIE_DB_PGBOUNCER")
+    if env is not None:
+        behind_pooler = env.lower() in ("1", "true", "yes")
+    return urlunsplit(parts._replace(query=urlencode(query))), behind_pooler
+
+
+def _connect_kwargs(behind_pooler: bool) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"autocommit": False}
+    if behind_pooler:
+        # Transaction poolers hand each transaction to a different server
+        # backend, so server-side prepared statements can't be reused
+        kwargs["prepare_threshold"] = None
+    elif os.getenv("ALLIE_DB_PREPARE_THRESHOLD"):
+        kwargs["prepare_threshold"] = _env_int("ALLIE_DB_PREPARE_THRESHOLD", 5)
+    return kwargs
+
+
+def _configure(conn: psycopg.Connection) -> None:
+    # Send/receive `vector` columns as binary float32 and accept NumPy arrays
+    # as parameters directly, instead of formatting "[0.1,...]" strings
+    register_vector(conn)
+    conn.commit()
+
+
+async def _configure_async(conn: psycopg.AsyncConnection) -> None:
+    await register_vector_async(conn)
+    await conn.commit()
+
+
+def to_array(value: Any) -> np.ndarray:
+    """Converts a loaded pgvector value to a float32 NumPy array."""
+    if hasattr(value, "to_numpy"):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
+
+
+def pool_enabled() -> bool:
+    return os.getenv("ALLIE_DB_POOL", "1").lower() not in ("0", "false", "no")
+
+
+def _pool_kwargs(behind_pooler: bool) -> Dict[str, Any]:
+    return dict(
+        min_size=_env_int("ALLIE_DB_POOL_MIN", 1),
+        max_size=_env_int("ALLIE_DB_POOL_MAX", 10),
+        max_idle=_env_float("ALLIE_DB_POOL_MAX_IDLE", 300.0),
+        max_lifetime=_env_float("ALLIE_DB_POOL_MAX_LIFETIME", 3600.0),
+        timeout=_env_float("ALLIE_DB_POOL_TIMEOUT", 30.0),
+        kwargs=_connect_kwargs(behind_pooler),
+        open=False,
+    )
+
+
+def _pool_gauges(name: str, pool: Any) -> None:
+    # Read at scrape time only
+    def in_use() -> int:
+        stats = pool.get_stats()
+        return stats.get("pool_size", 0) - stats.get("pool_available", 0)
+
+    queue_gauge(name, lambda: pool.get_stats().get("requests_waiting", 0))
+    in_flight_gauge(name, in_use)
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            url, behind_pooler = _split_pgbouncer_flag(_get_db_url())
+            pool = ConnectionPool(
+                url,
+                configure=_configure,
+                # Cheap round trip on checkout so dropped connections are
+                # replaced instead of failing the request
+                check=ConnectionPool.check_connection,
+                name="allie",
+                **_pool_kwargs(behind_pooler),
+            )
+            pool.open(wait=False)
+            _pool_gauges("db_workers", pool)
+            _pool = pool
+    return _pool
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    # Only ever touched from the event loop thread, so no lock is needed
+    global _async_pool
+    if _async_pool is None:
+        url, behind_pooler = _split_pgbouncer_flag(_get_db_url())
+        pool = AsyncConnectionPool(
+            url,
+            configure=_configure_async,
+            check=AsyncConnectionPool.check_connection,
+            name="allie-async",
+            **_pool_kwargs(behind_pooler),
+        )
+        await pool.open(wait=False)
+        _pool_gauges("db_requests", pool)
+        _async_pool = pool
+    return _async_pool
+
+
+@contextmanager
+def _direct_conn() -> Iterator[psycopg.Connection]:
+    url, behind_pooler = _split_pgbouncer_flag(_get_db_url())
+    with psycopg.connect(url, **_connect_kwargs(behind_pooler)) as conn:
+        _configure(conn)
+        yield conn
+
+
 def get_conn():
-    # Open a short-lived connection per request for cloud DBs/poolers
-    url = _get_db_url()
-    return psycopg.connect(url, autocommit=False)
+    """
+    Context manager yielding a connection that commits on clean exit.
+
+    Connections come from a process-wide pool unless ALLIE_DB_POOL=0, in
+    which case a short-lived connection is opened per call.
+    """
+    if not pool_enabled():
+        return _direct_conn()
+    return get_pool().connection()
+
+
+@asynccontextmanager
+async def _direct_async_conn() -> AsyncIterator[psycopg.AsyncConnection]:
+    url, behind_pooler = _split_pgbouncer_flag(_get_db_url())
+    async with await psycopg.AsyncConnection.connect(url, **_connect_kwargs(behind_pooler)) as conn:
+        await _configure_async(conn)
+        yield conn
+
+
+@asynccontextmanager
+async def get_async_conn() -> AsyncIterator[psycopg.AsyncConnection]:
+    """Async counterpart of `get_conn()` for request handlers."""
+    started = time.perf_counter()
+    if not pool_enabled():
+        async with _direct_async_conn() as conn:
+            observe_span("db_connect", time.perf_counter() - started)
+            yield conn
+        return
+    pool = await get_async_pool()
+    # Time spent waiting for a pooled connection (or opening one)
+    async with pool.connection() as conn:
+        observe_span("db_connect", time.perf_counter() - started)
+        yield conn
+
+
+def _stats(pool: Any) -> Optional[Dict[str, Any]]:
+    if pool is None:
+        return None
+    stats = pool.get_stats()
+    size = stats.get("pool_size", 0)
+    available = stats.get("pool_available", 0)
+    in_use = size - available
+    return {
+        "size": size,
+        "available": available,
+        "in_use": in_use,
+        "min": pool.min_size,
+        "max": pool.max_size,
+        "waiting": stats.get("requests_waiting", 0),
+        "saturation": round(in_use / pool.max_size, 3) if pool.max_size else 0.0,
+    }
+
+
+def pool_stats() -> Dict[str, Optional[Dict[str, Any]]]:
+    # None for a pool that hasn't been opened yet
+    return {"requests": _stats(_async_pool), "workers": _stats(_pool)}
+
 
+async def close_pool() -> None:
+    global _pool, _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import psycopg
+
+from .database import get_conn, to_array
+from .model import embed_texts, get_backend_name, get_max_seq_length, get_model_name
+
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    # Whitespace-only edits to a transcript shouldn't cost a re-encode
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text: str, model_name: str, max_seq_length: int, backend: str) -> bytes:
+    # The backend name carries its quantization (`torch-int8`, `onnx-int8`),
+    # whose vectors differ slightly from the fp32 ones
+    h = hashlib.sha256()
+    h.update(f"{model_name}\0{max_seq_length}\0{backend}\0".encode("utf-8"))
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.digest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store in the `embedding_cache` table.
+
+    Lookups touch `last_used` in the same statement; every `evict_every`
+    stores, rows beyond `max_rows` are deleted least-recently-used first.
+    DB errors never fail an ingest: the affected call just encodes
+    everything, and a missing table or DB URL disables the cache for the
+    process.
+    """
+
+    def __init__(self, max_rows: int = 200000, evict_every: int = 500, enabled: bool = True):
+        self.max_rows = max_rows
+        self.evict_every = max(1, evict_every)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._since_evict = 0
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def _on_error(self, exc: Exception) -> None:
+        self.errors += 1
+        if isinstance(exc, (psycopg.errors.UndefinedTable, RuntimeError)):
+            if self.enabled:
+                logging.warning("Embedding cache disabled: %s", exc)
+            self.enabled = False
+        else:
+            logging.warning("Embedding cache unavailable for this call: %s", exc)
+
+    def lookup(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        if not self.enabled or not keys:
+            return {}
+        try:
+            with get_conn() as conn, conn.cursor(binary=True) as cur:
+                cur.execute(
+                    "update embedding_cache set last_used=now() where key = any(%s) returning key, embedding",
+                    (keys,),
+                )
+                found = {bytes(k): to_array(v) for k, v in cur.fetchall()}
+        except (psycopg.Error, RuntimeError) as exc:
+            self._on_error(exc)
+            return {}
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, keys: List[bytes], model_name: str, embs: List[np.ndarray]) -> None:
+        if not self.enabled or not keys:
+            return
+        with self._lock:
+            self._since_evict += len(keys)
+            evict = self._since_evict >= self.evict_every
+            if evict:
+                self._since_evict = 0
+        try:
+            with get_conn() as conn, conn.cursor() as cur:
+                cur.execute("""
+                  insert into embedding_cache (key, model, embedding)
+                  select * from unnest(%s::bytea[], %s::text[], %s::vector[])
+                  on conflict (key) do update set last_used=now()
+                """, (keys, [model_name] * len(keys), embs))
+                evicted = 0
+                if evict and self.max_rows > 0:
+                    cur.execute("""
+                      delete from embedding_cache where key in (
+                        select key from embedding_cache order by last_used desc offset %s
+                      )
+                    """, (self.max_rows,))
+                    evicted = cur.rowcount
+        except (psycopg.Error, RuntimeError) as exc:
+            self._on_error(exc)
+            return
+        with self._lock:
+            self.stored += len(keys)
+            self.evicted += max(0, evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "max_rows": self.max_rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stored": self.stored,
+                "evicted": self.evicted,
+                "errors": self.errors,
+            }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                max_rows = int(os.getenv("ALLIE_EMBED_CACHE_MAX_ROWS", "200000"))
+            except ValueError:
+                max_rows = 200000
+            enabled = os.getenv("ALLIE_EMBED_CACHE", "1").lower() not in ("0", "false", "no")
+            _cache = EmbeddingCache(max_rows=max_rows, enabled=enabled)
+    return _cache
+
+
+def cached_embed_texts(texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+    """
+    Drop-in for `embed_texts` that only encodes texts missing from the cache.
+    Identical texts within one call are encoded once.
+    """
+    cache = get_embedding_cache()
+    if not cache.enabled or not texts:
+        return embed_texts(texts, batch_size=batch_size)
+
+    max_len = get_max_seq_length()
+    model_name = get_model_name()
+    backend = get_backend_name()
+    keys = [cache_key(t, model_name, max_len, backend) for t in texts]
+    found = cache.lookup(list(dict.fromkeys(keys)))
+
+    todo: Dict[bytes, str] = {}
+    for k, t in zip(keys, texts):
+        if k not in found and k not in todo:
+            todo[k] = t
+    if todo:
+        fresh = embed_texts(list(todo.values()), batch_size=batch_size)
+        new_keys = list(todo.keys())
+        new_embs = list(fresh)
+        found.update(zip(new_keys, new_embs))
+        cache.store(new_keys, model_name, new_embs)
+
+    return np.stack([found[k] for k in keys]).astype(np.float32, copy=False)
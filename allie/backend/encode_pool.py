@@ -0,0 +1,401 @@
+"""
+Multi-process embedding pool, enabled with ALLIE_EMBED_PROCS.
+
+One encode call only keeps a few cores busy, and more uvicorn workers each
+hold their own copy of the model. With ALLIE_EMBED_PROCS=N, `embed_texts`
+instead splits each call into length-sorted shards and hands them to N
+worker processes, longest first, with each idle worker taking the next
+shard.
+
+- Workers are spawned, never forked, so starting or replacing one is safe
+  while this process runs other threads, and this process never loads the
+  model itself.
+- Weights are held once and shared read-only. Each `torch` worker swaps its
+  parameters for tensors mmapped from a cached state dict (see
+  `backends._shared_weights`; the first worker writes it). Each `onnx`
+  worker loads a copy of the graph whose weights sit in one external data
+  file (see `backends.shared_onnx_model`), which ONNX Runtime mmaps. Either
+  way every worker maps the same page-cache pages.
+- Each worker runs ALLIE_EMBED_PROC_THREADS intra-op threads (default: cores
+  / N). When there are enough cores, each worker is also pinned to its own
+  disjoint set of CPUs.
+- Results are not pickled. Every worker writes its float32 rows into its
+  own shared-memory buffer, and the caller copies them once into the
+  returned array. A buffer is reused by the worker's next shard, so
+  handing out views of it would let cached rows change under callers.
+"""
+import atexit
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Loading a model from a cold disk can take a while
+_START_TIMEOUT_S = 300.0
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def pool_size() -> int:
+    return max(0, _env_int("ALLIE_EMBED_PROCS", 0))
+
+
+def _cpu_sets(procs: int, threads: int) -> List[Optional[List[int]]]:
+    # Pinning only helps when every worker can get cores of its own
+    if os.getenv("ALLIE_EMBED_PIN", "1").lower() in ("0", "false", "no"):
+        return [None] * procs
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return [None] * procs
+    if len(cpus) < procs * threads:
+        return [None] * procs
+    return [cpus[i * threads:(i + 1) * threads] for i in range(procs)]
+
+
+def _load_model() -> Any:
+    from .model import _init_model
+
+    return _init_model()
+
+
+def _serve(conn, backend: str, env: Dict[str, str], threads: int, cpus: Optional[List[int]], max_rows: int) -> None:
+    """Worker process: load the model, then encode shards until told to stop."""
+    os.environ.update(env)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+    try:
+        if backend.startswith("torch"):
+            import torch
+
+            torch.set_num_threads(threads)
+        model = _load_model()
+        warm = np.asarray(model.encode(["warmup"], batch_size=1, normalize_embeddings=True))
+        conn.send(("ready", int(warm.shape[-1]), int(getattr(model, "max_seq_length", 0) or 0)))
+    except Exception as exc:
+        conn.send(("error", f"{type(exc).__name__}: {exc}"))
+        return
+    shm = SharedMemory(name=conn.recv())
+    out = np.ndarray((max_rows, warm.shape[-1]), dtype=np.float32, buffer=shm.buf)
+    try:
+        while True:
+            try:
+                msg = conn.recv()
+            except EOFError:
+                break
+            if msg is None:
+                break
+            texts, batch_size = msg
+            try:
+                emb = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+                out[:len(texts)] = emb
+                conn.send(("ok", len(texts)))
+            except Exception as exc:
+                conn.send(("error", f"{type(exc).__name__}: {exc}"))
+    finally:
+        del out
+        shm.close()
+
+
+class _Worker:
+    __slots__ = ("slot", "process", "conn", "shm", "out")
+
+    def __init__(self, slot: int, process: Any, conn: Any):
+        self.slot = slot
+        self.process = process
+        self.conn = conn
+        self.shm: Optional[SharedMemory] = None
+        self.out: Optional[np.ndarray] = None
+
+
+class EncodePool:
+    """
+    N worker processes that each encode one shard at a time.
+
+    `encode()` is safe to call from several threads: shards from concurrent
+    calls queue for the same idle workers. A worker that dies is replaced,
+    and the call that lost the shard raises RuntimeError.
+    """
+
+    def __init__(self, backend: str, model_name: str, procs: int, threads: int = 0, max_rows: int = 256):
+        self.backend = backend
+        self.model_name = model_name
+        self.procs = max(1, procs)
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        self.threads = threads if threads > 0 else max(1, cores // self.procs)
+        self.max_rows = max(1, max_rows)
+        self.dim = 0
+        self.max_seq_length = 0
+        self._cpus = _cpu_sets(self.procs, self.threads)
+        self._env: Dict[str, str] = {"TOKENIZERS_PARALLELISM": "false", "RAYON_NUM_THREADS": str(self.threads)}
+        self._ctx: Any = None
+        self._workers: List[_Worker] = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._started = False
+        self._closed = False
+        self.calls = 0
+        self.shards = 0
+        self.texts = 0
+        self.errors = 0
+        self.restarts = 0
+        self.start_s: Optional[float] = None
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    def _prepare(self) -> None:
+        from . import backends
+
+        if self.backend.startswith("torch"):
+            self._env.update({
+                "ALLIE_TORCH_SHARED_STATE": backends.shared_torch_state(self.model_name),
+                "OMP_NUM_THREADS": str(self.threads),
+                "MKL_NUM_THREADS": str(self.threads),
+            })
+        else:
+            root, path = backends.shared_onnx_model(self.backend, self.model_name)
+            self._env.update({
+                "ALLIE_EMBED_MODEL": root,
+                "ALLIE_ONNX_PATH": path,
+                "ALLIE_ONNX_THREADS": str(self.threads),
+                "ALLIE_ONNX_PREPACK": "0",
+            })
+        self._ctx = mp.get_context("spawn")
+        # Workers must register the shared buffers with this tracker, not
+        # start their own that would unlink them when the worker exits
+        resource_tracker.ensure_running()
+
+    def _spawn(self, slot: int) -> _Worker:
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_serve,
+            args=(child, self.backend, self._env, self.threads, self._cpus[slot], self.max_rows),
+            name=f"allie-embed-{slot}",
+            daemon=True,
+        )
+        process.start()
+        # Only the worker may hold this end, or its exit would never read as EOF
+        child.close()
+        return _Worker(slot, process, parent)
+
+    def _attach(self, worker: _Worker) -> None:
+        if not worker.conn.poll(_START_TIMEOUT_S):
+            raise RuntimeError(f"embedding worker {worker.slot} did not start")
+        try:
+            msg = worker.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"embedding worker {worker.slot} exited during startup") from None
+        if msg[0] != "ready":
+            raise RuntimeError(f"embedding worker {worker.slot} failed to load the model: {msg[1]}")
+        self.dim, self.max_seq_length = msg[1], msg[2]
+        if worker.shm is None:
+            worker.shm = SharedMemory(create=True, size=self.max_rows * self.dim * 4)
+            worker.out = np.ndarray((self.max_rows, self.dim), dtype=np.float32, buffer=worker.shm.buf)
+        worker.conn.send(worker.shm.name)
+
+    def start(self) -> None:
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            if self._closed:
+                raise RuntimeError("embedding pool is closed")
+            started = time.perf_counter()
+            self._prepare()
+            workers = [self._spawn(0)]
+            try:
+                # The first worker writes the shared torch state dict if it
+                # is missing; the rest then load concurrently and map it
+                self._attach(workers[0])
+                workers += [self._spawn(slot) for slot in range(1, self.procs)]
+                for worker in workers[1:]:
+                    self._attach(worker)
+            except Exception:
+                self._workers = workers
+                self._shutdown()
+                raise
+            self._workers = workers
+            for worker in workers:
+                self._idle.put(worker)
+            self._started = True
+            self.start_s = time.perf_counter() - started
+            logger.info(
+                "Started %d embedding workers (%s, %d threads each) in %.2fs",
+                self.procs, self.backend, self.threads, self.start_s,
+            )
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.conn.close()
+        worker.process.join(timeout=1)
+        if worker.process.is_alive():
+            worker.process.kill()
+        fresh = self._spawn(worker.slot)
+        fresh.shm, fresh.out = worker.shm, worker.out
+        with self._stats_lock:
+            self.restarts += 1
+        try:
+            self._attach(fresh)
+        except Exception:
+            logger.exception("Could not restart embedding worker %d", worker.slot)
+            return
+        self._workers[worker.slot] = fresh
+        self._idle.put(fresh)
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """(n, d) float32 L2-normalized embeddings, in the order of `texts`."""
+        self.start()
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+        # Small enough that every worker gets a share, and that faster
+        # workers pick up the slack
+        size = min(self.max_rows, batch_size, -(-len(texts) // self.procs))
+        pending = [order[i:i + size] for i in range(0, len(order), size)]
+        pending.reverse()
+        inflight: Dict[Any, Tuple[_Worker, List[int]]] = {}
+        failure: Optional[str] = None
+
+        while pending or inflight:
+            while pending and failure is None:
+                try:
+                    # Only block on the shared queue when none of our shards can wake us
+                    worker = self._idle.get(block=not inflight, timeout=None if inflight else 1.0)
+                except queue.Empty:
+                    if not inflight and not any(w.process.is_alive() for w in self._workers):
+                        failure = "no embedding workers are running"
+                    break
+                shard = pending.pop()
+                try:
+                    worker.conn.send(([texts[i] for i in shard], batch_size))
+                except (OSError, ValueError):
+                    failure = f"embedding worker {worker.slot} is gone"
+                    self._replace(worker)
+                    continue
+                inflight[worker.conn] = (worker, shard)
+            if failure is not None:
+                pending.clear()
+            if not inflight:
+                continue
+            for conn in wait(list(inflight)):
+                worker, shard = inflight.pop(conn)
+                try:
+                    msg = conn.recv()
+                except (EOFError, OSError):
+                    failure = f"embedding worker {worker.slot} exited"
+                    self._replace(worker)
+                    continue
+                if msg[0] == "ok":
+                    out[shard] = worker.out[:len(shard)]
+                else:
+                    failure = msg[1]
+                self._idle.put(worker)
+
+        with self._stats_lock:
+            self.calls += 1
+            self.texts += len(texts)
+            self.shards += -(-len(texts) // size)
+            if failure is not None:
+                self.errors += 1
+        if failure is not None:
+            raise RuntimeError(failure)
+        return out
+
+    def _shutdown(self) -> None:
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join(timeout=1)
+            worker.conn.close()
+            if worker.shm is not None:
+                worker.out = None
+                worker.shm.close()
+                worker.shm.unlink()
+        self._workers = []
+        self._idle = queue.Queue()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._started = False
+            self._shutdown()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "procs": self.procs,
+                "threads_per_proc": self.threads,
+                "pinned": self._cpus[0] is not None,
+                "started": self._started,
+                "alive": sum(1 for w in self._workers if w.process.is_alive()),
+                "idle": self._idle.qsize(),
+                "start_s": round(self.start_s, 3) if self.start_s is not None else None,
+                "calls": self.calls,
+                "shards": self.shards,
+                "texts": self.texts,
+                "errors": self.errors,
+                "restarts": self.restarts,
+            }
+
+
+_pool: Optional[EncodePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[EncodePool]:
+    """The process-wide pool, or None when ALLIE_EMBED_PROCS is unset or 0."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    procs = pool_size()
+    if procs <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            from .model import get_backend_name, get_model_name
+
+            _pool = EncodePool(
+                get_backend_name(),
+                get_model_name(),
+                procs,
+                threads=_env_int("ALLIE_EMBED_PROC_THREADS", 0),
+                max_rows=_env_int("ALLIE_EMBED_PROC_MAX_ROWS", 256),
+            )
+            atexit.register(_pool.close)
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,61 @@
+"""
+Gunicorn settings for running the Allie API with several pre-forked workers.
+
+    gunicorn -c allie/backend/gunicorn_conf.py allie.backend.app:app
+
+The master imports the app and, before forking, prepares the model
+(`startup.preload_for_fork`). With the `torch` backends it loads the weights
+once and workers share them copy-on-write; each worker then only runs its
+warmup encode before `/readyz` passes. With the `onnx` backends, or when
+ALLIE_EMBED_PROCS runs the model in `encode_pool` workers, the master only
+fetches the model files: ONNX Runtime sessions do not survive `fork()`, and
+pool workers are spawned and map the weights from a shared file instead.
+uvicorn's own `--workers` spawns fresh interpreters and cannot share memory
+through fork.
+
+Env: ALLIE_WORKERS (default 2), PORT (default 8000), ALLIE_PREFORK_PRELOAD
+(set to 0 to skip the master preload), PROMETHEUS_MULTIPROC_DIR (see
+`instrumentation`; the files of workers that exit are cleaned up here).
+"""
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+bind = f"0.0.0.0:{_env_int('PORT', 8000)}"
+workers = _env_int("ALLIE_WORKERS", 2)
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Loading a model can take a while on a cold disk
+timeout = 120
+
+# Workers warm up before reporting ready, unless told otherwise
+os.environ.setdefault("ALLIE_STARTUP", "preload")
+
+
+# Hooks import lazily: the config file is read before the app's directory is
+# on sys.path, while the hooks run after preload_app has imported the app
+def on_starting(server):
+    if os.getenv("ALLIE_PREFORK_PRELOAD", "1").lower() not in ("0", "false", "no"):
+        from allie.backend import startup
+
+        startup.preload_for_fork()
+
+
+def post_fork(server, worker):
+    from allie.backend import startup
+
+    startup.after_fork()
+
+
+def child_exit(server, worker):
+    # A dead worker's livesum gauge files would otherwise keep counting
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
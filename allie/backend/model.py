@@ -1,17 +1,26 @@
 import os
 import threading
-from typing import Optional, List
+from typing import Any, Optional, List
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from instrumentation import observe_batch, span
+
+from .backends import load_backend
+from .encode_pool import get_pool
 
 
 _lock = threading.Lock()
-_model: Optional[SentenceTransformer] = None
+_model: Optional[Any] = None
 _model_name: Optional[str] = None
 
 
-def _init_model() -> SentenceTransformer:
+def get_backend_name() -> str:
+    # torch (default), torch-int8, onnx or onnx-int8; see backends.py
+    return os.getenv("ALLIE_BACKEND", "torch").lower()
+
+
+def _init_model() -> Any:
     global _model, _model_name
     if _model is not None:
         return _model
@@ -19,13 +28,15 @@ def _init_model() -> SentenceTransformer:
         if _model is None:
             _model_name = os.getenv("ALLIE_EMBED_MODEL", "BAAI/bge-small-en-v1.5")
             device = os.getenv("ALLIE_DEVICE")  # e.g., 'cpu', 'cuda', 'mps'
-            _model = SentenceTransformer(_model_name, device=device)
+            model = load_backend(get_backend_name(), _model_name, device=device)
             max_len = os.getenv("ALLIE_MAX_SEQ_LENGTH")
             if max_len:
                 try:
-                    _model.max_seq_length = int(max_len)
+                    model.max_seq_length = int(max_len)
                 except ValueError:
                     pass
+            # Publish only once configured; readers check `_model` without the lock
+            _model = model
     return _model
 
 
@@ -39,6 +50,10 @@ def get_model_name() -> str:
 
 
 def get_embed_dim() -> int:
+    pool = get_pool()
+    if pool is not None:
+        pool.start()
+        return pool.dim
     model = _init_model()
     try:
         return model.get_sentence_embedding_dimension()
@@ -50,16 +65,61 @@ def get_embed_dim() -> int:
         return int(v.shape[-1])
 
 
+def get_max_seq_length() -> int:
+    # Part of the embedding cache key: text past this many tokens is dropped
+    pool = get_pool()
+    if pool is not None:
+        pool.start()
+        return pool.max_seq_length
+    return int(getattr(_init_model(), "max_seq_length", 0) or 0)
+
+
+def is_loaded() -> bool:
+    pool = get_pool()
+    if pool is not None:
+        return pool.started
+    return _model is not None
+
+
 def warmup() -> None:
-    _ = _init_model()
+    # A real forward pass, so lazy kernels/allocations are paid before traffic;
+    # pool workers each run one before reporting ready
+    pool = get_pool()
+    if pool is not None:
+        pool.start()
+        return
+    _init_model().encode(["warmup"], batch_size=1, normalize_embeddings=True)
+
+
+def get_batch_size() -> int:
+    # Texts per forward pass; sentence-transformers defaults to 32
+    try:
+        return max(1, int(os.getenv("ALLIE_EMBED_BATCH_SIZE", "32")))
+    except ValueError:
+        return 32
 
 
-def embed_texts(texts: List[str]) -> np.ndarray:
+def embed_texts(texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
     """
     Returns an array of shape (n, d) with float32 dtype and L2-normalized rows.
+
+    `batch_size` caps how many texts go through one forward pass; defaults to
+    ALLIE_EMBED_BATCH_SIZE. With ALLIE_EMBED_PROCS set, the texts are sharded
+    across the worker processes of `encode_pool`.
     """
+    pool = get_pool()
+    if pool is not None:
+        observe_batch("encode", len(texts))
+        with span("encode"):
+            return pool.encode(texts, batch_size or get_batch_size())
     model = _init_model()
-    emb = model.encode(texts, normalize_embeddings=True)
+    observe_batch("encode", len(texts))
+    with span("encode"):
+        emb = model.encode(
+            texts,
+            batch_size=batch_size or get_batch_size(),
+            normalize_embeddings=True,
+        )
     # Ensure float32 for DB/vector extension compatibility and memory footprint
     emb = np.asarray(emb, dtype=np.float32)
     return emb
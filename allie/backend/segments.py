@@ -0,0 +1,158 @@
+"""
+Long transcripts as overlapping token windows.
+
+The encoder drops everything past `max_seq_length` tokens, so a single
+vector per transcript only covers the first few minutes of a long lecture.
+`split()` tokenizes the whole transcript once and cuts it into windows of
+ALLIE_SEGMENT_TOKENS tokens, with consecutive windows overlapping by
+ALLIE_SEGMENT_OVERLAP tokens. Each window keeps the start and end time of
+the captions it covers. The windows of all videos are encoded together and
+stored in `video_segments`. A video's own vector is the token-weighted
+mean of its windows (`pool_vectors`). A transcript that fits in one window
+yields one segment with the same vector as before.
+
+Off unless ALLIE_SEGMENTS=1: it needs the `video_segments` table, and
+pooled vectors of long transcripts are not comparable with single-pass
+vectors already stored, so existing videos must be re-ingested.
+"""
+import bisect
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .backends import load_tokenizer
+from .embed_cache import cached_embed_texts
+from .model import get_max_seq_length, get_model_name
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def segments_enabled() -> bool:
+    return os.getenv("ALLIE_SEGMENTS", "0").lower() in ("1", "true", "yes")
+
+
+@dataclass
+class Segment:
+    seg_no: int
+    text: str
+    start_s: Optional[float]
+    end_s: Optional[float]
+    tokens: int
+
+
+_lock = threading.Lock()
+_tokenizer: Any = None
+_tokenizer_failed = False
+_WORD = re.compile(r"\S+")
+
+
+def _get_tokenizer() -> Any:
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is not None or _tokenizer_failed:
+        return _tokenizer
+    with _lock:
+        if _tokenizer is None and not _tokenizer_failed:
+            try:
+                _tokenizer = load_tokenizer(get_model_name())
+            except Exception:
+                logging.warning("No tokenizer.json for %s; segmenting by words", get_model_name(), exc_info=True)
+                _tokenizer_failed = True
+    return _tokenizer
+
+
+def window_tokens() -> int:
+    # Room for the [CLS]/[SEP] the encoder adds, so no window is truncated
+    window = _env_int("ALLIE_SEGMENT_TOKENS", 256)
+    max_len = get_max_seq_length()
+    if max_len:
+        window = min(window, max_len - 2)
+    return max(16, window)
+
+
+def _spans(text: str, tokenizer: Any) -> List[Tuple[int, int]]:
+    """Character span of every token in `text`."""
+    if tokenizer is None:
+        # Roughly 4 tokens per 3 English words; keep word windows inside the limit
+        return [m.span() for m in _WORD.finditer(text)]
+    return [o for o in tokenizer.encode(text, add_special_tokens=False).offsets if o[1] > o[0]]
+
+
+def split(transcript: str, cues: Optional[Sequence[Any]] = None) -> List[Segment]:
+    """
+    Overlapping windows over `cues` (objects with `text`, `start` and
+    `duration`, as returned by `ingest_youtube.fetch_segments`) or, without
+    cues, over `transcript` (no timestamps then).
+    """
+    if cues:
+        parts = [(" ".join(c.text.split()), c.start, c.start + (c.duration or 0.0)) for c in cues]
+        parts = [p for p in parts if p[0]]
+    else:
+        parts = [(transcript, None, None)]
+    # One string for the tokenizer; cue_at[i] is where cue i starts in it
+    text = " ".join(p[0] for p in parts)
+    cue_at: List[int] = []
+    pos = 0
+    for part, _, _ in parts:
+        cue_at.append(pos)
+        pos += len(part) + 1
+
+    tokenizer = _get_tokenizer()
+    spans = _spans(text, tokenizer)
+    if not spans:
+        return [Segment(0, transcript, None, None, 0)]
+    window = window_tokens()
+    if tokenizer is None:
+        window = max(12, window * 3 // 4)
+    step = window - min(max(0, _env_int("ALLIE_SEGMENT_OVERLAP", 32)), window // 2)
+
+    def cue(char: int) -> Tuple[str, Optional[float], Optional[float]]:
+        return parts[bisect.bisect_right(cue_at, char) - 1]
+
+    out: List[Segment] = []
+    for i in range(0, len(spans), step):
+        j = min(i + window, len(spans))
+        first, last = spans[i][0], spans[j - 1][1]
+        out.append(Segment(len(out), text[first:last], cue(first)[1], cue(last - 1)[2], j - i))
+        if j == len(spans):
+            break
+    return out
+
+
+def pool_vectors(emb: np.ndarray, segments: List[Segment]) -> np.ndarray:
+    """Token-weighted mean of a video's window vectors, L2-normalized."""
+    if len(segments) == 1:
+        return np.asarray(emb[0], dtype=np.float32)
+    weights = np.array([max(1, s.tokens) for s in segments], dtype=np.float32)
+    vec = (emb * weights[:, None]).sum(axis=0)
+    vec /= max(float(np.linalg.norm(vec)), 1e-12)
+    return vec.astype(np.float32)
+
+
+def embed_segments(
+    videos: List[Tuple[str, Optional[Sequence[Any]]]], batch_size: Optional[int] = None
+) -> List[Tuple[List[Segment], np.ndarray, np.ndarray]]:
+    """
+    Splits every `(transcript, cues)` pair and encodes all windows in one
+    call. Returns, per video, its segments, their (n, d) vectors and the
+    pooled video vector.
+    """
+    split_videos = [split(transcript, cues) for transcript, cues in videos]
+    texts = [s.text for segs in split_videos for s in segs]
+    emb = np.asarray(cached_embed_texts(texts, batch_size=batch_size), dtype=np.float32)
+    out = []
+    offset = 0
+    for segs in split_videos:
+        rows = emb[offset:offset + len(segs)]
+        offset += len(segs)
+        out.append((segs, rows, pool_vectors(rows, segs)))
+    return out
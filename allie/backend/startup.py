@@ -0,0 +1,142 @@
+"""
+Startup and readiness for the embedding model.
+
+ALLIE_STARTUP picks when the model is loaded:
+
+- `lazy` (default): on the first request that needs it; the service reports
+  ready immediately, as before.
+- `preload`: a background thread loads the model and runs a real encode as
+  soon as the worker starts. `/healthz` (liveness) answers right away, while
+  `/readyz` returns 503 until the warmup encode has finished, so a platform
+  readiness/startup probe only routes traffic to warm instances.
+- `blocking`: as `preload`, but the ASGI lifespan waits for the warmup, so
+  the server doesn't accept connections until the model is warm.
+
+Torch, sentence-transformers and ONNX Runtime are only imported by
+`backends.load_backend`, so importing the app stays cheap in every mode.
+
+Under a pre-forking server (see `gunicorn_conf.py`) `preload_for_fork()`
+runs in the master before workers are forked: torch weights are loaded once
+and shared copy-on-write by all workers, and each worker then only runs its
+own warmup encode. ONNX Runtime sessions own native thread pools that do not
+survive `fork()`, so for the `onnx` backends the master only fetches (and,
+for `onnx-int8`, quantizes) the model files. The same goes for every backend
+when ALLIE_EMBED_PROCS runs the model in `encode_pool` workers, which are
+spawned with their own (mmap-shared) copy of the weights.
+"""
+import asyncio
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .encode_pool import pool_size
+from .model import get_backend_name, get_model_name, is_loaded, warmup
+
+logger = logging.getLogger(__name__)
+
+MODES = ("lazy", "preload", "blocking")
+
+_lock = threading.Lock()
+_phase = "idle"  # idle -> loading -> ready | failed
+_error: Optional[str] = None
+_started: Optional[float] = None
+_warm_s: Optional[float] = None
+_thread: Optional[threading.Thread] = None
+_fork_threads: Optional[int] = None
+_preforked = False
+
+
+def get_mode() -> str:
+    mode = os.getenv("ALLIE_STARTUP", "lazy").lower()
+    return mode if mode in MODES else "lazy"
+
+
+def warm() -> None:
+    """Load the model and run one real encode; marks the process ready."""
+    global _phase, _error, _started, _warm_s
+    with _lock:
+        if _phase == "ready":
+            return
+        _phase, _error, _started = "loading", None, time.perf_counter()
+    try:
+        warmup()
+    except Exception as exc:
+        with _lock:
+            _phase, _error = "failed", f"{type(exc).__name__}: {exc}"
+        logger.exception("Model warmup failed")
+        raise
+    with _lock:
+        _phase = "ready"
+        _warm_s = time.perf_counter() - _started
+    logger.info("Model %s warm in %.2fs", get_model_name(), _warm_s)
+
+
+def _warm_quietly() -> None:
+    try:
+        warm()
+    except Exception:
+        pass  # recorded in stats(); /readyz stays 503
+
+
+async def on_startup() -> None:
+    """Called from the app lifespan in every worker."""
+    global _thread
+    mode = get_mode()
+    if mode == "blocking":
+        await asyncio.to_thread(warm)
+    elif mode == "preload" and _thread is None:
+        _thread = threading.Thread(target=_warm_quietly, name="allie-warmup", daemon=True)
+        _thread.start()
+
+
+def is_ready() -> bool:
+    return _phase == "ready" or get_mode() == "lazy"
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "mode": get_mode(),
+        "phase": _phase,
+        "ready": is_ready(),
+        "model_loaded": is_loaded(),
+        "preforked": _preforked,
+        "warmup_s": round(_warm_s, 3) if _warm_s is not None else None,
+        "error": _error,
+    }
+
+
+def preload_for_fork() -> None:
+    """Load what can be shared before a pre-fork server forks its workers."""
+    global _fork_threads, _preforked
+    backend = get_backend_name()
+    started = time.perf_counter()
+    if backend.startswith("torch") and not pool_size():
+        import torch
+
+        # With one thread torch never enters an OpenMP parallel region, so no
+        # thread pool exists in the master for forked workers to inherit
+        _fork_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        from .model import _init_model
+
+        _init_model()
+    else:
+        from .backends import prefetch
+
+        prefetch(backend, get_model_name())
+    # Keep the collector from touching (and so copying) the shared pages
+    gc.collect()
+    gc.freeze()
+    _preforked = True
+    logger.info("Preloaded %s (%s) for fork in %.2fs", get_model_name(), backend, time.perf_counter() - started)
+
+
+def after_fork() -> None:
+    """Called in each worker right after fork."""
+    if _fork_threads is not None:
+        import torch
+
+        torch.set_num_threads(_fork_threads)
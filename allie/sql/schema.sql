@@ -37,7 +37,45 @@ do $$ begin
   end if;
 end $$;
 
+-- Transcript segments (allie/backend/segments.py): overlapping token windows
+-- of each transcript with the caption time range they cover. The row in
+-- video_embeddings is their token-weighted mean. Same dimension as
+-- video_embeddings
+create table if not exists public.video_segments (
+  video_id text not null references public.videos(id) on delete cascade,
+  seg_no integer not null,
+  start_s real,
+  end_s real,
+  text text not null,
+  embedding vector(384) not null,
+  primary key (video_id, seg_no)
+);
+
+-- Nearest-segment search across all videos; per-video lookups (best segment
+-- for a /similar result) go through the primary key instead
+do $$ begin
+  if not exists (
+    select 1 from pg_indexes where schemaname='public' and indexname='video_segments_embedding_idx'
+  ) then
+    create index video_segments_embedding_idx on public.video_segments using ivfflat (embedding vector_l2_ops) with (lists = 100);
+  end if;
+end $$;
+
 -- Helpful view for debugging
 create or replace view public.video_with_emb as
 select v.*, e.embedding from public.videos v left join public.video_embeddings e on e.video_id = v.id;
 
+
+-- Content-addressed embedding cache (allie/backend/embed_cache.py)
+-- key = sha256(model name, max_seq_length, backend, normalized text), where
+-- the backend (ALLIE_BACKEND) names the quantization, e.g. onnx-int8;
+-- unconstrained vector so rows from different models can coexist
+create table if not exists public.embedding_cache (
+  key bytea primary key,
+  model text not null,
+  embedding vector not null,
+  created_at timestamptz not null default now(),
+  last_used timestamptz not null default now()
+);
+
+create index if not exists embedding_cache_last_used_idx on public.embedding_cache (last_used);
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: in-memory index vs pgvector for /similar.
+
+Builds the `MemoryIndex` used by ALLIE_INDEX_MODE=memory in float32 and
+float16 and reports recall@k against exact float32 cosine ranking, mean and
+p99 query latency, and matrix memory. With --db the index is loaded from
+`video_embeddings` and the pgvector ivfflat path (`SIMILAR_SQL`) is measured
+on the same seeds; otherwise a synthetic corpus is used.
+
+Usage:
+  python -m allie.tools.bench_ann --rows 50000
+  python -m allie.tools.bench_ann --db "$SUPABASE_DB_URL" --probes 10
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from allie.backend.ann_index import LOAD_SQL, MemoryIndex
+
+
+def synthetic(rows: int, dim: int) -> List[Tuple[str, str, str, None, np.ndarray]]:
+    rng = np.random.default_rng(0)
+    # A few hundred clusters so neighbours are meaningful, like real topics
+    centers = rng.standard_normal((max(1, rows // 200), dim)).astype(np.float32)
+    data = centers[rng.integers(0, len(centers), rows)] + 0.3 * rng.standard_normal((rows, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return [(f"v{i}", "", "en", None, data[i]) for i in range(rows)]
+
+
+def percentile_ms(samples: Sequence[float], q: float) -> float:
+    return float(np.percentile(np.asarray(samples) * 1000.0, q))
+
+
+def timed(fn, seeds: Sequence[str], k: int) -> Tuple[Dict[str, List[str]], List[float]]:
+    out: Dict[str, List[str]] = {}
+    lat: List[float] = []
+    for s in seeds:
+        t0 = time.perf_counter()
+        res = fn(s, k)
+        lat.append(time.perf_counter() - t0)
+        out[s] = [r["video_id"] for r in res]
+    return out, lat
+
+
+def recall(truth: Dict[str, List[str]], got: Dict[str, List[str]]) -> float:
+    hits = sum(len(set(truth[s]) & set(got[s])) for s in truth)
+    total = sum(len(truth[s]) for s in truth)
+    return hits / total if total else 1.0
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument("--db", help="Postgres URL; loads video_embeddings and times the pgvector path")
+    p.add_argument("--rows", type=int, default=20000, help="synthetic corpus size without --db")
+    p.add_argument("--dim", type=int, default=384)
+    p.add_argument("-k", type=int, default=20)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--probes", type=int, help="ivfflat.probes for the pgvector path")
+    args = p.parse_args(argv)
+
+    conn = None
+    if args.db:
+        import psycopg
+        from pgvector.psycopg import register_vector
+
+        conn = psycopg.connect(args.db, autocommit=True)
+        register_vector(conn)
+        if args.probes:
+            conn.execute(f"set ivfflat.probes = {int(args.probes)}")
+        with conn.cursor(binary=True) as cur:
+            cur.execute(LOAD_SQL)
+            rows = cur.fetchall()
+    else:
+        rows = synthetic(args.rows, args.dim)
+    if not rows:
+        print("no embeddings to index")
+        return 1
+
+    dim = len(np.asarray(rows[0][4].to_numpy() if hasattr(rows[0][4], "to_numpy") else rows[0][4]))
+    rng = np.random.default_rng(1)
+    seeds = [rows[i][0] for i in rng.choice(len(rows), size=min(args.queries, len(rows)), replace=False)]
+
+    indexes = {}
+    for dtype in ("float32", "float16"):
+        idx = MemoryIndex(dim=dim, dtype=dtype)
+        t0 = time.perf_counter()
+        idx.load(rows)
+        indexes[dtype] = (idx, time.perf_counter() - t0)
+
+    truth, _ = timed(lambda s, k: indexes["float32"][0].search(s, k), seeds, args.k)
+
+    print(f"corpus={len(rows)} dim={dim} k={args.k} queries={len(seeds)}")
+    print(f"{'path':14}{'recall@k':>10}{'mean ms':>10}{'p99 ms':>10}{'memory MB':>12}{'load s':>9}")
+    for dtype, (idx, load_s) in indexes.items():
+        got, lat = timed(lambda s, k: idx.search(s, k), seeds, args.k)
+        mb = idx.stats()["matrix_bytes"] / 1e6
+        print(f"{'memory/' + dtype:14}{recall(truth, got):10.4f}{np.mean(lat) * 1000:10.3f}"
+              f"{percentile_ms(lat, 99):10.3f}{mb:12.1f}{load_s:9.2f}")
+
+    if conn is not None:
+        from allie.backend.app import SIMILAR_SQL
+
+        def pg(seed: str, k: int):
+            cur = conn.execute(SIMILAR_SQL, {"seed_id": seed, "k": k, "lang": None, "channel_id": None})
+            return [{"video_id": r[0]} for r in cur.fetchall()]
+
+        got, lat = timed(pg, seeds, args.k)
+        print(f"{'pgvector':14}{recall(truth, got):10.4f}{np.mean(lat) * 1000:10.3f}"
+              f"{percentile_ms(lat, 99):10.3f}{'-':>12}{'-':>9}")
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Parity and throughput benchmark for the embedding backends (ALLIE_BACKEND).
+
+Encodes the same transcripts with each backend and reports load time,
+throughput and resident memory, plus cosine similarity and max absolute
+difference against the reference backend's vectors. Rows already stored in
+`video_embeddings` came from the reference (`torch`), so a backend is
+drop-in compatible when its min cosine stays above --min-cosine.
+
+Texts come from --file (one transcript per line) or, by default, the lesson
+markdown under public/course_content/lessons split into paragraphs.
+
+With --procs, the first non-reference backend is also run through the
+multi-process pool (ALLIE_EMBED_PROCS, see `encode_pool.py`) at each pool
+size, with --proc-threads threads per worker, to show how throughput scales
+with cores.
+
+Usage:
+  python -m allie.tools.bench_backends --backends torch,onnx,onnx-int8
+  python -m allie.tools.bench_backends --file transcripts.txt --reference onnx
+  python -m allie.tools.bench_backends --backends onnx --reference onnx --procs 1,2,4,8,16
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import resource
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from allie.backend.backends import BACKENDS, load_backend
+
+
+def load_texts(path: str | None, limit: int) -> List[str]:
+    if path:
+        lines = Path(path).read_text(encoding="utf-8").splitlines()
+        texts = [x.strip() for x in lines if x.strip()]
+    else:
+        root = Path(__file__).resolve().parents[2] / "public" / "course_content" / "lessons"
+        texts = []
+        for md in sorted(root.glob("*.md")):
+            texts.extend(p.strip() for p in md.read_text(encoding="utf-8").split("\n\n") if len(p.strip()) > 200)
+    return texts[:limit]
+
+
+def rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def bench_pool(name: str, args: argparse.Namespace, texts: List[str], sizes: List[int]) -> None:
+    from allie.backend.encode_pool import EncodePool
+
+    # Workers load the model through model.py, which reads these
+    os.environ["ALLIE_BACKEND"] = name
+    os.environ["ALLIE_EMBED_MODEL"] = args.model
+    if args.max_seq_length:
+        os.environ["ALLIE_MAX_SEQ_LENGTH"] = str(args.max_seq_length)
+    print(f"\npool scaling ({name}, {args.proc_threads} thread(s) per worker)")
+    print(f"{'procs':>6}{'start s':>9}{'texts/s':>10}{'speedup':>9}")
+    base = None
+    for n in sizes:
+        pool = EncodePool(name, args.model, n, threads=args.proc_threads)
+        try:
+            pool.start()
+            pool.encode(texts[: args.batch_size * n], args.batch_size)
+            t0 = time.perf_counter()
+            pool.encode(texts, args.batch_size)
+            rate = len(texts) / (time.perf_counter() - t0)
+        finally:
+            pool.close()
+        base = base or rate
+        print(f"{n:6d}{pool.start_s or 0:9.2f}{rate:10.1f}{rate / base:8.2f}x")
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument("--model", default="BAAI/bge-small-en-v1.5")
+    p.add_argument("--backends", default="torch,onnx,onnx-int8", help=f"comma-separated subset of {','.join(BACKENDS)}")
+    p.add_argument("--reference", default="torch")
+    p.add_argument("--file", help="transcripts, one per line")
+    p.add_argument("--limit", type=int, default=256)
+    p.add_argument("--batch-size", type=int, default=32)
+    p.add_argument("--max-seq-length", type=int)
+    p.add_argument("--min-cosine", type=float, default=0.99)
+    p.add_argument("--procs", help="pool sizes to measure, e.g. 1,2,4,8")
+    p.add_argument("--proc-threads", type=int, default=1, help="threads per pool worker")
+    args = p.parse_args(argv)
+
+    texts = load_texts(args.file, args.limit)
+    if not texts:
+        print("no texts to encode")
+        return 1
+    names = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if args.reference not in names:
+        names.insert(0, args.reference)
+
+    results: Dict[str, np.ndarray] = {}
+    print(f"model={args.model} texts={len(texts)} batch_size={args.batch_size}")
+    print(f"{'backend':12}{'load s':>8}{'texts/s':>10}{'max RSS MB':>12}")
+    for name in names:
+        rss0 = rss_mb()
+        t0 = time.perf_counter()
+        model = load_backend(name, args.model, device="cpu")
+        if args.max_seq_length:
+            model.max_seq_length = args.max_seq_length
+        load_s = time.perf_counter() - t0
+        model.encode(texts[: args.batch_size], batch_size=args.batch_size, normalize_embeddings=True)
+        t0 = time.perf_counter()
+        emb = np.asarray(model.encode(texts, batch_size=args.batch_size, normalize_embeddings=True), dtype=np.float32)
+        rate = len(texts) / (time.perf_counter() - t0)
+        results[name] = emb
+        # Peak RSS only grows, so later rows include earlier backends
+        print(f"{name:12}{load_s:8.2f}{rate:10.1f}{rss_mb():12.0f}  (+{rss_mb() - rss0:.0f})")
+        del model
+
+    ref = results[args.reference]
+    ok = True
+    print(f"\nparity vs {args.reference}")
+    print(f"{'backend':12}{'mean cos':>10}{'min cos':>10}{'max |diff|':>12}")
+    for name, emb in results.items():
+        if name == args.reference:
+            continue
+        cos = np.sum(ref * emb, axis=1)
+        print(f"{name:12}{cos.mean():10.5f}{cos.min():10.5f}{np.abs(ref - emb).max():12.5f}")
+        ok = ok and float(cos.min()) >= args.min_cosine
+
+    if args.procs:
+        pooled = next((n for n in names if n != args.reference), args.reference)
+        bench_pool(pooled, args, texts, [int(n) for n in args.procs.split(",") if n.strip()])
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: text vs binary pgvector transport for the Allie embed API.
+
+Compares the old `vec_sql` string formatting / `float(x)` parsing against the
+pgvector binary dumper and loader the service now registers on its
+connections. Without --db it measures client-side CPU and payload size only;
+with --db it also times the /ingest upsert and the /similar seed fetch plus
+k-NN query round trips against a scratch table.
+
+Usage:
+  python -m allie.tools.bench_vectors
+  python -m allie.tools.bench_vectors --db "$SUPABASE_DB_URL" --rows 2000
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import time
+from typing import Callable, List
+
+import numpy as np
+from pgvector import Vector
+
+
+def legacy_vec_sql(v: np.ndarray) -> str:
+    # What app.py used to send for every embedding parameter
+    return "[" + ",".join(f"{float(x):.6f}" for x in v.tolist()) + "]"
+
+
+def legacy_parse(s: str) -> np.ndarray:
+    # What /similar used to do with the fetched seed embedding
+    s = s.strip("[]")
+    return np.array([float(x) for x in s.split(",")], dtype=np.float32)
+
+
+def bench(fn: Callable[[], object], n: int) -> float:
+    """Returns mean microseconds per call."""
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def run_local(dim: int, n: int) -> None:
+    v = np.random.default_rng(0).standard_normal(dim).astype(np.float32)
+    v /= np.linalg.norm(v)
+    text = legacy_vec_sql(v)
+    binary = Vector(v).to_binary()
+
+    dump_text = bench(lambda: legacy_vec_sql(v).encode(), n)
+    dump_bin = bench(lambda: Vector(v).to_binary(), n)
+    load_text = bench(lambda: legacy_parse(text), n)
+    load_bin = bench(lambda: Vector.from_binary(binary).to_numpy(), n)
+
+    print(f"dim={dim} iterations={n}")
+    print(f"{'':24}{'text':>12}{'binary':>12}{'speedup':>10}")
+    print(f"{'dump (us/vector)':24}{dump_text:12.1f}{dump_bin:12.1f}{dump_text / dump_bin:9.1f}x")
+    print(f"{'load (us/vector)':24}{load_text:12.1f}{load_bin:12.1f}{load_text / load_bin:9.1f}x")
+    print(f"{'bytes on the wire':24}{len(text):12d}{len(binary):12d}{len(text) / len(binary):9.1f}x")
+    # /ingest sends the vector once; /similar used to load it once and send it twice
+    print(f"{'/ingest client CPU (us)':24}{dump_text:12.1f}{dump_bin:12.1f}")
+    print(f"{'/similar client CPU (us)':24}{load_text + 2 * dump_text:12.1f}{load_bin + 2 * dump_bin:12.1f}")
+
+
+def run_db(url: str, dim: int, rows: int, n: int) -> None:
+    import psycopg
+    from pgvector.psycopg import register_vector
+
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((rows, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    ids = [f"bench_{i}" for i in range(rows)]
+
+    with psycopg.connect(url, autocommit=True) as conn:
+        register_vector(conn)
+        conn.execute(f"create temp table allie_bench_vectors (id text primary key, embedding vector({dim}))")
+        with conn.cursor() as cur:
+            cur.executemany(
+                "insert into allie_bench_vectors values (%s, %s)", list(zip(ids, data))
+            )
+
+        upsert = (
+            "insert into allie_bench_vectors (id, embedding) values (%s, {p}) "
+            "on conflict (id) do update set embedding=excluded.embedding"
+        )
+        knn = (
+            "select id, 1 - (embedding <=> {p}) from allie_bench_vectors "
+            "where id <> %s order by embedding <-> {p} limit 20"
+        )
+        picks = itertools.cycle(rng.integers(0, rows, size=n).tolist())
+
+        def ingest_text() -> None:
+            i = next(picks)
+            conn.execute(upsert.format(p="%s::vector"), (ids[i], legacy_vec_sql(data[i])))
+
+        def ingest_binary() -> None:
+            i = next(picks)
+            conn.execute(upsert.format(p="%s"), (ids[i], data[i]))
+
+        def similar_text() -> None:
+            i = next(picks)
+            row = conn.execute(
+                "select embedding::text from allie_bench_vectors where id=%s", (ids[i],)
+            ).fetchone()
+            seed = legacy_vec_sql(legacy_parse(row[0]))
+            conn.execute(knn.format(p="%s::vector"), (seed, ids[i], seed)).fetchall()
+
+        def similar_binary() -> None:
+            i = next(picks)
+            with conn.cursor(binary=True) as cur:
+                cur.execute("select embedding from allie_bench_vectors where id=%s", (ids[i],))
+                seed = cur.fetchone()[0].to_numpy()
+                cur.execute(knn.format(p="%s"), (seed, ids[i], seed))
+                cur.fetchall()
+
+        print(f"\nround trips against {rows} rows (us/call, mean of {n})")
+        print(f"{'':24}{'text':>12}{'binary':>12}")
+        print(f"{'/ingest upsert':24}{bench(ingest_text, n):12.1f}{bench(ingest_binary, n):12.1f}")
+        print(f"{'/similar 2-query path':24}{bench(similar_text, n):12.1f}{bench(similar_binary, n):12.1f}")
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument("--dim", type=int, default=384)
+    p.add_argument("-n", "--iterations", type=int, default=2000)
+    p.add_argument("--db", help="Postgres URL with pgvector; enables round-trip timings")
+    p.add_argument("--rows", type=int, default=1000)
+    args = p.parse_args(argv)
+
+    run_local(args.dim, args.iterations)
+    if args.db:
+        run_db(args.db, args.dim, args.rows, min(args.iterations, 500))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
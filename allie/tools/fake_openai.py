@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Fake OpenAI API for benchmarks.
+
+Serves `/v1/chat/completions` (JSON and SSE streaming) and `/v1/embeddings`
+with a configurable latency model, so the Flask AI routes can be load tested
+without network calls or cost. Point the backend at it with
+`OPENAI_BASE_URL=http://127.0.0.1:<port>/v1` and any `OPENAI_API_KEY`.
+
+Latency model per completion: `--ttft-ms` before the first token, then
+`--token-ms` between each of `--tokens` tokens (a JSON completion waits for
+all of them), each scaled by +/- `--jitter`. `--error-rate` answers that
+fraction of requests with 429 and `Retry-After: 0`. Embeddings are
+deterministic per input text.
+
+Usage:
+  python -m allie.tools.fake_openai --port 8099 --ttft-ms 300 --token-ms 15
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import numpy as np
+
+WORDS = (
+    "Let's break this down step by step. First, review the key idea from the "
+    "lesson, then try one practice problem on your own and check the result."
+).split()
+
+
+@dataclass
+class Profile:
+    ttft_ms: float = 300.0
+    token_ms: float = 15.0
+    tokens: int = 60
+    embed_ms: float = 20.0
+    embed_dim: int = 1536
+    jitter: float = 0.2
+    error_rate: float = 0.0
+
+    def delay(self, ms: float) -> None:
+        if ms > 0:
+            time.sleep(ms * random.uniform(1.0 - self.jitter, 1.0 + self.jitter) / 1000.0)
+
+
+class FakeOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, profile: Profile):
+        super().__init__(addr, _Handler)
+        self.profile = profile
+        self.counts: Dict[str, int] = {"chat": 0, "stream": 0, "embeddings": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def _embedding(text: str, dim: int) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def _chunk(index: int, delta: Dict[str, Any], finish: str | None = None) -> Dict[str, Any]:
+    return {
+        "id": "chatcmpl-bench",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "fake",
+        "choices": [{"index": index, "delta": delta, "finish_reason": finish}],
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeOpenAI
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _json(self, status: int, body: Dict[str, Any], headers: Dict[str, str] | None = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, text: str) -> None:
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        profile = self.server.profile
+
+        if profile.error_rate and random.random() < profile.error_rate:
+            self.server.count("errors")
+            self._json(429, {"error": {"message": "Rate limit reached", "type": "requests"}}, {"Retry-After": "0"})
+            return
+
+        if self.path.endswith("/embeddings"):
+            self.server.count("embeddings")
+            inputs = body.get("input")
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+            profile.delay(profile.embed_ms)
+            data = [
+                {"object": "embedding", "index": i, "embedding": _embedding(str(t), profile.embed_dim)}
+                for i, t in enumerate(inputs)
+            ]
+            self._json(200, {"object": "list", "model": body.get("model", "fake"), "data": data,
+                             "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}})
+            return
+
+        if not self.path.endswith("/chat/completions"):
+            self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        n = min(profile.tokens, int(body.get("max_tokens") or profile.tokens))
+        words = [(" " if i else "") + WORDS[i % len(WORDS)] for i in range(n)]
+
+        if body.get("stream"):
+            self.server.count("stream")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                profile.delay(profile.ttft_ms)
+                for i, word in enumerate(words):
+                    if i:
+                        profile.delay(profile.token_ms)
+                    self._write_chunk(f"data: {json.dumps(_chunk(0, {'content': word}))}\n\n")
+                self._write_chunk(f"data: {json.dumps(_chunk(0, {}, 'stop'))}\n\n")
+                self._write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The gateway closed a cancelled stream
+                self.close_connection = True
+            return
+
+        self.server.count("chat")
+        profile.delay(profile.ttft_ms + profile.token_ms * max(0, n - 1))
+        self._json(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": n, "total_tokens": n},
+        })
+
+
+def start(host: str = "127.0.0.1", port: int = 0, profile: Profile | None = None) -> FakeOpenAI:
+    """Serve on a daemon thread; `port=0` picks a free port (see `base_url`)."""
+    server = FakeOpenAI((host, port), profile or Profile())
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def add_profile_args(p: argparse.ArgumentParser) -> None:
+    d = Profile()
+    p.add_argument("--ttft-ms", type=float, default=d.ttft_ms, help="delay before the first token")
+    p.add_argument("--token-ms", type=float, default=d.token_ms, help="delay between tokens")
+    p.add_argument("--tokens", type=int, default=d.tokens, help="tokens per completion (capped by max_tokens)")
+    p.add_argument("--embed-ms", type=float, default=d.embed_ms)
+    p.add_argument("--embed-dim", type=int, default=d.embed_dim)
+    p.add_argument("--jitter", type=float, default=d.jitter, help="+/- fraction applied to every delay")
+    p.add_argument("--error-rate", type=float, default=d.error_rate, help="fraction of requests answered 429")
+
+
+def profile_from_args(args: argparse.Namespace) -> Profile:
+    return Profile(
+        ttft_ms=args.ttft_ms,
+        token_ms=args.token_ms,
+        tokens=args.tokens,
+        embed_ms=args.embed_ms,
+        embed_dim=args.embed_dim,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    )
+
+
+def main(argv: List[str] | None = None) -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8099)
+    add_profile_args(p)
+    args = p.parse_args(argv)
+
+    server = FakeOpenAI((args.host, args.port), profile_from_args(args))
+    print(f"fake OpenAI listening on {server.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -7,19 +7,36 @@ Usage:
   python -m allie.tools.ingest_youtube --file ids.txt
   echo "id1\nid2" | python -m allie.tools.ingest_youtube
 
+Transcripts are fetched on one bounded worker pool and posted on another,
+through a single keep-alive HTTP client, in batches to `/ingest/batch` when
+the server has it (falling back to `/ingest`). Every finished ID is appended
+to a journal (--journal), so re-running the same command after an interrupt
+skips IDs already ingested. Captions are sent with their timestamps, so the
+server's transcript segments can point at the moment they cover.
+
 Env:
   ALLIE_API_URL: default http://localhost:8000
 """
 from __future__ import annotations
 
 import argparse
+import json
 import os
+import random
 import sys
-from typing import Iterable, List
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
 
 import httpx
 from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled
 
+T = TypeVar("T")
+
+# Statuses worth retrying; everything else 4xx is the request's fault
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
 
 def iter_ids(args: argparse.Namespace) -> Iterable[str]:
     if args.ids:
@@ -40,30 +57,282 @@ def iter_ids(args: argparse.Namespace) -> Iterable[str]:
                 yield line
 
 
-def fetch_transcript(video_id: str, lang: str = "en") -> str:
+Cues = List[Dict[str, Any]]
+
+
+def fetch_segments(video_id: str, lang: str = "en") -> Cues:
+    """Timed captions as `[{"text", "start", "duration"}, ...]` (seconds)."""
     try:
         transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=[lang])
     except TranscriptsDisabled:
         # try auto-generated
         transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=[f"{lang}", "en"])
-    text = " ".join(chunk["text"] for chunk in transcript)
-    return text
+    return [
+        {"text": chunk["text"], "start": chunk["start"], "duration": chunk.get("duration", 0.0)}
+        for chunk in transcript
+    ]
 
 
-def ingest(api: str, video_id: str, transcript: str, title: str = "", lang: str = "en") -> bool:
-    payload = {
+def fetch_transcript(video_id: str, lang: str = "en") -> str:
+    return " ".join(chunk["text"] for chunk in fetch_segments(video_id, lang))
+
+
+def video_payload(video_id: str, cues: Cues, title: str = "", lang: str = "en") -> Dict[str, Any]:
+    # The joined transcript is kept for servers without segment support
+    return {
         "youtube_id": video_id,
         "title": title,
-        "transcript": transcript,
+        "transcript": " ".join(chunk["text"] for chunk in cues),
+        "segments": cues,
         "lang": lang,
     }
-    with httpx.Client(timeout=60.0) as client:
-        r = client.post(f"{api.rstrip('/')}/ingest", json=payload)
-        if r.status_code != 200:
-            print(f"[ERROR] {video_id}: {r.status_code} {r.text}", file=sys.stderr)
-            return False
-        print(f"[OK] {video_id}")
-        return True
+
+
+class RetryableHTTPError(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"{response.status_code} {response.text[:200]}")
+        self.response = response
+
+
+def with_retries(fn: Callable[[], T], retries: int, base_delay: float = 0.5, retry_on: Tuple[type, ...] = (Exception,)) -> T:
+    """Calls `fn`, retrying `retry_on` errors with jittered exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt == retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (0.5 + random.random())
+            retry_after = getattr(getattr(e, "response", None), "headers", {}).get("Retry-After")
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def make_client(workers: int, timeout: float = 60.0) -> httpx.Client:
+    # One pooled client shared by all post workers; httpx.Client is thread-safe
+    limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+    return httpx.Client(timeout=timeout, limits=limits)
+
+
+def _post(client: httpx.Client, url: str, payload: Dict[str, Any], retries: int) -> httpx.Response:
+    def once() -> httpx.Response:
+        r = client.post(url, json=payload)
+        if r.status_code in RETRY_STATUS:
+            raise RetryableHTTPError(r)
+        return r
+    return with_retries(once, retries, retry_on=(httpx.TransportError, RetryableHTTPError))
+
+
+def ingest_one(api: str, video_id: str, transcript: str, title: str, lang: str,
+               client: httpx.Client, retries: int, cues: Optional[Cues] = None) -> Optional[str]:
+    """Posts one video to /ingest; returns an error message or None."""
+    if cues is not None:
+        payload = video_payload(video_id, cues, title, lang)
+    else:
+        payload = {
+            "youtube_id": video_id,
+            "title": title,
+            "transcript": transcript,
+            "lang": lang,
+        }
+    try:
+        r = _post(client, f"{api.rstrip('/')}/ingest", payload, retries)
+    except (httpx.HTTPError, RetryableHTTPError) as e:
+        return str(e)
+    if r.status_code != 200:
+        return f"{r.status_code} {r.text}"
+    return None
+
+
+def ingest(api: str, video_id: str, transcript: str, title: str = "", lang: str = "en") -> bool:
+    with make_client(1) as client:
+        error = ingest_one(api, video_id, transcript, title, lang, client, retries=0)
+    if error is not None:
+        print(f"[ERROR] {video_id}: {error}", file=sys.stderr)
+        return False
+    print(f"[OK] {video_id}")
+    return True
+
+
+def ingest_batch(api: str, items: List[Tuple[str, Cues]], lang: str, client: httpx.Client,
+                 retries: int) -> Optional[Dict[str, Optional[str]]]:
+    """
+    Posts `(video_id, cues)` pairs to /ingest/batch. Returns
+    {video_id: error-or-None}, or None if the server has no batch endpoint.
+    """
+    payload = {"items": [video_payload(v, cues, lang=lang) for v, cues in items]}
+    try:
+        r = _post(client, f"{api.rstrip('/')}/ingest/batch", payload, retries)
+    except (httpx.HTTPError, RetryableHTTPError) as e:
+        return {v: str(e) for v, _ in items}
+    if r.status_code in (404, 405):
+        return None
+    if r.status_code != 200:
+        return {v: f"{r.status_code} {r.text[:200]}" for v, _ in items}
+    out: Dict[str, Optional[str]] = {}
+    for res in r.json().get("results", []):
+        out[res.get("video_id")] = None if res.get("ok") else res.get("error", "failed")
+    return out
+
+
+class Journal:
+    """Append-only JSONL record of finished IDs, used to resume runs."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done: Set[str] = set()
+        self.failed: Set[str] = set()
+        self._lock = threading.Lock()
+        self._f = None
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from an interrupted write
+                    if rec.get("status") == "ok":
+                        self.done.add(rec["id"])
+                        self.failed.discard(rec["id"])
+                    else:
+                        self.failed.add(rec["id"])
+        if path:
+            self._f = open(path, "a", encoding="utf-8")
+
+    def record(self, video_id: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            if error is None:
+                self.done.add(video_id)
+            else:
+                self.failed.add(video_id)
+            if self._f is not None:
+                rec = {"id": video_id, "status": "ok" if error is None else "failed", "ts": time.time()}
+                if error is not None:
+                    rec["error"] = error
+                self._f.write(json.dumps(rec) + "\n")
+                self._f.flush()
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+
+
+class Pipeline:
+    """Bounded fetch -> batch -> post pipeline driven from the calling thread."""
+
+    def __init__(self, args: argparse.Namespace, journal: Journal):
+        self.args = args
+        self.journal = journal
+        self.client = make_client(args.post_workers)
+        self.fetch_pool = ThreadPoolExecutor(args.fetch_workers, thread_name_prefix="fetch")
+        self.post_pool = ThreadPoolExecutor(args.post_workers, thread_name_prefix="post")
+        self.fetching: Dict[Future, str] = {}
+        self.posting: Dict[Future, List[Tuple[str, Cues]]] = {}
+        self.buffer: List[Tuple[str, Cues]] = []
+        # None = unknown, probed by the first batch
+        self.batch_supported: Optional[bool] = None if args.batch_size > 1 else False
+        self.ok = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def _fetch(self, vid: str) -> Cues:
+        return with_retries(
+            lambda: fetch_segments(vid, lang=self.args.lang),
+            self.args.retries,
+            # requests' network errors are OSErrors; transcript API errors
+            # (disabled, not found) are permanent and not retried
+            retry_on=(OSError,),
+        )
+
+    def _post(self, items: List[Tuple[str, Cues]]) -> Dict[str, Optional[str]]:
+        if self.batch_supported is not False:
+            res = ingest_batch(self.args.api, items, self.args.lang, self.client, self.args.retries)
+            if res is not None:
+                self.batch_supported = True
+                return res
+            self.batch_supported = False
+        return {
+            vid: ingest_one(self.args.api, vid, "", "", self.args.lang, self.client, self.args.retries, cues=cues)
+            for vid, cues in items
+        }
+
+    def _done(self, vid: str, error: Optional[str]) -> None:
+        self.journal.record(vid, error)
+        if error is None:
+            self.ok += 1
+            print(f"[OK] {vid}")
+        else:
+            self.failed += 1
+            print(f"[ERROR] {vid}: {error}", file=sys.stderr)
+
+    def _flush(self, force: bool = False) -> None:
+        while self.buffer and (force or len(self.buffer) >= self.args.batch_size):
+            while len(self.posting) >= self.args.post_workers * 2:
+                self._reap_posts(block=True)
+            items, self.buffer = self.buffer[: self.args.batch_size], self.buffer[self.args.batch_size:]
+            self.posting[self.post_pool.submit(self._post, items)] = items
+
+    def _reap_fetches(self, block: bool) -> None:
+        if not self.fetching:
+            return
+        done, _ = wait(self.fetching, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in done:
+            vid = self.fetching.pop(fut)
+            try:
+                self.buffer.append((vid, fut.result()))
+            except Exception as e:
+                self._done(vid, f"transcript fetch failed: {e}")
+        self._flush()
+
+    def _reap_posts(self, block: bool) -> None:
+        if not self.posting:
+            return
+        done, _ = wait(self.posting, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in done:
+            items = self.posting.pop(fut)
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {vid: str(e) for vid, _ in items}
+            for vid, _ in items:
+                self._done(vid, res.get(vid, "missing from response"))
+
+    def run(self, ids: Iterable[str]) -> int:
+        skip: Set[str] = set()
+        if self.args.resume:
+            skip |= self.journal.done
+            if self.args.skip_failed:
+                skip |= self.journal.failed
+        seen: Set[str] = set()
+        try:
+            for vid in ids:
+                if vid in skip:
+                    self.skipped += 1
+                    continue
+                if vid in seen:
+                    continue
+                seen.add(vid)
+                while len(self.fetching) >= self.args.fetch_workers * 2:
+                    self._reap_fetches(block=True)
+                    self._reap_posts(block=False)
+                self.fetching[self.fetch_pool.submit(self._fetch, vid)] = vid
+            while self.fetching:
+                self._reap_fetches(block=True)
+                self._reap_posts(block=False)
+            self._flush(force=True)
+            while self.posting:
+                self._reap_posts(block=True)
+        finally:
+            self.fetch_pool.shutdown(wait=False, cancel_futures=True)
+            self.post_pool.shutdown(wait=True, cancel_futures=True)
+            self.client.close()
+        print(f"[done] ok={self.ok} failed={self.failed} skipped={self.skipped}", file=sys.stderr)
+        return 0 if self.failed == 0 else 1
 
 
 def main(argv: List[str] | None = None) -> int:
@@ -72,22 +341,24 @@ def main(argv: List[str] | None = None) -> int:
     p.add_argument("--file", help="File with YouTube IDs (one per line)")
     p.add_argument("--lang", default="en")
     p.add_argument("--api", default=os.getenv("ALLIE_API_URL", "http://localhost:8000"))
+    p.add_argument("--fetch-workers", type=int, default=8, help="Concurrent transcript fetches")
+    p.add_argument("--post-workers", type=int, default=4, help="Concurrent requests to the API")
+    p.add_argument("--batch-size", type=int, default=32, help="Videos per /ingest/batch call (1 disables batching)")
+    p.add_argument("--retries", type=int, default=3, help="Retries for transient fetch/API errors")
+    p.add_argument("--journal", default=".ingest_journal.jsonl", help="Checkpoint file ('' to disable)")
+    p.add_argument("--no-resume", dest="resume", action="store_false", help="Ignore the journal's finished IDs")
+    p.add_argument("--skip-failed", action="store_true", help="Also skip IDs the journal recorded as failed")
     args = p.parse_args(argv)
+    args.fetch_workers = max(1, args.fetch_workers)
+    args.post_workers = max(1, args.post_workers)
+    args.batch_size = max(1, args.batch_size)
 
-    api = args.api
-    ok = True
-    for vid in iter_ids(args):
-        try:
-            text = fetch_transcript(vid, lang=args.lang)
-        except Exception as e:
-            print(f"[ERROR] {vid}: transcript fetch failed: {e}", file=sys.stderr)
-            ok = False
-            continue
-        if not ingest(api, vid, text, lang=args.lang):
-            ok = False
-    return 0 if ok else 1
+    journal = Journal(args.journal or None)
+    try:
+        return Pipeline(args, journal).run(iter_ids(args))
+    finally:
+        journal.close()
 
 
 if __name__ == "__main__":
     raise SystemExit(main())
-
@@ -2,164 +2,202 @@
 """
 Seed course structure into Firestore to match the hierarchical format expected by the app.
 
+Lesson titles come from the first line of each lesson's markdown in Storage,
+read with small ranged downloads on a thread pool over one pooled storage
+client. All course, module, lesson and `lessonContent` docs are compared
+against what Firestore already holds (one batched `get_all`) and only the
+docs that differ are written, in batched writes of up to 500 operations.
+
+`--dry-run` prints the docs without touching Firestore; `--diff` reads
+Firestore and prints what would change without writing. Both clients honour
+the emulators: set `FIRESTORE_EMULATOR_HOST` (and `STORAGE_EMULATOR_HOST`
+for a fake GCS server) to reseed locally.
+
 Usage:
   python allie/tools/seed_course_structure.py --project ai-integra-course-v2
+  python allie/tools/seed_course_structure.py --diff
+  FIRESTORE_EMULATOR_HOST=localhost:8080 python allie/tools/seed_course_structure.py --project demo-test
 """
 from __future__ import annotations
 
 import argparse
-import subprocess
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
 from google.cloud import firestore
 
+BUCKET = 'ai-integra-course-v2.firebasestorage.app'
+COURSE_ID = 'course_01_id'
+COURSE = {
+    'title': 'AI Integration Course',
+    'description': 'Learn to integrate AI into your applications with practical, hands-on lessons.',
+}
+# The title is on the first line; read just enough bytes to cover it
+HEADER_BYTES = 1024
+MAX_BATCH = 500
+
+# Module definitions with their lessons from Storage
+MODULES = [
+    {
+        'id': 'module_01_id',
+        'title': 'Module 1: Foundations of AI Integration',
+        'description': 'Introduction to AI integration fundamentals and getting started.',
+        'order': 1,
+        'lessons': [
+            ('lesson_1', 1, 'free'),
+            ('lesson_2', 2, 'free'),
+            ('lesson_3', 3, 'free'),
+            ('lesson_4', 4, 'free'),
+            ('lesson_5', 5, 'free'),
+        ]
+    },
+    {
+        'id': 'module_02_id',
+        'title': 'Module 2: AI in Finance and Investment',
+        'description': 'AI applications in finance, blockchain, and investment trends.',
+        'order': 2,
+        'lessons': [
+            ('lesson_6', 1, 'premium'),
+            ('lesson_7', 2, 'premium'),
+            ('lesson_8', 3, 'premium'),
+        ]
+    },
+    {
+        'id': 'module_03_id',
+        'title': 'Module 3: AI Entrepreneurship and Startups',
+        'description': 'From ideas to funding: building AI-powered businesses.',
+        'order': 3,
+        'lessons': [
+            ('lesson_9', 1, 'premium'),
+            ('lesson_10', 2, 'premium'),
+            ('lesson_11', 3, 'premium'),
+            ('lesson_12', 4, 'premium'),
+            ('lesson_13', 5, 'premium'),
+            ('lesson_14', 6, 'premium'),
+        ]
+    },
+    {
+        'id': 'module_04_id',
+        'title': 'Module 4: AI for Small Business',
+        'description': 'Practical AI strategies for SMB growth and operations.',
+        'order': 4,
+        'lessons': [
+            ('lesson_15', 1, 'premium'),
+            ('lesson_16', 2, 'premium'),
+            ('lesson_17', 3, 'premium'),
+            ('lesson_18', 4, 'premium'),
+            ('lesson_19', 5, 'premium'),
+            ('lesson_20', 6, 'premium'),
+        ]
+    },
+    {
+        'id': 'module_05_id',
+        'title': 'Module 5: AI for Real Estate',
+        'description': 'Applying AI to real estate workflows and decision-making.',
+        'order': 5,
+        'lessons': [
+            ('lesson_21', 1, 'premium'),
+            ('lesson_22', 2, 'premium'),
+            ('lesson_23', 3, 'premium'),
+            ('lesson_24', 4, 'premium'),
+            ('lesson_25', 5, 'premium'),
+            ('lesson_26', 6, 'premium'),
+        ]
+    },
+    {
+        'id': 'module_06_id',
+        'title': 'Module 6: AI for Executive Leadership',
+        'description': 'Strategic AI leadership across the enterprise.',
+        'order': 6,
+        'lessons': [
+            ('lesson_27', 1, 'premium'),
+            ('lesson_28', 2, 'premium'),
+            ('lesson_29', 3, 'premium'),
+            ('lesson_30', 4, 'premium'),
+            ('lesson_31', 5, 'premium'),
+        ]
+    },
+    {
+        'id': 'module_07_id',
+        'title': 'Module 7: AI and Creative Industries',
+        'description': 'Creative workflows powered by AI across media and entertainment.',
+        'order': 7,
+        'lessons': [
+            ('lesson_32', 1, 'premium'),
+            ('lesson_33', 2, 'premium'),
+            ('lesson_34', 3, 'premium'),
+            ('lesson_35', 4, 'premium'),
+            ('lesson_36', 5, 'premium'),
+            ('lesson_37', 6, 'premium'),
+            ('lesson_38', 7, 'premium'),
+            ('lesson_39', 8, 'premium'),
+        ]
+    },
+]
+
 
-def get_title_from_storage(bucket_path: str) -> str:
+def storage_client(project: str, workers: int):
+    """One storage client whose HTTP pool holds a connection per worker."""
+    import requests
+    from google.cloud import storage
+
+    emulator = os.getenv('STORAGE_EMULATOR_HOST')
+    if emulator:
+        from google.auth.credentials import AnonymousCredentials
+
+        client = storage.Client(project=project, credentials=AnonymousCredentials(),
+                                client_options={'api_endpoint': emulator})
+    else:
+        client = storage.Client(project=project)
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, workers))
+    client._http.mount('https://', adapter)
+    client._http.mount('http://', adapter)
+    return client
+
+
+def get_title_from_storage(bucket, path: str) -> str:
     """Extract title from first line of markdown file in Storage."""
     try:
-        result = subprocess.run(
-            ['gsutil', 'cat', bucket_path],
-            capture_output=True, text=True, timeout=30
-        )
-        if result.returncode == 0:
-            first_line = result.stdout.split('\n')[0]
-            # Remove markdown heading prefix
-            title = re.sub(r'^#+\s*', '', first_line).strip()
-            return title if title else "Untitled Lesson"
+        head = bucket.blob(path).download_as_bytes(start=0, end=HEADER_BYTES - 1)
+        if b'\n' not in head and len(head) == HEADER_BYTES:
+            # Unusually long first line; fetch a bigger prefix once
+            head = bucket.blob(path).download_as_bytes(start=0, end=16 * HEADER_BYTES - 1)
+        first_line = head.decode('utf-8', errors='ignore').split('\n')[0]
+        # Remove markdown heading prefix
+        title = re.sub(r'^#+\s*', '', first_line).strip()
+        return title if title else "Untitled Lesson"
     except Exception as e:
-        print(f"Warning: Could not get title from {bucket_path}: {e}")
+        print(f"Warning: Could not get title from gs://{bucket.name}/{path}: {e}")
     return "Untitled Lesson"
 
 
-def main() -> int:
-    p = argparse.ArgumentParser()
-    p.add_argument('--project', default='ai-integra-course-v2', help='GCP project ID')
-    args = p.parse_args()
+def lesson_path(module_id: str, lesson_id: str) -> str:
+    return f"lessons-md/courses/{COURSE_ID}/modules/{module_id}/lessons/{lesson_id}.md"
 
-    db = firestore.Client(project=args.project)
-    bucket = 'gs://ai-integra-course-v2.firebasestorage.app'
-
-    # Course data
-    course_id = 'course_01_id'
-    course_ref = db.collection('courses').document(course_id)
-    course_ref.set({
-        'title': 'AI Integration Course',
-        'description': 'Learn to integrate AI into your applications with practical, hands-on lessons.',
-    }, merge=True)
-    print(f"[seed] Created/updated course: {course_id}")
-
-    # Module definitions with their lessons from Storage
-    modules = [
-        {
-            'id': 'module_01_id',
-            'title': 'Module 1: Foundations of AI Integration',
-            'description': 'Introduction to AI integration fundamentals and getting started.',
-            'order': 1,
-            'lessons': [
-                ('lesson_1', 1, 'free'),
-                ('lesson_2', 2, 'free'),
-                ('lesson_3', 3, 'free'),
-                ('lesson_4', 4, 'free'),
-                ('lesson_5', 5, 'free'),
-            ]
-        },
-        {
-            'id': 'module_02_id',
-            'title': 'Module 2: AI in Finance and Investment',
-            'description': 'AI applications in finance, blockchain, and investment trends.',
-            'order': 2,
-            'lessons': [
-                ('lesson_6', 1, 'premium'),
-                ('lesson_7', 2, 'premium'),
-                ('lesson_8', 3, 'premium'),
-            ]
-        },
-        {
-            'id': 'module_03_id',
-            'title': 'Module 3: AI Entrepreneurship and Startups',
-            'description': 'From ideas to funding: building AI-powered businesses.',
-            'order': 3,
-            'lessons': [
-                ('lesson_9', 1, 'premium'),
-                ('lesson_10', 2, 'premium'),
-                ('lesson_11', 3, 'premium'),
-                ('lesson_12', 4, 'premium'),
-                ('lesson_13', 5, 'premium'),
-                ('lesson_14', 6, 'premium'),
-            ]
-        },
-        {
-            'id': 'module_04_id',
-            'title': 'Module 4: AI for Small Business',
-            'description': 'Practical AI strategies for SMB growth and operations.',
-            'order': 4,
-            'lessons': [
-                ('lesson_15', 1, 'premium'),
-                ('lesson_16', 2, 'premium'),
-                ('lesson_17', 3, 'premium'),
-                ('lesson_18', 4, 'premium'),
-                ('lesson_19', 5, 'premium'),
-                ('lesson_20', 6, 'premium'),
-            ]
-        },
-        {
-            'id': 'module_05_id',
-            'title': 'Module 5: AI for Real Estate',
-            'description': 'Applying AI to real estate workflows and decision-making.',
-            'order': 5,
-            'lessons': [
-                ('lesson_21', 1, 'premium'),
-                ('lesson_22', 2, 'premium'),
-                ('lesson_23', 3, 'premium'),
-                ('lesson_24', 4, 'premium'),
-                ('lesson_25', 5, 'premium'),
-                ('lesson_26', 6, 'premium'),
-            ]
-        },
-        {
-            'id': 'module_06_id',
-            'title': 'Module 6: AI for Executive Leadership',
-            'description': 'Strategic AI leadership across the enterprise.',
-            'order': 6,
-            'lessons': [
-                ('lesson_27', 1, 'premium'),
-                ('lesson_28', 2, 'premium'),
-                ('lesson_29', 3, 'premium'),
-                ('lesson_30', 4, 'premium'),
-                ('lesson_31', 5, 'premium'),
-            ]
-        },
-        {
-            'id': 'module_07_id',
-            'title': 'Module 7: AI and Creative Industries',
-            'description': 'Creative workflows powered by AI across media and entertainment.',
-            'order': 7,
-            'lessons': [
-                ('lesson_32', 1, 'premium'),
-                ('lesson_33', 2, 'premium'),
-                ('lesson_34', 3, 'premium'),
-                ('lesson_35', 4, 'premium'),
-                ('lesson_36', 5, 'premium'),
-                ('lesson_37', 6, 'premium'),
-                ('lesson_38', 7, 'premium'),
-                ('lesson_39', 8, 'premium'),
-            ]
-        },
-    ]
-
-    for module in modules:
+
+def fetch_titles(bucket, paths: List[str], workers: int) -> Dict[str, str]:
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(paths, pool.map(lambda path: get_title_from_storage(bucket, path), paths)))
+
+
+def build_docs(db, titles: Dict[str, str]) -> List[Tuple[Any, Dict[str, Any], str]]:
+    """Every (ref, merge data, label) the course needs, in seeding order."""
+    course_ref = db.collection('courses').document(COURSE_ID)
+    docs = [(course_ref, dict(COURSE), f"course {COURSE_ID}")]
+    for module in MODULES:
         module_ref = course_ref.collection('modules').document(module['id'])
-        module_ref.set({
+        docs.append((module_ref, {
             'title': module['title'],
             'description': module['description'],
             'order': module['order'],
-        }, merge=True)
-        print(f"[seed] Created/updated module: {module['id']}")
+        }, f"module {module['id']}"))
 
         for lesson_id, order, tier in module['lessons']:
-            storage_path = f"{bucket}/lessons-md/courses/{course_id}/modules/{module['id']}/lessons/{lesson_id}.md"
-            title = get_title_from_storage(storage_path)
+            relative_storage_path = lesson_path(module['id'], lesson_id)
+            title = titles[relative_storage_path]
             is_free = tier == 'free'
-            relative_storage_path = f"lessons-md/courses/{course_id}/modules/{module['id']}/lessons/{lesson_id}.md"
 
             # Lesson docs are world-readable metadata (firestore.rules). A
             # storagePath on a gated lesson doc would hand any signed-in user
@@ -173,23 +211,104 @@ def main() -> int:
                 'isFree': is_free,
                 'storagePath': relative_storage_path if is_free else firestore.DELETE_FIELD,
             }
-
-            lesson_ref = module_ref.collection('lessons').document(lesson_id)
-            lesson_ref.set(lesson_doc, merge=True)
+            docs.append((module_ref.collection('lessons').document(lesson_id), lesson_doc,
+                         f"  {lesson_id}: {title} ({tier})"))
 
             if not is_free:
                 # Same doc-id scheme as src/firebaseService.ts getLessonContentDocumentId
-                content_id = f"{course_id}__{module['id']}__{lesson_id}"
-                db.collection('lessonContent').document(content_id).set({
-                    'courseId': course_id,
+                content_id = f"{COURSE_ID}__{module['id']}__{lesson_id}"
+                docs.append((db.collection('lessonContent').document(content_id), {
+                    'courseId': COURSE_ID,
                     'moduleId': module['id'],
                     'lessonId': lesson_id,
                     'tier': tier,
                     'storagePath': relative_storage_path,
-                }, merge=True)
-            print(f"[seed]   {lesson_id}: {title} ({tier})")
+                }, f"  lessonContent {content_id}"))
+    return docs
+
+
+def changed_fields(current: Optional[Dict[str, Any]], data: Dict[str, Any]) -> List[str]:
+    """Fields a merge-set of ``data`` would change on a doc currently holding ``current``."""
+    if current is None:
+        return sorted(k for k, v in data.items() if v is not firestore.DELETE_FIELD) or ['<new doc>']
+    out = []
+    for k, v in data.items():
+        if v is firestore.DELETE_FIELD:
+            if k in current:
+                out.append(k)
+        elif current.get(k, object()) != v:
+            out.append(k)
+    return out
+
+
+def diff(db, docs: List[Tuple[Any, Dict[str, Any], str]]) -> List[Tuple[Any, Dict[str, Any], str, List[str]]]:
+    """Docs whose merge would change anything, read in one batched get_all."""
+    current = {snap.reference.path: (snap.to_dict() if snap.exists else None)
+               for snap in db.get_all([ref for ref, _, _ in docs])}
+    out = []
+    for ref, data, label in docs:
+        fields = changed_fields(current.get(ref.path), data)
+        if fields:
+            out.append((ref, data, label, fields))
+    return out
+
+
+def write(db, docs: List[Tuple[Any, Dict[str, Any], str, List[str]]]) -> int:
+    batches = 0
+    for i in range(0, len(docs), MAX_BATCH):
+        batch = db.batch()
+        for ref, data, _, _ in docs[i:i + MAX_BATCH]:
+            batch.set(ref, data, merge=True)
+        batch.commit()
+        batches += 1
+    return batches
+
+
+def _anonymous():
+    from google.auth.credentials import AnonymousCredentials
+
+    return AnonymousCredentials()
+
+
+def main() -> int:
+    p = argparse.ArgumentParser()
+    p.add_argument('--project', default='ai-integra-course-v2', help='GCP project ID')
+    p.add_argument('--bucket', default=BUCKET, help='Storage bucket holding lessons-md/')
+    p.add_argument('--workers', type=int, default=16, help='Concurrent Storage reads')
+    p.add_argument('--dry-run', action='store_true', help='Print the docs; do not touch Firestore')
+    p.add_argument('--diff', action='store_true', help='Print what would change; do not write')
+    p.add_argument('--force', action='store_true', help='Write every doc even if unchanged')
+    args = p.parse_args()
+
+    workers = max(1, args.workers)
+    bucket = storage_client(args.project, workers).bucket(args.bucket)
+    paths = [lesson_path(m['id'], lesson_id) for m in MODULES for lesson_id, _, _ in m['lessons']]
+    titles = fetch_titles(bucket, paths, workers)
+
+    if args.dry_run:
+        # Refs only need a client object, not a connection
+        docs = build_docs(firestore.Client(project=args.project, credentials=_anonymous()), titles)
+        for _, _, label in docs:
+            print(f"[dry-run] {label}")
+        print(f"\n{len(docs)} docs")
+        return 0
+
+    db = firestore.Client(project=args.project)
+    docs = build_docs(db, titles)
+    if args.force:
+        pending = [(ref, data, label, ['<forced>']) for ref, data, label in docs]
+    else:
+        pending = diff(db, docs)
+
+    tag = 'diff' if args.diff else 'seed'
+    for _, _, label, fields in pending:
+        print(f"[{tag}] {label} [{', '.join(fields)}]")
+    if args.diff:
+        print(f"\n{len(pending)} of {len(docs)} docs would change")
+        return 0
 
-    print('\nDone seeding course structure!')
+    batches = write(db, pending)
+    print(f"\nDone seeding course structure: {len(pending)} of {len(docs)} docs written in {batches} batch(es).")
     return 0
 
 
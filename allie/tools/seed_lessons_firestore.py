@@ -5,19 +5,30 @@ Seed lessons into Firestore for server-side protection of premium content.
 Requires Google credentials with Firestore access. Set GOOGLE_APPLICATION_CREDENTIALS
 to a service account JSON or use Application Default Credentials.
 
+Each doc stores a `contentHash` of its seeded fields (manifest metadata and
+markdown). A run reads only the stored hashes (one projection query), writes
+just the lessons whose hash changed through a BulkWriter, deletes seeded docs
+whose slug is no longer in the manifest, and prints a change report, so
+unchanged lessons keep their `updatedAt` and listeners stay quiet. Set
+FIRESTORE_EMULATOR_HOST to run against the Firestore emulator.
+
 Usage:
   python allie/tools/seed_lessons_firestore.py --project <gcp-project-id>
   # Optional flags:
   #   --include-free   Include free lessons as well
   #   --collection     Firestore collection (default: lessons)
+  #   --dry-run        Print the change report without writing
+  #   --force          Rewrite every lesson even if its hash matches
+  #   --no-delete      Keep docs that were dropped from the manifest
 """
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import os
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 from google.cloud import firestore
 
@@ -33,11 +44,49 @@ def read_file(repo_root: Path, rel_path: str) -> str:
   return p.read_text(encoding='utf-8')
 
 
+def content_hash(data: Dict[str, Any]) -> str:
+  canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+  return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def lesson_data(repo_root: Path, lesson: Dict[str, Any], tier: str) -> Dict[str, Any]:
+  video_id = lesson.get('videoId')
+
+  # Construct videoUrl for frontend (ReactPlayer) if videoId is present
+  video_url = None
+  if video_id and video_id != "YOUR_INTRO_VIDEO_ID" and video_id != "YOUR_SETUP_VIDEO_ID":
+    if video_id.startswith('http'):
+      video_url = video_id
+    else:
+      video_url = f"https://www.youtube.com/watch?v={video_id}"
+
+  return {
+    'slug': lesson['slug'],
+    'title': lesson['title'],
+    'tier': tier,
+    'videoId': video_id,
+    'videoUrl': video_url, # Added to match frontend schema
+    'thumbnailUrl': lesson.get('thumbnailUrl'),
+    'md': read_file(repo_root, lesson['path']),
+  }
+
+
+def stored_hashes(db: Any, collection: str) -> Dict[str, Any]:
+  """Doc id -> stored contentHash (None for docs seeded before hashing), without reading md bodies."""
+  return {
+    snap.id: (snap.to_dict() or {}).get('contentHash')
+    for snap in db.collection(collection).select(['contentHash']).stream()
+  }
+
+
 def main() -> int:
   p = argparse.ArgumentParser()
   p.add_argument('--project', help='GCP project ID (optional if ADC set)')
   p.add_argument('--include-free', action='store_true', help='Also seed free lessons')
   p.add_argument('--collection', default='lessons', help='Firestore collection name')
+  p.add_argument('--dry-run', action='store_true', help='Print the change report without writing')
+  p.add_argument('--force', action='store_true', help='Rewrite every lesson even if unchanged')
+  p.add_argument('--no-delete', action='store_true', help='Keep docs dropped from the manifest')
   args = p.parse_args()
 
   repo_root = Path(__file__).resolve().parents[2]
@@ -45,42 +94,64 @@ def main() -> int:
 
   db = firestore.Client(project=args.project) if args.project else firestore.Client()
 
-  def upsert(lesson: Dict[str, Any], tier: str) -> None:
-    slug = lesson['slug']
-    title = lesson['title']
-    video_id = lesson.get('videoId')
-    thumb = lesson.get('thumbnailUrl')
-    
-    # Construct videoUrl for frontend (ReactPlayer) if videoId is present
-    video_url = None
-    if video_id and video_id != "YOUR_INTRO_VIDEO_ID" and video_id != "YOUR_SETUP_VIDEO_ID":
-       if video_id.startswith('http'):
-           video_url = video_id
-       else:
-           video_url = f"https://www.youtube.com/watch?v={video_id}"
-
-    md = read_file(repo_root, lesson['path'])
-    data = {
-      'slug': slug,
-      'title': title,
-      'tier': tier,
-      'videoId': video_id,
-      'videoUrl': video_url, # Added to match frontend schema
-      'thumbnailUrl': thumb,
-      'md': md,
-      'updatedAt': firestore.SERVER_TIMESTAMP,
-    }
-    db.collection(args.collection).document(slug).set(data, merge=True)
-    print(f'[seed] upserted {slug} ({tier})')
-
-  if args.include_free:
-    for l in manifest.get('free', []):
-      upsert(l, 'free')
-  for l in manifest.get('premium', []):
-    upsert(l, 'premium')
-
-  print('Done.')
-  return 0
+  wanted: Dict[str, Dict[str, Any]] = {}
+  tiers = (['free'] if args.include_free else []) + ['premium']
+  for tier in tiers:
+    for l in manifest.get(tier, []):
+      wanted[l['slug']] = lesson_data(repo_root, l, tier)
+  # Free lessons left out by a premium-only run are still in the manifest
+  listed = {l['slug'] for lessons in manifest.values() for l in lessons}
+
+  current = stored_hashes(db, args.collection)
+  created: List[str] = []
+  updated: List[str] = []
+  unchanged: List[str] = []
+  writes: Dict[str, Dict[str, Any]] = {}
+  for slug, data in wanted.items():
+    digest = content_hash(data)
+    if slug not in current:
+      created.append(slug)
+    elif current[slug] != digest or args.force:
+      updated.append(slug)
+    else:
+      unchanged.append(slug)
+      continue
+    writes[slug] = {**data, 'contentHash': digest, 'updatedAt': firestore.SERVER_TIMESTAMP}
+
+  # Only docs this script seeded (they carry contentHash) are ever deleted
+  deleted = [] if args.no_delete else sorted(
+    slug for slug, digest in current.items() if digest is not None and slug not in listed
+  )
+
+  failed: List[str] = []
+  if not args.dry_run and (writes or deleted):
+    writer = db.bulk_writer()
+
+    def on_error(err: Any, _writer: Any) -> bool:
+      # Retried with BulkWriter's backoff; give up on a doc after a few attempts
+      if err.attempts < 5:
+        return True
+      failed.append(f"{err.operation.reference.id}: {err.message}")
+      return False
+
+    writer.on_write_error(on_error)
+    for slug, data in writes.items():
+      writer.set(db.collection(args.collection).document(slug), data, merge=True)
+    for slug in deleted:
+      writer.delete(db.collection(args.collection).document(slug))
+    writer.close()
+
+  tag = 'dry-run' if args.dry_run else 'seed'
+  for label, slugs in (('created', created), ('updated', updated), ('deleted', deleted)):
+    for slug in slugs:
+      print(f'[{tag}] {label} {slug}')
+  for line in failed:
+    print(f'[{tag}] FAILED {line}')
+  print(
+    f'Done: {len(created)} created, {len(updated)} updated, {len(deleted)} deleted, '
+    f'{len(unchanged)} unchanged, {len(failed)} failed.'
+  )
+  return 1 if failed else 0
 
 
 if __name__ == '__main__':
@@ -1,12 +1,40 @@
-"""Blueprint exposing the AI tutor endpoints for the Flask backend."""
+"""Blueprint exposing the AI tutor endpoints for the Flask backend.
+
+``/api/tutor`` and ``/api/recap`` answer with a single JSON body by default.
+Clients that send ``"stream": true`` in the JSON payload (or ``?stream=1``, or
+``Accept: text/event-stream``) get server-sent events instead::
+
+    data: {"delta": "Hel"}
+    data: {"delta": "lo"}
+    event: done
+    data: {"response": "Hello"}        # {"recap": ...} for /api/recap
+
+Errors raised before the first token keep the JSON error contract and status
+codes. An upstream failure after streaming has started can no longer change
+the status, so it is sent as ``event: error`` with the usual error payload.
+
+Answers come from the completion cache when possible. Otherwise identical
+concurrent requests are coalesced onto one upstream call (see
+``backend/single_flight.py``), which always streams; JSON clients simply wait
+for its ``done`` event.
+"""
 
 from __future__ import annotations
 
+import itertools
+import json
 import os
-from typing import Any, Dict, Tuple
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import openai
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
+
+from instrumentation import observe_span, observe_ttft, span
+
+from backend.completion_cache import Probe, completion_key, get_completion_cache
+from backend.openai_client import MODEL, Overloaded, gateway_stats, get_gateway
+from backend.single_flight import Flight, flights_enabled, get_flights
 
 bp = Blueprint("ai", __name__)
 
@@ -19,34 +47,184 @@ def _ensure_api_key() -> Tuple[bool, Dict[str, Any]]:
         current_app.logger.warning("OPENAI_API_KEY is not configured")
         return False, {"error": "OpenAI API key not configured"}
 
-    if openai.api_key != api_key:
-        openai.api_key = api_key
+    return True, {"api_key": api_key}
 
-    return True, {}
 
+def _failure(exc: Exception) -> Tuple[int, Dict[str, Any]]:
+    """Map an exception from the gateway onto the route's error contract."""
 
-def _call_openai(messages: Any, max_tokens: int) -> Tuple[int, Dict[str, Any]]:
-    """Proxy a chat completion to OpenAI with defensive error handling."""
+    if isinstance(exc, Overloaded):
+        current_app.logger.warning("Shedding AI request: %s", exc)
+        return 503, {"error": "AI tutor is busy, please retry", "retry_after": exc.retry_after}
+    if isinstance(exc, openai.APITimeoutError):
+        current_app.logger.warning("OpenAI timeout: %s", exc)
+        return 504, {"error": "Upstream OpenAI timeout"}
+    if isinstance(exc, openai.OpenAIError):
+        current_app.logger.exception("OpenAI error: %s", exc)
+        return 502, {"error": "Upstream OpenAI error", "details": str(exc)}
+    current_app.logger.exception("Unexpected error calling OpenAI: %s", exc)
+    return 500, {"error": "Internal server error"}
+
+
+def _open_stream(messages: Any, max_tokens: int) -> Tuple[int, Any]:
+    """Start a streaming completion; errors here still map to a status code."""
 
     ok, payload = _ensure_api_key()
     if not ok:
         return 503, payload
 
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=max_tokens,
+        return 200, get_gateway(payload["api_key"]).stream(messages, max_tokens=max_tokens, model=MODEL)
+    except Exception as exc:
+        return _failure(exc)
+
+
+def _sse(data: Dict[str, Any], event: str | None = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
+
+
+def _produce(flight: Flight, messages: Any, max_tokens: int, remember: Callable[[str], None]) -> None:
+    """Run one upstream completion, publishing its deltas into ``flight``."""
+
+    status, chunks = _open_stream(messages, max_tokens)
+    if status != 200:
+        flight.publish("error", (status, chunks))
+        return
+
+    parts = []
+    try:
+        for text in chunks:
+            if flight.cancelled:
+                # Every subscriber went away: stop paying for tokens
+                return
+            parts.append(text)
+            flight.publish("delta", text)
+    except Exception as exc:
+        flight.publish("error", _failure(exc))
+        return
+    finally:
+        chunks.close()
+
+    content = "".join(parts).strip()
+    remember(content)
+    flight.publish("done", content)
+
+
+def _relay(
+    endpoint: str,
+    first: Tuple[str, Any],
+    events: Iterator[Tuple[str, Any]],
+    result_key: str,
+    started: float,
+) -> Iterator[str]:
+    """Forward flight events as SSE, recording the completion time."""
+
+    kind, data = first
+    try:
+        while True:
+            if kind == "delta":
+                yield _sse({"delta": data})
+            elif kind == "done":
+                observe_span(f"{endpoint}_completion", time.perf_counter() - started)
+                yield _sse({result_key: data}, event="done")
+                return
+            else:
+                yield _sse(data[1], event="error")
+                return
+            kind, data = next(events)
+    finally:
+        events.close()
+
+
+def _replay(content: str, result_key: str) -> Iterator[str]:
+    """A cached answer, streamed in the same event format as a live one."""
+
+    yield _sse({"delta": content})
+    yield _sse({result_key: content}, event="done")
+
+
+def _wants_stream(data: Dict[str, Any]) -> bool:
+    if data.get("stream") is True:
+        return True
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return request.accept_mimetypes.best == "text/event-stream"
+
+
+def _error_response(status: int, payload: Dict[str, Any]):
+    headers = {"Retry-After": str(payload["retry_after"])} if "retry_after" in payload else {}
+    return jsonify(payload), status, headers
+
+
+def _embedder(near: bool) -> Optional[Callable[[str], List[float]]]:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not near or not api_key:
+        return None
+    return get_gateway(api_key).embed
+
+
+def _respond(endpoint: str, messages: Any, max_tokens: int, result_key: str, stream: bool, near: bool = False):
+    started = time.perf_counter()
+    cache = get_completion_cache()
+    probe: Optional[Probe] = None
+    embed = None
+    if cache is not None:
+        embed = _embedder(near)
+        with span("completion_cache"):
+            content, probe = cache.lookup(messages, max_tokens, MODEL, embed)
+        if content is not None:
+            observe_span(f"{endpoint}_cache_hit", time.perf_counter() - started)
+            headers = {"X-Cache": probe.hit or "exact"}
+            if stream:
+                headers.update({"Cache-Control": "no-cache"})
+                return Response(_replay(content, result_key), mimetype="text/event-stream", headers=headers)
+            return jsonify({result_key: content}), 200, headers
+
+    def remember(content: str) -> None:
+        if cache is not None and probe is not None:
+            cache.store(probe, content, embed)
+
+    app = current_app._get_current_object()
+
+    def produce(flight: Flight) -> None:
+        with app.app_context():
+            _produce(flight, messages, max_tokens, remember)
+
+    key = None
+    if flights_enabled():
+        key = probe.key if probe is not None else completion_key(messages, max_tokens, MODEL)[1]
+    flights = get_flights()
+    flight, leader = flights.join(key, produce)
+    events = flight.subscribe(flights.timeout)
+
+    # Wait for the first event so errors before any token keep their status
+    kind, data = next(events)
+    if kind == "error":
+        events.close()
+        return _error_response(*data)
+    # Only a streamed call that started its own upstream request measures
+    # time to first token: JSON clients never see it, and a joiner's wait
+    # depends on how far along the leader already was
+    if kind == "delta" and stream and leader:
+        ttft = time.perf_counter() - started
+        observe_ttft(endpoint, ttft)
+        current_app.logger.info("%s ttft_ms=%.1f", endpoint, ttft * 1000.0)
+
+    if stream:
+        return Response(
+            stream_with_context(_relay(endpoint, (kind, data), events, result_key, started)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Cache": "miss"},
         )
-    except openai.error.OpenAIError as exc:  # type: ignore[attr-defined]
-        current_app.logger.exception("OpenAI error: %s", exc)
-        return 502, {"error": "Upstream OpenAI error", "details": str(exc)}
-    except Exception as exc:  # pragma: no cover - safeguard against unexpected libs
-        current_app.logger.exception("Unexpected error calling OpenAI: %s", exc)
-        return 500, {"error": "Internal server error"}
 
-    message = response.choices[0].message.content if response.choices else ""
-    return 200, {"content": message.strip()}
+    for kind, data in itertools.chain([(kind, data)], events):
+        if kind == "error":
+            return _error_response(*data)
+        if kind == "done":
+            observe_span(f"{endpoint}_completion", time.perf_counter() - started)
+            return jsonify({result_key: data}), 200, {"X-Cache": "miss"}
+    return _error_response(500, {"error": "Internal server error"})  # pragma: no cover - flights always end
 
 
 @bp.route("/api/tutor", methods=["POST"])
@@ -56,19 +234,18 @@ def tutor_chat():
     if not prompt:
         return jsonify({"error": "No prompt provided"}), 400
 
-    status, payload = _call_openai(
+    return _respond(
+        "tutor",
         [
             {"role": "system", "content": "You are Moe, a compassionate AI tutor."},
             {"role": "user", "content": prompt},
         ],
         max_tokens=500,
+        result_key="response",
+        stream=_wants_stream(data),
+        near=True,
     )
 
-    if status != 200:
-        return jsonify(payload), status
-
-    return jsonify({"response": payload.get("content", "")})
-
 
 @bp.route("/api/recap", methods=["POST"])
 def personalized_recap():
@@ -82,15 +259,27 @@ def personalized_recap():
         "to reinforce learning and suggest next actions."
     )
 
-    status, payload = _call_openai(
+    return _respond(
+        "recap",
         [
             {"role": "system", "content": system_msg},
             {"role": "user", "content": user_text},
         ],
         max_tokens=300,
+        result_key="recap",
+        stream=_wants_stream(data),
     )
 
-    if status != 200:
-        return jsonify(payload), status
 
-    return jsonify({"recap": payload.get("content", "")})
+@bp.route("/api/ai/metrics", methods=["GET"])
+def ai_metrics():
+    """Upstream, cache and coalescing state; latencies are on ``/metrics``."""
+
+    cache = get_completion_cache()
+    return jsonify(
+        {
+            "upstream": gateway_stats(),
+            "cache": cache.stats() if cache is not None else None,
+            "single_flight": get_flights().stats(),
+        }
+    )
@@ -0,0 +1,289 @@
+"""Completion cache in front of the OpenAI gateway.
+
+Entries are keyed by sha256 of model, system message, ``max_tokens`` and the
+normalized user prompt (case-folded, whitespace collapsed, trailing
+punctuation dropped), so "What is an embedding?" and "what is an embedding"
+share one answer. With ``AI_CACHE_SIMILARITY`` set (e.g. ``0.95``), routes
+that opt in also match near-duplicate prompts whose embedding cosine
+similarity to a cached prompt is at least that threshold.
+
+Backends (``AI_CACHE``):
+
+* ``memory`` (default) – per-process LRU bounded by ``AI_CACHE_SIZE`` entries
+  with a ``AI_CACHE_TTL`` second expiry;
+* ``redis`` – any Redis-compatible server at ``AI_CACHE_REDIS_URL``, shared by
+  all workers; entries expire after ``AI_CACHE_TTL`` and size is bounded by
+  the server's ``maxmemory`` / ``allkeys-lru`` policy;
+* ``off`` – no caching.
+
+The near-duplicate index always lives in process memory (the newest
+``AI_CACHE_SIZE`` prompt vectors) and points at keys in the backend, so an
+expired or evicted answer is simply a miss.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Embed = Callable[[str], List[float]]
+
+_WS = re.compile(r"\s+")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def normalize_prompt(text: str) -> str:
+    return _WS.sub(" ", text.casefold()).strip().rstrip("?!. ")
+
+
+def completion_key(messages: List[Dict[str, Any]], max_tokens: int, model: str) -> Tuple[str, str, str]:
+    """Return ``(scope, key, normalized prompt)`` for a chat request."""
+
+    system = "\n".join(str(m.get("content") or "") for m in messages if m.get("role") == "system")
+    prompt = normalize_prompt("\n".join(str(m.get("content") or "") for m in messages if m.get("role") != "system"))
+    scope = hashlib.sha256(json.dumps([model, system, max_tokens]).encode("utf-8")).hexdigest()
+    key = hashlib.sha256(f"{scope}\x00{prompt}".encode("utf-8")).hexdigest()
+    return scope, key, prompt
+
+
+class MemoryBackend:
+    """Thread-safe LRU with per-entry expiry."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._data), "maxsize": self.maxsize, "evictions": self.evictions}
+
+
+class RedisBackend:
+    """Redis-compatible backend shared by every worker process."""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "ai-cache:") -> None:
+        import redis  # optional dependency, only needed for AI_CACHE=redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.ttl = max(1, int(ttl))
+        self.prefix = prefix
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception:
+            # A cache outage must never fail the request
+            self.errors += 1
+            return None
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self.client.set(self.prefix + key, value.encode("utf-8"), ex=self.ttl)
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "errors": self.errors}
+
+
+class _NearIndex:
+    """Ring buffer of unit prompt vectors searched with one matrix product."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(1, capacity)
+        self._lock = threading.Lock()
+        self._mat: Any = None
+        self._keys: List[str] = [""] * self.capacity
+        self._scopes: List[str] = [""] * self.capacity
+        self._pos = 0
+        self._size = 0
+
+    def add(self, scope: str, key: str, vec: Any) -> None:
+        import numpy as np
+
+        with self._lock:
+            if self._mat is None:
+                self._mat = np.zeros((self.capacity, vec.shape[0]), dtype=np.float32)
+            if vec.shape[0] != self._mat.shape[1]:
+                return
+            self._mat[self._pos] = vec
+            self._keys[self._pos] = key
+            self._scopes[self._pos] = scope
+            self._pos = (self._pos + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def best(self, scope: str, vec: Any, threshold: float) -> Optional[str]:
+        with self._lock:
+            if self._mat is None or self._size == 0 or vec.shape[0] != self._mat.shape[1]:
+                return None
+            sims = self._mat[: self._size] @ vec
+            for i in sims.argsort()[::-1]:
+                if sims[i] < threshold:
+                    return None
+                if self._scopes[i] == scope:
+                    return self._keys[i]
+        return None
+
+
+@dataclass
+class Probe:
+    """Result of a lookup, reused to store the answer on a miss."""
+
+    key: str
+    scope: str
+    prompt: str
+    near: bool
+    vector: Any = None
+    hit: Optional[str] = None  # "exact" or "near"
+
+
+class CompletionCache:
+    def __init__(self, backend: Any, similarity: float = 0.0, max_vectors: int = 10000) -> None:
+        self.backend = backend
+        self.similarity = similarity
+        self._near = _NearIndex(max_vectors) if similarity > 0 else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def lookup(
+        self,
+        messages: List[Dict[str, Any]],
+        max_tokens: int,
+        model: str,
+        embed: Optional[Embed] = None,
+    ) -> Tuple[Optional[str], Probe]:
+        scope, key, prompt = completion_key(messages, max_tokens, model)
+        probe = Probe(key=key, scope=scope, prompt=prompt, near=self._near is not None and embed is not None)
+
+        value = self.backend.get(key)
+        if value is not None:
+            self._count("hits")
+            probe.hit = "exact"
+            return value, probe
+
+        if probe.near:
+            probe.vector = self._embed(embed, prompt)
+            if probe.vector is not None:
+                match = self._near.best(scope, probe.vector, self.similarity)
+                value = self.backend.get(match) if match else None
+                if value is not None:
+                    self._count("near_hits")
+                    probe.hit = "near"
+                    return value, probe
+
+        self._count("misses")
+        return None, probe
+
+    def store(self, probe: Probe, content: str, embed: Optional[Embed] = None) -> None:
+        if not content:
+            return
+        self.backend.set(probe.key, content)
+        self._count("stores")
+        if probe.near:
+            if probe.vector is None and embed is not None:
+                probe.vector = self._embed(embed, probe.prompt)
+            if probe.vector is not None:
+                self._near.add(probe.scope, probe.key, probe.vector)
+
+    @staticmethod
+    def _embed(embed: Embed, text: str) -> Any:
+        import numpy as np
+
+        try:
+            vec = np.asarray(embed(text), dtype=np.float32)
+        except Exception:
+            # Near-duplicate matching is best effort; exact matching still works
+            return None
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.near_hits + self.misses
+            out = {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": round((self.hits + self.near_hits) / total, 4) if total else 0.0,
+                "similarity": self.similarity,
+            }
+        out.update(self.backend.stats())
+        return out
+
+
+_cache: Optional[CompletionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """Return the process-wide cache, or None when ``AI_CACHE=off``."""
+
+    global _cache
+    if _cache is not None:
+        return _cache
+    mode = os.getenv("AI_CACHE", "memory").lower()
+    if mode in ("off", "0", "false", "none"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            size = _env_int("AI_CACHE_SIZE", 5000)
+            ttl = _env_float("AI_CACHE_TTL", 86400.0)
+            if mode == "redis":
+                backend: Any = RedisBackend(os.getenv("AI_CACHE_REDIS_URL", "redis://localhost:6379/0"), ttl)
+            else:
+                backend = MemoryBackend(size, ttl)
+            _cache = CompletionCache(backend, _env_float("AI_CACHE_SIMILARITY", 0.0), size)
+    return _cache
@@ -3,13 +3,18 @@
 from __future__ import annotations
 
 import os
+import signal
+import threading
 from functools import lru_cache
 from pathlib import Path
 from typing import Tuple
 
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, request
 from flask_cors import CORS
 
+from backend import static_assets
+from instrumentation import instrument_flask
+
 
 @lru_cache(maxsize=1)
 def _frontend_build_dir() -> Tuple[Path, Path]:
@@ -26,13 +31,33 @@ def _frontend_build_dir() -> Tuple[Path, Path]:
     return fallback, fallback / "index.html"
 
 
+def _resolve_frontend() -> Tuple[Path, Path]:
+    _frontend_build_dir.cache_clear()
+    return _frontend_build_dir()
+
+
+def reload_frontend() -> static_assets.Manifest:
+    """Re-resolve FRONTEND_BUILD_DIR and rebuild the static manifest."""
+
+    return static_assets.reload(*_resolve_frontend())
+
+
+def _install_reload_signal() -> None:
+    # Signal handlers can only be set from the main thread (not under a
+    # threaded test runner or when imported by a worker thread)
+    if threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda *_: reload_frontend())
+
+
 def create_app() -> Flask:
     """Create a Flask app instance with registered routes and static serving."""
 
-    static_dir, _ = _frontend_build_dir()
-    static_root = str(static_dir)
-    app = Flask(__name__, static_folder=static_root, static_url_path="")
+    # Assets are served from an in-memory manifest (see static_assets.py)
+    # rather than Flask's static route, which would also shadow the SPA
+    # fallback below.
+    app = Flask(__name__, static_folder=None)
     CORS(app)
+    instrument_flask(app)
 
     from backend.ai_routes import bp as ai_blueprint
 
@@ -42,21 +67,24 @@ def create_app() -> Flask:
     def healthcheck():  # pragma: no cover - trivial endpoint
         return jsonify({"status": "ok"})
 
+    reload_frontend()
+    _install_reload_signal()
+
     @app.route("/", defaults={"path": ""})
     @app.route("/<path:path>")
     def serve_frontend(path: str):
-        static_dir, index_html = _frontend_build_dir()
-        static_root = str(static_dir)
-        target = static_dir / path if path else index_html
-
-        if path and target.exists() and target.is_file():
-            return send_from_directory(static_root, path)
+        manifest = static_assets.get_manifest(_resolve_frontend)
+        asset = manifest.lookup(path) if path else None
+        if asset is None:
+            if path.startswith("api/"):
+                return jsonify({"error": "Not found"}), 404
+            asset = manifest.index
 
-        if index_html.exists():
-            return send_from_directory(static_root, "index.html")
+        if asset is not None:
+            return static_assets.respond(asset, request)
 
         return (
-            jsonify({"error": "Frontend build not found", "path": str(index_html)}),
+            jsonify({"error": "Frontend build not found", "path": str(manifest.index_html)}),
             500,
         )
 
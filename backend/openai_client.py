@@ -0,0 +1,312 @@
+"""Process-wide OpenAI client with admission control for the Flask backend.
+
+Every upstream call goes through :func:`get_gateway`, which owns:
+
+* one long-lived ``openai.OpenAI`` client on a keep-alive ``httpx`` pool with
+  explicit connect/read timeouts;
+* a bounded wait queue in front of ``OPENAI_CONCURRENCY`` upstream slots –
+  when ``OPENAI_QUEUE_SIZE`` callers are already waiting, or a caller waits
+  longer than ``OPENAI_QUEUE_TIMEOUT`` seconds, :class:`Overloaded` is raised
+  and the route answers 503 instead of tying up a worker;
+* token buckets for requests per minute (``OPENAI_RPM``) and tokens per
+  minute (``OPENAI_TPM``, charged with a prompt estimate plus ``max_tokens``);
+* retries with full-jitter exponential backoff on 429, 5xx, timeouts and
+  connection errors, honouring ``Retry-After``.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+import httpx
+import openai
+
+from instrumentation import in_flight_gauge, queue_gauge, span
+
+T = TypeVar("T")
+
+MODEL = "gpt-4o-mini"
+EMBED_MODEL = "text-embedding-3-small"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+class Overloaded(Exception):
+    """Raised when the upstream queue is full or the wait would be too long."""
+
+    def __init__(self, reason: str, retry_after: float = 1.0) -> None:
+        super().__init__(reason)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at ``rate`` per second.
+
+    ``acquire`` reserves tokens up front (the balance may go negative) and then
+    sleeps off the debt, so concurrent callers are served in arrival order
+    without holding the lock while sleeping.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float, max_wait: float) -> None:
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            wait = max(0.0, (amount - self._tokens) / self.rate)
+            if wait > max_wait:
+                raise Overloaded("rate limit budget exhausted", retry_after=wait)
+            self._tokens -= amount
+        if wait:
+            time.sleep(wait)
+
+
+class Gate:
+    """At most ``limit`` callers inside, at most ``max_waiting`` queued."""
+
+    def __init__(self, limit: int, max_waiting: int) -> None:
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)
+        self._sem = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self, timeout: float) -> None:
+        if not self._sem.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    raise Overloaded("upstream queue full")
+                self.waiting += 1
+            try:
+                acquired = self._sem.acquire(timeout=timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected += 1
+                raise Overloaded("timed out waiting for an upstream slot")
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        self._sem.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "rejected": self.rejected,
+            }
+
+
+def _retryable(exc: BaseException) -> bool:
+    if isinstance(exc, openai.APIConnectionError):  # includes timeouts
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409, 429) or exc.status_code >= 500
+    return False
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    # ~4 characters per token is close enough for budgeting
+    chars = sum(len(str(m.get("content") or "")) for m in messages)
+    return chars // 4 + max_tokens
+
+
+class ChatStream:
+    """Iterator of text deltas that gives its upstream slot back on close."""
+
+    def __init__(self, upstream: Any, release: Callable[[], None]) -> None:
+        self._upstream = upstream
+        self._release: Optional[Callable[[], None]] = release
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self._upstream:
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    yield text
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._release is None:
+            return
+        release, self._release = self._release, None
+        try:
+            close = getattr(self._upstream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            release()
+
+
+class OpenAIGateway:
+    def __init__(self, api_key: str) -> None:
+        self.api_key = api_key
+        timeout = httpx.Timeout(
+            _env_float("OPENAI_TIMEOUT", 60.0),
+            connect=_env_float("OPENAI_CONNECT_TIMEOUT", 5.0),
+        )
+        max_connections = _env_int("OPENAI_MAX_CONNECTIONS", 32)
+        self._http = httpx.Client(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=_env_float("OPENAI_KEEPALIVE_S", 30.0),
+            ),
+        )
+        # Retries are ours (jittered, budget-aware), not the SDK's
+        self.client = openai.OpenAI(api_key=api_key, timeout=timeout, max_retries=0, http_client=self._http)
+        self.gate = Gate(_env_int("OPENAI_CONCURRENCY", 16), _env_int("OPENAI_QUEUE_SIZE", 64))
+        self.queue_timeout = _env_float("OPENAI_QUEUE_TIMEOUT", 10.0)
+        rpm = _env_float("OPENAI_RPM", 500.0)
+        tpm = _env_float("OPENAI_TPM", 200000.0)
+        self.requests = TokenBucket(rpm / 60.0, rpm / 60.0 * 10) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm / 60.0, tpm / 60.0 * 10) if tpm > 0 else None
+        self.max_retries = _env_int("OPENAI_MAX_RETRIES", 2)
+        self.backoff_base = _env_float("OPENAI_BACKOFF_BASE", 0.5)
+        self.backoff_max = _env_float("OPENAI_BACKOFF_MAX", 8.0)
+        self.retries = 0
+        queue_gauge("openai", lambda: self.gate.waiting)
+        in_flight_gauge("openai", lambda: self.gate.in_flight)
+
+    def _admit(self, messages: List[Dict[str, Any]], max_tokens: int) -> None:
+        deadline = time.monotonic() + self.queue_timeout
+        self.gate.acquire(self.queue_timeout)
+        try:
+            if self.requests is not None:
+                self.requests.acquire(1, max(0.0, deadline - time.monotonic()))
+            if self.tokens is not None:
+                self.tokens.acquire(_estimate_tokens(messages, max_tokens), max(0.0, deadline - time.monotonic()))
+        except BaseException:
+            self.gate.release()
+            raise
+
+    def _with_retries(self, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            try:
+                # For streams this is the time until response headers
+                with span("openai_upstream"):
+                    return fn()
+            except openai.OpenAIError as exc:
+                if attempt >= self.max_retries or not _retryable(exc):
+                    raise
+                delay = _retry_after(exc)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                attempt += 1
+                self.retries += 1
+                time.sleep(min(delay, self.backoff_max))
+
+    def complete(self, messages: List[Dict[str, Any]], max_tokens: int, model: str = MODEL) -> str:
+        self._admit(messages, max_tokens)
+        try:
+            response = self._with_retries(
+                lambda: self.client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens)
+            )
+        finally:
+            self.gate.release()
+        message = response.choices[0].message.content if response.choices else ""
+        return (message or "").strip()
+
+    def embed(self, text: str, model: str = EMBED_MODEL) -> List[float]:
+        """Embed one string under the same admission and retry policy."""
+
+        self._admit([{"content": text}], 0)
+        try:
+            response = self._with_retries(lambda: self.client.embeddings.create(model=model, input=text))
+        finally:
+            self.gate.release()
+        return list(response.data[0].embedding)
+
+    def stream(self, messages: List[Dict[str, Any]], max_tokens: int, model: str = MODEL) -> ChatStream:
+        """Open a streaming completion; the slot is held until the stream closes."""
+
+        self._admit(messages, max_tokens)
+        try:
+            upstream = self._with_retries(
+                lambda: self.client.chat.completions.create(
+                    model=model, messages=messages, max_tokens=max_tokens, stream=True
+                )
+            )
+        except BaseException:
+            self.gate.release()
+            raise
+        return ChatStream(upstream, self.gate.release)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"gate": self.gate.stats(), "retries": self.retries}
+
+    def close(self) -> None:
+        self._http.close()
+
+
+_gateway: Optional[OpenAIGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway(api_key: str) -> OpenAIGateway:
+    """Return the process-wide gateway, rebuilding it if the key changed."""
+
+    global _gateway
+    gw = _gateway
+    if gw is not None and gw.api_key == api_key:
+        return gw
+    with _gateway_lock:
+        if _gateway is None or _gateway.api_key != api_key:
+            # The old client is left to in-flight requests and the GC
+            _gateway = OpenAIGateway(api_key)
+        return _gateway
+
+
+def gateway_stats() -> Dict[str, Any]:
+    gw = _gateway
+    return gw.stats() if gw is not None else {}
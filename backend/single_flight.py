@@ -0,0 +1,256 @@
+"""Single-flight coalescing of identical in-flight completions.
+
+Requests with the same completion key (see ``completion_cache.completion_key``)
+share one upstream call. The call runs on a background thread and publishes
+its events (``delta``, then ``done`` or ``error``) into a :class:`Flight`;
+every request subscribes from the first event, so a streaming client that
+joins late still receives the prefix produced so far, and a JSON client waits
+for ``done``. A flight that every local subscriber has abandoned is cancelled
+and its upstream stream closed.
+
+``AI_SINGLE_FLIGHT`` selects the scope:
+
+* ``local`` – coalesce within one worker process (all Flask threads);
+* ``redis`` – also across processes and hosts. The first process to
+  ``SET NX`` the flight's lock in the Redis-compatible server at
+  ``AI_CACHE_REDIS_URL`` calls upstream and mirrors its events into a Redis
+  stream; other processes replay that stream into their own local flight.
+  Default when ``AI_CACHE=redis``;
+* ``off`` – every request gets its own flight.
+
+Subscribers that see no new event for ``AI_FLIGHT_TIMEOUT`` seconds give up
+with a 504 error event.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from instrumentation import in_flight_gauge
+
+Event = Tuple[str, Any]
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _timeout_event() -> Event:
+    return "error", (504, {"error": "Timed out waiting for the AI response"})
+
+
+class Flight:
+    """Append-only event log for one upstream call, replayable by any subscriber."""
+
+    def __init__(self, key: Optional[str], cancellable: bool = True) -> None:
+        self.key = key
+        self.cancellable = cancellable
+        self.events: List[Event] = []
+        self.done = False
+        self.cancelled = False
+        self.subscribers = 0
+        self.mirror: Optional[Callable[[str, Any], None]] = None
+        self._cond = threading.Condition()
+
+    def publish(self, kind: str, data: Any) -> None:
+        with self._cond:
+            if self.done:
+                return
+            self.events.append((kind, data))
+            self.done = kind != "delta"
+            self._cond.notify_all()
+        if self.mirror is not None:
+            self.mirror(kind, data)
+
+    def subscribe(self, timeout: float) -> Iterator[Event]:
+        """Yield every event from the start, blocking for new ones until the end."""
+
+        with self._cond:
+            self.subscribers += 1
+        seen = 0
+        try:
+            while True:
+                with self._cond:
+                    while seen >= len(self.events):
+                        if not self._cond.wait(timeout):
+                            break
+                    batch = self.events[seen:]
+                    seen = len(self.events)
+                if not batch:
+                    yield _timeout_event()
+                    return
+                for event in batch:
+                    yield event
+                    if event[0] != "delta":
+                        return
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                if self.subscribers == 0 and not self.done and self.cancellable:
+                    self.cancelled = True
+
+
+class Flights:
+    """Registry of in-flight calls, optionally coordinated through Redis."""
+
+    def __init__(self, redis_client: Any = None, timeout: float = 90.0, prefix: str = "ai-flight:") -> None:
+        self.redis = redis_client
+        self.timeout = timeout
+        self.prefix = prefix
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.joined = 0
+        self.remote = 0
+        self.redis_errors = 0
+
+    def join(self, key: Optional[str], produce: Callable[[Flight], None]) -> Tuple[Flight, bool]:
+        """Return the flight for ``key``, starting ``produce`` if there is none.
+
+        ``produce`` runs on a background thread and must end by publishing
+        ``done`` or ``error``; it should stop early once ``flight.cancelled``.
+        The flag is true when this call started ``produce`` (the leader), false
+        when it joined a flight already running here or in another process.
+        """
+
+        if key is None:
+            flight = Flight(None)
+            self._start(flight, produce)
+            return flight, True
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.cancelled:
+                self.joined += 1
+                return flight, False
+            # Other processes may be following us, so never cancel under Redis
+            flight = Flight(key, cancellable=self.redis is None)
+            self._flights[key] = flight
+
+        if self.redis is not None and not self._claim(flight):
+            self.remote += 1
+            self._start(flight, self._follow_remote)
+            return flight, False
+        with self._lock:
+            self.leaders += 1
+        self._start(flight, produce)
+        return flight, True
+
+    def _start(self, flight: Flight, produce: Callable[[Flight], None]) -> None:
+        def run() -> None:
+            try:
+                produce(flight)
+            except Exception as exc:  # pragma: no cover - produce maps its own errors
+                flight.publish("error", (500, {"error": "Internal server error", "details": str(exc)}))
+            finally:
+                # Terminal events are always published, even on cancellation
+                flight.publish("error", (499, {"error": "Cancelled"}))
+                if flight.key is not None:
+                    with self._lock:
+                        if self._flights.get(flight.key) is flight:
+                            del self._flights[flight.key]
+
+        threading.Thread(target=run, name="ai-flight", daemon=True).start()
+
+    # Redis coordination -------------------------------------------------
+
+    def _claim(self, flight: Flight) -> bool:
+        """Try to become the cross-process leader; mirror events if we do."""
+
+        lock_key = f"{self.prefix}lock:{flight.key}"
+        stream_key = f"{self.prefix}events:{flight.key}"
+        token = uuid.uuid4().hex
+        try:
+            if not self.redis.set(lock_key, token, nx=True, px=int(self.timeout * 1000)):
+                return False
+            # Drop the event log of a previous flight for the same key
+            self.redis.delete(stream_key)
+        except Exception:
+            self.redis_errors += 1
+            return True
+
+        def mirror(kind: str, data: Any) -> None:
+            try:
+                self.redis.xadd(stream_key, {"k": kind, "d": json.dumps(data)})
+                if kind != "delta":
+                    self.redis.expire(stream_key, int(self.timeout))
+                    if self.redis.get(lock_key) == token.encode():
+                        self.redis.delete(lock_key)
+            except Exception:
+                self.redis_errors += 1
+
+        flight.mirror = mirror
+        return True
+
+    def _follow_remote(self, flight: Flight) -> None:
+        stream_key = f"{self.prefix}events:{flight.key}"
+        last = "0"
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            try:
+                batch = self.redis.xread({stream_key: last}, count=100, block=1000)
+            except Exception:
+                self.redis_errors += 1
+                break
+            for _, entries in batch or []:
+                for entry_id, fields in entries:
+                    last = entry_id
+                    kind = fields[b"k"].decode()
+                    data = json.loads(fields[b"d"])
+                    flight.publish(kind, tuple(data) if kind == "error" else data)
+                    if kind != "delta":
+                        return
+                deadline = time.monotonic() + self.timeout
+        flight.publish(*_timeout_event())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": "redis" if self.redis is not None else "local",
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "joined": self.joined,
+                "remote_followers": self.remote,
+                "redis_errors": self.redis_errors,
+            }
+
+
+_flights: Optional[Flights] = None
+_flights_lock = threading.Lock()
+
+
+def flights_enabled() -> bool:
+    return _mode() != "off"
+
+
+def _mode() -> str:
+    default = "redis" if os.getenv("AI_CACHE", "memory").lower() == "redis" else "local"
+    return os.getenv("AI_SINGLE_FLIGHT", default).lower()
+
+
+def get_flights() -> Flights:
+    global _flights
+    if _flights is not None:
+        return _flights
+    with _flights_lock:
+        if _flights is None:
+            client = None
+            if _mode() == "redis":
+                import redis  # optional dependency, only needed for AI_SINGLE_FLIGHT=redis
+
+                client = redis.Redis.from_url(
+                    os.getenv("AI_CACHE_REDIS_URL", "redis://localhost:6379/0"),
+                    socket_timeout=5.0,
+                    socket_connect_timeout=0.5,
+                )
+            _flights = Flights(client, _env_float("AI_FLIGHT_TIMEOUT", 90.0))
+            in_flight_gauge("single_flight", lambda: len(_flights._flights))
+    return _flights
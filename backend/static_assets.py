@@ -0,0 +1,251 @@
+"""In-memory manifest and precompressed serving for the frontend build.
+
+At startup every file under the build directory is stat'ed and hashed once
+into a :class:`Manifest`, so requests are answered from a dict lookup instead
+of filesystem checks. Each asset gets:
+
+* a strong ``ETag`` (content sha256) with ``If-None-Match`` → 304;
+* ``Cache-Control: public, max-age=31536000, immutable`` when its name
+  carries a build hash (``assets/index-B1x9kQ2a.js``), ``no-cache`` otherwise
+  so ``index.html`` is always revalidated;
+* ``.br`` / ``.gz`` variants picked by ``Accept-Encoding`` – taken from
+  sibling files produced by the build when present, otherwise compressed in
+  memory at startup for text-like types (``STATIC_COMPRESS=0`` disables,
+  brotli needs the optional ``brotli`` package);
+* ``Range`` support (206) on the identity encoding.
+
+Call :func:`reload` (or send the process ``SIGHUP``) after a new build is
+deployed; a changed ``FRONTEND_BUILD_DIR`` is picked up on the next request.
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from flask import Request, Response
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Vite/Rollup style content hashes: name-<8+ url-safe chars>.ext
+_HASHED = re.compile(r"[.-]([A-Za-z0-9_-]{8,})\.[A-Za-z0-9]+$")
+_COMPRESSIBLE = re.compile(
+    r"^(text/|application/(javascript|json|xml|manifest\+json|wasm)|image/svg\+xml)"
+)
+_SIBLINGS = {".br": "br", ".gz": "gzip"}
+
+
+def _is_hashed(rel: str) -> bool:
+    match = _HASHED.search(rel)
+    return bool(match and any(c.isdigit() for c in match.group(1)))
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class Variant:
+    size: int
+    path: Optional[Path] = None
+    data: Optional[bytes] = None
+
+
+@dataclass
+class Asset:
+    rel: str
+    path: Path
+    size: int
+    mtime: float
+    etag: str
+    mimetype: str
+    cache_control: str
+    variants: Dict[str, Variant] = field(default_factory=dict)
+
+
+class Manifest:
+    """Snapshot of one build directory."""
+
+    def __init__(self, root: Path, index_html: Path, compress: bool = True, compress_max: int = 8 << 20):
+        self.root = root
+        self.index_html = index_html
+        self.assets: Dict[str, Asset] = {}
+        self.compressed_bytes = 0
+        if root.is_dir():
+            self._scan(compress, compress_max)
+
+    def _scan(self, compress: bool, compress_max: int) -> None:
+        files = [p for p in self.root.rglob("*") if p.is_file()]
+        names = {p.relative_to(self.root).as_posix() for p in files}
+        for path in files:
+            rel = path.relative_to(self.root).as_posix()
+            st = path.stat()
+            mimetype, encoded = mimetypes.guess_type(rel)
+            if encoded or mimetype is None:
+                # foo.js.gz itself is opaque bytes, not JavaScript
+                mimetype = "application/octet-stream"
+            asset = Asset(
+                rel=rel,
+                path=path,
+                size=st.st_size,
+                mtime=st.st_mtime,
+                etag=_sha256(path),
+                mimetype=mimetype,
+                cache_control=IMMUTABLE if _is_hashed(rel) else REVALIDATE,
+            )
+            for suffix, encoding in _SIBLINGS.items():
+                if rel + suffix in names:
+                    sibling = path.with_name(path.name + suffix)
+                    asset.variants[encoding] = Variant(size=sibling.stat().st_size, path=sibling)
+            if compress and _COMPRESSIBLE.match(mimetype) and 1024 <= st.st_size <= compress_max:
+                self._compress(asset)
+            self.assets[rel] = asset
+
+    def _compress(self, asset: Asset) -> None:
+        raw = None
+        for encoding in ("br", "gzip"):
+            if encoding in asset.variants or (encoding == "br" and brotli is None):
+                continue
+            if raw is None:
+                raw = asset.path.read_bytes()
+            if encoding == "br":
+                data = brotli.compress(raw, quality=11)
+            else:
+                data = gzip.compress(raw, compresslevel=9, mtime=0)
+            # Not worth a Vary split for marginal gains
+            if len(data) < 0.9 * len(raw):
+                asset.variants[encoding] = Variant(size=len(data), data=data)
+                self.compressed_bytes += len(data)
+
+    def lookup(self, rel: str) -> Optional[Asset]:
+        return self.assets.get(rel)
+
+    @property
+    def index(self) -> Optional[Asset]:
+        try:
+            return self.assets.get(self.index_html.relative_to(self.root).as_posix())
+        except ValueError:
+            return None
+
+
+def _choose_encoding(asset: Asset, request: Request) -> Optional[str]:
+    if not asset.variants or request.range is not None:
+        return None
+    accepted = request.accept_encodings
+    best, best_q = None, 0.0
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants:
+            q = accepted[encoding]
+            if q > best_q:
+                best, best_q = encoding, q
+    return best
+
+
+def respond(asset: Asset, request: Request) -> Response:
+    """Build a conditional, range-aware response for ``asset``."""
+
+    encoding = _choose_encoding(asset, request)
+    variant = asset.variants[encoding] if encoding is not None else None
+    response = Response(mimetype=asset.mimetype, direct_passthrough=True)
+    response.set_etag(asset.etag if encoding is None else f"{asset.etag}-{encoding}")
+    response.last_modified = asset.mtime
+    response.headers["Cache-Control"] = asset.cache_control
+    if asset.variants:
+        response.vary.add("Accept-Encoding")
+
+    # Revalidations are most requests for index.html: answer them from the
+    # manifest alone, without opening the file
+    if (
+        request.method in ("GET", "HEAD")
+        and "If-Match" not in request.headers
+        and not is_resource_modified(
+            request.environ, response.headers["ETag"], last_modified=response.headers["Last-Modified"]
+        )
+    ):
+        response.status_code = 304
+        del response.headers["Content-Type"]
+        return response
+
+    if variant is None:
+        fh = asset.path.open("rb")
+        length = asset.size
+    else:
+        fh = BytesIO(variant.data) if variant.data is not None else variant.path.open("rb")
+        length = variant.size
+        response.headers["Content-Encoding"] = encoding
+    response.response = wrap_file(request.environ, fh)
+    response.content_length = length
+    return response.make_conditional(request, accept_ranges=encoding is None, complete_length=length)
+
+
+_manifest: Optional[Manifest] = None
+_manifest_key: Optional[Tuple[Optional[str], str]] = None
+_manifest_lock = threading.Lock()
+
+
+def _settings() -> Tuple[bool, int]:
+    compress = os.getenv("STATIC_COMPRESS", "1").lower() not in ("0", "false", "no")
+    try:
+        compress_max = int(os.getenv("STATIC_COMPRESS_MAX_BYTES", str(8 << 20)))
+    except ValueError:
+        compress_max = 8 << 20
+    return compress, compress_max
+
+
+def reload(root: Path, index_html: Path) -> Manifest:
+    """Rebuild the manifest for ``root`` and swap it in atomically."""
+
+    global _manifest, _manifest_key
+    manifest = Manifest(root, index_html, *_settings())
+    with _manifest_lock:
+        _manifest = manifest
+        _manifest_key = (os.getenv("FRONTEND_BUILD_DIR"), str(root))
+    return manifest
+
+
+def get_manifest(resolve) -> Manifest:
+    """Return the current manifest, rebuilding when FRONTEND_BUILD_DIR changed.
+
+    ``resolve`` returns ``(build_dir, index_html)`` for the current settings.
+    """
+
+    manifest, key = _manifest, _manifest_key
+    if manifest is not None and key is not None and key[0] == os.getenv("FRONTEND_BUILD_DIR"):
+        return manifest
+    with _manifest_lock:
+        if _manifest is not None and _manifest_key is not None and _manifest_key[0] == os.getenv("FRONTEND_BUILD_DIR"):
+            return _manifest
+    root, index_html = resolve()
+    return reload(root, index_html)
+
+
+def stats() -> Dict[str, object]:
+    manifest = _manifest
+    if manifest is None:
+        return {}
+    return {
+        "root": str(manifest.root),
+        "assets": len(manifest.assets),
+        "precompressed": sum(1 for a in manifest.assets.values() if a.variants),
+        "compressed_bytes": manifest.compressed_bytes,
+    }
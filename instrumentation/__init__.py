@@ -0,0 +1,195 @@
+"""
+Shared latency instrumentation for the Flask backend and the Allie API.
+
+Both apps export Prometheus text format at ``GET /metrics``:
+
+- ``http_request_duration_seconds{app,method,route,status}`` per route
+  template (never the raw path, so cardinality stays bounded);
+- ``span_duration_seconds{app,span}`` for sub-steps: ``db_connect``,
+  ``db_query``, ``postprocess``, ``encode``, ``openai_upstream``, ...;
+- ``time_to_first_token_seconds{app,endpoint}`` for streamed completions
+  that made their own upstream call (not coalesced joiners);
+- ``batch_size{app,stage}`` for encode and ingest batch sizes;
+- ``queue_depth{app,queue}`` / ``in_flight{app,pool}`` gauges, read from the
+  owning object only when scraped (no hot-path cost).
+
+Hot-path cost is one ``perf_counter`` pair and one histogram ``observe`` per
+span; labelled children are resolved once and cached.
+
+Under a pre-forking server set ``PROMETHEUS_MULTIPROC_DIR`` so every worker
+contributes to the scrape; callback gauges are per process and are only
+exported in single-process mode.
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Callable, Dict, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+# 1 ms .. 60 s; the tail matters more than fine resolution near zero
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route template",
+    ("app", "method", "route", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+SPAN_LATENCY = Histogram(
+    "span_duration_seconds",
+    "Latency of sub-steps inside a request",
+    ("app", "span"),
+    buckets=LATENCY_BUCKETS,
+)
+TTFT = Histogram(
+    "time_to_first_token_seconds",
+    "Time from request start to the first streamed token",
+    ("app", "endpoint"),
+    buckets=LATENCY_BUCKETS,
+)
+BATCH_SIZE = Histogram(
+    "batch_size",
+    "Items per batch",
+    ("app", "stage"),
+    buckets=SIZE_BUCKETS,
+)
+QUEUE_DEPTH = Gauge("queue_depth", "Items waiting in a queue", ("app", "queue"), multiprocess_mode="livesum")
+IN_FLIGHT = Gauge("in_flight", "Work currently executing", ("app", "pool"), multiprocess_mode="livesum")
+
+_app = os.getenv("METRICS_APP", "")
+_children: Dict[Tuple[Any, ...], Any] = {}
+
+
+def set_app(name: str) -> None:
+    """Set the ``app`` label used by every metric in this process."""
+    global _app
+    _app = name
+    _children.clear()
+
+
+def _child(metric: Any, *labels: str) -> Any:
+    key = (metric, labels)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(_app, *labels)
+    return child
+
+
+class span:
+    """Time a block into ``span_duration_seconds{span=name}``; sync or async code."""
+
+    __slots__ = ("_hist", "_start")
+
+    def __init__(self, name: str):
+        self._hist = _child(SPAN_LATENCY, name)
+
+    def __enter__(self) -> "span":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._hist.observe(time.perf_counter() - self._start)
+
+
+def observe_span(name: str, seconds: float) -> None:
+    _child(SPAN_LATENCY, name).observe(seconds)
+
+
+def observe_ttft(endpoint: str, seconds: float) -> None:
+    _child(TTFT, endpoint).observe(seconds)
+
+
+def observe_batch(stage: str, size: int) -> None:
+    _child(BATCH_SIZE, stage).observe(size)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    _child(REQUEST_LATENCY, method, route, str(status)).observe(seconds)
+
+
+def queue_gauge(queue: str, fn: Callable[[], float]) -> None:
+    """Report ``fn()`` as ``queue_depth{queue=...}`` at scrape time."""
+    _child(QUEUE_DEPTH, queue).set_function(fn)
+
+
+def in_flight_gauge(pool: str, fn: Callable[[], float]) -> None:
+    _child(IN_FLIGHT, pool).set_function(fn)
+
+
+def render() -> Tuple[bytes, str]:
+    """Current metrics in Prometheus text format and its content type."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def instrument_flask(app: Any, name: str = "backend") -> None:
+    """Per-route latency for a Flask app, plus ``GET /metrics``."""
+    from flask import Response, g, request
+
+    set_app(name)
+
+    @app.before_request
+    def _start_timer() -> None:
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record(response: Any) -> Any:
+        start = getattr(g, "_metrics_start", None)
+        if start is not None:
+            # Streaming bodies are still being produced; their time to first
+            # token is reported separately
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():  # pragma: no cover - exposition only
+        body, content_type = render()
+        return Response(body, content_type=content_type)
+
+
+def instrument_fastapi(app: Any, name: str = "allie") -> None:
+    """Per-route latency for a FastAPI app, plus ``GET /metrics``."""
+    from fastapi import Request
+    from fastapi.responses import Response
+
+    set_app(name)
+
+    @app.middleware("http")
+    async def _record(request: Request, call_next: Callable[[Request], Any]) -> Any:
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            observe_request(
+                request.method,
+                getattr(route, "path", "unmatched"),
+                status,
+                time.perf_counter() - start,
+            )
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():  # pragma: no cover - exposition only
+        body, content_type = render()
+        return Response(body, media_type=content_type)
@@ -3,15 +3,40 @@
 
 Usage:
   python3 scripts/upload_lessons_to_storage.py --project ai-integra-course-v2
+  python3 scripts/upload_lessons_to_storage.py --dry-run
+  STORAGE_EMULATOR_HOST=http://localhost:4443 python3 scripts/upload_lessons_to_storage.py --bucket test
 
 This maps local files in public/course_content/lessons/lesson<N>_*.md to:
   gs://<bucket>/lessons-md/courses/<course_id>/modules/<module_id>/lessons/lesson_<N>.md
+
+Only lessons whose content changed are uploaded: the remote objects under the
+course prefix are listed once and their MD5 hashes compared with the local
+files (``--force`` uploads everything). Uploads run in parallel over one
+pooled ``google-cloud-storage`` client, each file is retried with backoff on
+transient errors, and a failure does not stop the other files; the run ends
+with a summary and exits non-zero if any file failed.
+
+``--dry-run`` compares against the bucket when it can; without the client
+library, credentials or network it lists every lesson as new instead.
+
+Set ``STORAGE_EMULATOR_HOST`` (or ``--emulator-host``) to run against a local
+fake GCS server such as fsouza/fake-gcs-server; no credentials are used then.
 """
 
 import argparse
+import base64
+import hashlib
+import os
+import random
 import re
-import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, List, Optional
+
+CONTENT_TYPE = 'text/markdown; charset=utf-8'
 
 
 def module_for_lesson(num: int) -> str:
@@ -32,39 +57,158 @@ def module_for_lesson(num: int) -> str:
     raise ValueError(f"No module mapping for lesson {num}")
 
 
+@dataclass
+class Upload:
+    path: Path
+    name: str
+    md5: str  # base64, as reported by GCS
+    size: int
+
+
+@dataclass
+class Outcome:
+    upload: Upload
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+
+
+def local_md5(path: Path) -> str:
+    return base64.b64encode(hashlib.md5(path.read_bytes()).digest()).decode()
+
+
+def plan(lesson_dir: Path, course: str) -> List[Upload]:
+    uploads = []
+    for path in sorted(lesson_dir.glob('lesson*_*.md')):
+        match = re.match(r'lesson(\d+)_', path.name)
+        if not match:
+            continue
+        num = int(match.group(1))
+        name = f"lessons-md/courses/{course}/modules/{module_for_lesson(num)}/lessons/lesson_{num}.md"
+        uploads.append(Upload(path, name, local_md5(path), path.stat().st_size))
+    return uploads
+
+
+def make_client(project: str, workers: int, emulator_host: Optional[str]):
+    """One storage client whose HTTP session keeps a connection per worker."""
+    import requests
+    from google.cloud import storage
+
+    if emulator_host:
+        from google.auth.credentials import AnonymousCredentials
+
+        client = storage.Client(
+            project=project,
+            credentials=AnonymousCredentials(),
+            client_options={'api_endpoint': emulator_host},
+        )
+    else:
+        client = storage.Client(project=project)
+
+    # The default urllib3 pool holds 10 connections; size it for the workers
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(10, workers))
+    client._http.mount('https://', adapter)
+    client._http.mount('http://', adapter)
+    return client
+
+
+def remote_hashes(bucket, prefix: str) -> Dict[str, str]:
+    """Object name -> base64 MD5 for everything under ``prefix`` (one paginated listing)."""
+    blobs = bucket.list_blobs(prefix=prefix, fields='items(name,md5Hash),nextPageToken')
+    return {blob.name: blob.md5_hash for blob in blobs}
+
+
+def _retryable(exc: Exception) -> bool:
+    import requests
+    from google.api_core import exceptions as gexc
+
+    if isinstance(exc, (gexc.TooManyRequests, gexc.ServerError)):
+        return True
+    if isinstance(exc, gexc.GoogleAPICallError):
+        return exc.code == 408
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+def upload_one(bucket, item: Upload, retries: int, backoff: float) -> Outcome:
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            blob = bucket.blob(item.name)
+            # checksum='md5' has the body verified, so a corrupted upload fails loudly
+            blob.upload_from_filename(str(item.path), content_type=CONTENT_TYPE, checksum='md5', retry=None)
+            return Outcome(item, True, attempt)
+        except Exception as exc:  # noqa: BLE001 - reported per file
+            if attempt > retries or not _retryable(exc):
+                return Outcome(item, False, attempt, f"{exc.__class__.__name__}: {exc}")
+            time.sleep(min(30.0, backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0))
+
+
 def main() -> int:
     parser = argparse.ArgumentParser()
     parser.add_argument('--project', default='ai-integra-course-v2', help='GCP project ID')
     parser.add_argument('--bucket', default='ai-integra-course-v2.firebasestorage.app', help='Storage bucket name')
     parser.add_argument('--course', default='course_01_id', help='Course ID')
-    parser.add_argument('--dry-run', action='store_true', help='Print actions without copying')
+    parser.add_argument('--dry-run', action='store_true', help='Print what would be uploaded without copying')
+    parser.add_argument('--force', action='store_true', help='Upload every lesson even if the remote copy matches')
+    parser.add_argument('--workers', type=int, default=8, help='Parallel uploads')
+    parser.add_argument('--retries', type=int, default=3, help='Retries per file on transient errors')
+    parser.add_argument('--backoff', type=float, default=0.5, help='Initial retry delay in seconds')
+    parser.add_argument('--emulator-host', default=os.getenv('STORAGE_EMULATOR_HOST'),
+                        help='Fake GCS endpoint, e.g. http://localhost:4443 (default: $STORAGE_EMULATOR_HOST)')
     args = parser.parse_args()
 
     lesson_dir = Path(__file__).resolve().parents[1] / 'public' / 'course_content' / 'lessons'
     if not lesson_dir.exists():
         raise SystemExit(f"Lesson directory not found: {lesson_dir}")
 
-    files = sorted(lesson_dir.glob('lesson*_*.md'))
-    for path in files:
-        match = re.match(r'lesson(\d+)_', path.name)
-        if not match:
-            continue
-        num = int(match.group(1))
-        module_id = module_for_lesson(num)
-        dest = (
-            f"gs://{args.bucket}/lessons-md/courses/{args.course}/"
-            f"modules/{module_id}/lessons/lesson_{num}.md"
-        )
-        cmd = ['gcloud', 'storage', 'cp', str(path), dest]
-        if args.dry_run:
-            print('[dry-run]', ' '.join(cmd))
-            continue
-        print('[upload]', ' '.join(cmd))
-        result = subprocess.run(cmd, check=False)
-        if result.returncode != 0:
-            raise SystemExit(f"Upload failed for {path}")
+    started = time.monotonic()
+    uploads = plan(lesson_dir, args.course)
+    workers = max(1, args.workers)
+    bucket = None
+    remote: Dict[str, str] = {}
+    try:
+        client = make_client(args.project, workers, args.emulator_host)
+        bucket = client.bucket(args.bucket)
+        if not args.force:
+            remote = remote_hashes(bucket, f"lessons-md/courses/{args.course}/")
+    except Exception as exc:  # noqa: BLE001 - a dry run still lists the local plan
+        if not args.dry_run:
+            raise
+        print(f"[dry-run] cannot reach gs://{args.bucket} ({exc.__class__.__name__}: {exc}); "
+              "listing every lesson as new", file=sys.stderr)
+    changed = [u for u in uploads if remote.get(u.name) != u.md5]
+    unchanged = len(uploads) - len(changed)
+
+    for u in changed:
+        state = 'new' if u.name not in remote else 'changed'
+        if args.force:
+            state = 'forced'
+        print(f"[{'dry-run' if args.dry_run else 'upload'}] {u.path.name} -> gs://{args.bucket}/{u.name} ({state})")
+    if args.dry_run:
+        print(f"{len(changed)} to upload, {unchanged} unchanged")
+        return 0
+
+    outcomes: List[Outcome] = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(upload_one, bucket, u, args.retries, args.backoff) for u in changed]
+        for fut in as_completed(futures):
+            outcome = fut.result()
+            outcomes.append(outcome)
+            if not outcome.ok:
+                print(f"[failed] {outcome.upload.path.name}: {outcome.error}", file=sys.stderr)
 
-    return 0
+    failed = [o for o in outcomes if not o.ok]
+    uploaded = [o for o in outcomes if o.ok]
+    retried = sum(o.attempts - 1 for o in outcomes)
+    print(
+        f"Summary: {len(uploaded)} uploaded ({sum(o.upload.size for o in uploaded)} bytes), "
+        f"{unchanged} unchanged, {len(failed)} failed, {retried} retries, "
+        f"{time.monotonic() - started:.1f}s"
+    )
+    for o in sorted(failed, key=lambda o: o.upload.name):
+        print(f"  failed: {o.upload.path} -> {o.upload.name} after {o.attempts} attempt(s): {o.error}")
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Tests import the backends as packages from the repo root (allie.backend,
+# backend, instrumentation), the same way uvicorn/gunicorn are started
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
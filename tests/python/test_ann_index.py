@@ -0,0 +1,170 @@
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+from allie.backend import ann_index
+from allie.backend.ann_index import MemoryIndex
+
+DIM = 16
+
+
+class Vec:
+    """Stands in for a loaded pgvector value."""
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def to_numpy(self):
+        return self.values
+
+
+def corpus(n=200, seed=0):
+    # (id, title, lang, channel_id, embedding), as LOAD_SQL returns them
+    rng = np.random.default_rng(seed)
+    return [
+        (f"v{i}", f"title {i}", ("en", "de")[i % 2], f"c{i % 3}", Vec(rng.standard_normal(DIM)))
+        for i in range(n)
+    ]
+
+
+def brute_force(rows, seed_id, k, lang=None, channel_id=None):
+    vecs = {vid: emb.values / np.linalg.norm(emb.values) for vid, _, _, _, emb in rows}
+    q = vecs[seed_id]
+    scored = [
+        (float(vecs[vid] @ q), vid)
+        for vid, _, lng, ch, _ in rows
+        if vid != seed_id and (lang is None or lng == lang) and (channel_id is None or ch == channel_id)
+    ]
+    return [vid for _, vid in sorted(scored, reverse=True)[:k]]
+
+
+@pytest.fixture
+def rows():
+    return corpus()
+
+
+@pytest.fixture
+def index(rows):
+    idx = MemoryIndex(dim=DIM)
+    idx.load(rows)
+    return idx
+
+
+def ids(results):
+    return [r["video_id"] for r in results]
+
+
+def test_matches_brute_force(index, rows):
+    out = index.search("v0", 10)
+    assert ids(out) == brute_force(rows, "v0", 10)
+    assert out[0]["title"] == f"title {out[0]['video_id'][1:]}"
+    sims = [r["sim"] for r in out]
+    assert sims == sorted(sims, reverse=True)
+
+
+def test_seed_is_excluded(index):
+    assert "v0" not in ids(index.search("v0", 199))
+    assert len(index.search("v0", 199)) == 199
+
+
+def test_unknown_seed_returns_none(index):
+    assert index.search("missing", 5) is None
+
+
+@pytest.mark.parametrize("lang,channel_id", [("en", None), (None, "c1"), ("de", "c2")])
+def test_filters(index, rows, lang, channel_id):
+    out = index.search("v0", 10, lang=lang, channel_id=channel_id)
+    assert ids(out) == brute_force(rows, "v0", 10, lang, channel_id)
+    by_id = {vid: (lng, ch) for vid, _, lng, ch, _ in rows}
+    for vid in ids(out):
+        assert lang is None or by_id[vid][0] == lang
+        assert channel_id is None or by_id[vid][1] == channel_id
+
+
+def test_unknown_filter_value_matches_nothing(index):
+    assert index.search("v0", 10, lang="fr") == []
+    assert index.search("v0", 10, channel_id="nope") == []
+
+
+def test_k_larger_than_matches(index, rows):
+    # 200 rows over 3 channels: v0's channel c0 holds 67, 66 besides the seed
+    out = index.search("v0", 500, channel_id="c0")
+    assert len(out) == 66
+    assert ids(out) == brute_force(rows, "v0", 500, channel_id="c0")
+
+
+def test_float16_ranks_like_float32(rows):
+    full = MemoryIndex(dim=DIM, dtype="float32")
+    half = MemoryIndex(dim=DIM, dtype="float16")
+    full.load(rows)
+    half.load(rows)
+    for seed in ("v0", "v7", "v42"):
+        a, b = full.search(seed, 10), half.search(seed, 10)
+        # Rounding may swap near-ties, so compare the sets and the scores
+        assert len(set(ids(a)) & set(ids(b))) >= 9
+        assert np.allclose([r["sim"] for r in a], [r["sim"] for r in b], atol=2e-3)
+    assert half.stats()["matrix_bytes"] * 2 == full.stats()["matrix_bytes"]
+
+
+def test_float16_chunks_cover_every_row(rows, monkeypatch):
+    monkeypatch.setattr(ann_index, "_CHUNK", 7)
+    half = MemoryIndex(dim=DIM, dtype="float16")
+    half.load(rows)
+    assert ids(half.search("v0", 5)) == brute_force(rows, "v0", 5)
+
+
+def test_upsert_adds_and_rewrites(index, rows):
+    seed = rows[0][4].values
+    index.upsert("new", seed * 3, "copy of v0", "en", "c9")
+    top = index.search("v0", 1)[0]
+    assert top["video_id"] == "new" and top["sim"] == pytest.approx(1.0, abs=1e-5)
+    assert index.search("v0", 5, channel_id="c9")[0]["video_id"] == "new"
+    index.upsert("new", -seed, "flipped", "en", "c9")
+    assert "new" not in ids(index.search("v0", 10))
+    assert len(index) == len(rows) + 1
+
+
+def test_reload_replays_racing_upserts(rows, monkeypatch):
+    idx = MemoryIndex(dim=DIM)
+    idx.load(rows[:10])
+    late = np.ones(DIM, dtype=np.float32)
+
+    class Cursor:
+        itersize = None
+
+        def execute(self, sql):
+            assert sql == ann_index.LOAD_SQL
+
+        def __iter__(self):
+            # An /ingest lands while the snapshot is being read and isn't in it
+            idx.upsert("raced", late, "raced", "en", "c0")
+            return iter(rows)
+
+    class Conn:
+        @contextmanager
+        def cursor(self, **kwargs):
+            yield Cursor()
+
+    @contextmanager
+    def get_conn():
+        yield Conn()
+
+    monkeypatch.setattr(ann_index, "get_conn", get_conn)
+    assert idx.reload() == len(rows)
+    assert len(idx) == len(rows) + 1
+    assert idx.search("raced", 1) is not None
+    assert idx.loaded and idx._replay is None
+
+
+def test_failed_reload_keeps_the_old_index(index, monkeypatch):
+    @contextmanager
+    def get_conn():
+        raise RuntimeError("db down")
+        yield
+
+    monkeypatch.setattr(ann_index, "get_conn", get_conn)
+    with pytest.raises(RuntimeError):
+        index.reload()
+    assert index._replay is None
+    assert index.search("v0", 3) is not None
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from allie.backend.batcher import MicroBatcher
+
+
+def fake_encode(texts):
+    # Row i encodes len(text) so results can be checked per caller
+    return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+
+def test_rows_go_back_to_their_callers():
+    b = MicroBatcher(encode_fn=fake_encode, window_ms=20)
+    futures = [b.submit(["a" * n, "b" * (n + 10)]) for n in (5, 1, 3)]
+    for n, fut in zip((5, 1, 3), futures):
+        rows = fut.result(timeout=2)
+        assert rows[:, 0].tolist() == [n, n + 10]
+    assert b.stats()["texts"] == 6
+
+
+def test_encode_error_reaches_every_caller_and_worker_survives():
+    calls = []
+
+    def flaky(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return fake_encode(texts)
+
+    b = MicroBatcher(encode_fn=flaky, window_ms=0)
+    with pytest.raises(RuntimeError, match="boom"):
+        b.embed(["x"], timeout=2)
+    assert b.embed(["xyz"], timeout=2)[0, 0] == 3
+
+
+def test_cancelled_caller_does_not_kill_the_worker():
+    started, release = threading.Event(), threading.Event()
+
+    def slow(texts):
+        started.set()
+        release.wait(2)
+        return fake_encode(texts)
+
+    b = MicroBatcher(encode_fn=slow, window_ms=0)
+    first = b.submit(["first"])
+    assert started.wait(2)
+    queued = b.submit(["queued"])
+    assert queued.cancel()  # cancelled while waiting in the queue
+    release.set()
+    assert first.result(timeout=2)[0, 0] == 5
+    assert b.embed(["later"], timeout=2)[0, 0] == 5
+    assert b._thread.is_alive()
+
+
+def test_cancel_through_asyncio_wrapper_mid_encode():
+    started, release = threading.Event(), threading.Event()
+
+    def slow(texts):
+        started.set()
+        release.wait(2)
+        return fake_encode(texts)
+
+    b = MicroBatcher(encode_fn=slow, window_ms=0)
+
+    async def scenario():
+        task = asyncio.ensure_future(asyncio.wrap_future(b.submit(["abc"])))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 2)
+        task.cancel()  # client disconnect
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        release.set()
+        return await asyncio.wait_for(asyncio.wrap_future(b.submit(["abcd"])), 2)
+
+    assert asyncio.run(scenario())[0, 0] == 4
+    assert b._thread.is_alive()
+
+
+def test_dead_worker_is_respawned():
+    b = MicroBatcher(encode_fn=fake_encode, window_ms=0)
+    b.embed(["a"], timeout=2)
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    b._thread = dead
+    assert b.embed(["ab"], timeout=2)[0, 0] == 2
+    assert b._thread is not dead
@@ -0,0 +1,229 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from backend import completion_cache
+from backend.completion_cache import CompletionCache, MemoryBackend, _NearIndex, completion_key, normalize_prompt
+
+MODEL = "gpt-test"
+
+
+def chat(prompt, system="You are a tutor."):
+    return [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+
+
+def embedder(vectors):
+    """embed() over a fixed prompt -> vector table; unknown prompts fail."""
+
+    calls = []
+
+    def embed(text):
+        calls.append(text)
+        return vectors[text]
+
+    embed.calls = calls
+    return embed
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = SimpleNamespace(now=500.0)
+    monkeypatch.setattr(completion_cache, "time", SimpleNamespace(monotonic=lambda: c.now))
+    return c
+
+
+# Keys ----------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "raw",
+    ["What is an embedding?", "what is an embedding", "  WHAT is\tan\nembedding ?! ", "What is an embedding..."],
+)
+def test_normalize_prompt(raw):
+    assert normalize_prompt(raw) == "what is an embedding"
+
+
+def test_key_shares_normalized_prompts():
+    assert completion_key(chat("What is an embedding?"), 100, MODEL)[1] == completion_key(
+        chat("what is an  embedding"), 100, MODEL
+    )[1]
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        (chat("What is a vector?"), 100, MODEL),
+        (chat("What is an embedding?", system="Be terse."), 100, MODEL),
+        (chat("What is an embedding?"), 200, MODEL),
+        (chat("What is an embedding?"), 100, "gpt-other"),
+    ],
+)
+def test_key_separates_prompt_system_tokens_and_model(other):
+    assert completion_key(chat("What is an embedding?"), 100, MODEL)[1] != completion_key(*other)[1]
+
+
+def test_scope_ignores_the_prompt():
+    a = completion_key(chat("one"), 100, MODEL)
+    b = completion_key(chat("two"), 100, MODEL)
+    assert a[0] == b[0] and a[1] != b[1]
+    assert a[2] == "one"
+
+
+# Memory backend -------------------------------------------------------------
+
+
+def test_memory_ttl(clock):
+    backend = MemoryBackend(maxsize=10, ttl=60)
+    backend.set("k", "v")
+    clock.now += 59
+    assert backend.get("k") == "v"
+    clock.now += 2
+    assert backend.get("k") is None
+    assert backend.stats()["entries"] == 0
+
+
+def test_memory_lru_eviction(clock):
+    backend = MemoryBackend(maxsize=2, ttl=60)
+    backend.set("a", "1")
+    backend.set("b", "2")
+    assert backend.get("a") == "1"
+    backend.set("c", "3")
+    assert backend.get("b") is None
+    assert (backend.get("a"), backend.get("c")) == ("1", "3")
+    assert backend.stats()["evictions"] == 1
+
+
+def test_memory_set_refreshes_expiry(clock):
+    backend = MemoryBackend(maxsize=2, ttl=60)
+    backend.set("a", "1")
+    clock.now += 50
+    backend.set("a", "2")
+    clock.now += 50
+    assert backend.get("a") == "2"
+
+
+# Near-duplicate index -------------------------------------------------------
+
+
+def unit(*values):
+    v = np.asarray(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_near_index_threshold_and_scope():
+    index = _NearIndex(capacity=4)
+    index.add("s", "k1", unit(1, 0, 0))
+    index.add("s", "k2", unit(0, 1, 0))
+    index.add("other", "k3", unit(1, 0.05, 0))
+    assert index.best("s", unit(1, 0.1, 0), threshold=0.99) == "k1"
+    assert index.best("s", unit(1, 1, 0), threshold=0.99) is None
+    # The closest vector is from another scope; the next one still clears the bar
+    assert index.best("s", unit(1, 0.05, 0), threshold=0.9) == "k1"
+    assert index.best("none", unit(1, 0, 0), threshold=0.5) is None
+    # Vectors of another dimension are ignored
+    index.add("s", "bad", unit(1, 0))
+    assert index.best("s", unit(1, 0), threshold=0.0) is None
+
+
+def test_near_index_ring_buffer_drops_oldest():
+    index = _NearIndex(capacity=2)
+    index.add("s", "k1", unit(1, 0))
+    index.add("s", "k2", unit(0, 1))
+    index.add("s", "k3", unit(-1, 0))
+    assert index.best("s", unit(1, 0), threshold=0.5) is None
+    assert index.best("s", unit(-1, 0), threshold=0.5) == "k3"
+
+
+# CompletionCache ------------------------------------------------------------
+
+
+def test_exact_hit_after_store(clock):
+    cache = CompletionCache(MemoryBackend(10, 60))
+    value, probe = cache.lookup(chat("What is RAG?"), 100, MODEL)
+    assert value is None and probe.hit is None
+    cache.store(probe, "Retrieval augmented generation")
+    value, probe = cache.lookup(chat("what is rag"), 100, MODEL)
+    assert (value, probe.hit) == ("Retrieval augmented generation", "exact")
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_empty_answers_are_not_stored(clock):
+    cache = CompletionCache(MemoryBackend(10, 60))
+    _, probe = cache.lookup(chat("q"), 100, MODEL)
+    cache.store(probe, "")
+    assert cache.lookup(chat("q"), 100, MODEL)[0] is None
+
+
+def test_near_hit_above_threshold(clock):
+    embed = embedder({
+        "what is rag": [1, 0, 0],
+        "explain rag": [0.99, 0.1, 0],
+        "what is a gpu": [0, 1, 0],
+    })
+    cache = CompletionCache(MemoryBackend(10, 60), similarity=0.95)
+    _, probe = cache.lookup(chat("What is RAG?"), 100, MODEL, embed)
+    cache.store(probe, "answer", embed)
+    # The lookup's vector is reused by store, so one embed call per prompt
+    assert embed.calls == ["what is rag"]
+
+    value, probe = cache.lookup(chat("Explain RAG"), 100, MODEL, embed)
+    assert (value, probe.hit) == ("answer", "near")
+    assert cache.lookup(chat("What is a GPU?"), 100, MODEL, embed)[0] is None
+    # Same prompt, different scope: never a near hit
+    assert cache.lookup(chat("Explain RAG", system="Other"), 100, MODEL, embed)[0] is None
+    assert cache.stats()["near_hits"] == 1
+
+
+def test_near_matching_needs_an_embedder(clock):
+    cache = CompletionCache(MemoryBackend(10, 60), similarity=0.5)
+    _, probe = cache.lookup(chat("What is RAG?"), 100, MODEL)
+    assert not probe.near
+
+
+def test_embed_failure_falls_back_to_exact(clock):
+    embed = embedder({})
+    cache = CompletionCache(MemoryBackend(10, 60), similarity=0.5)
+    value, probe = cache.lookup(chat("q"), 100, MODEL, embed)
+    assert value is None and probe.vector is None
+    cache.store(probe, "a", embed)
+    assert cache.lookup(chat("q"), 100, MODEL, embed)[0] == "a"
+
+
+def test_near_hit_for_an_expired_answer_is_a_miss(clock):
+    embed = embedder({"a": [1, 0], "b": [1, 0.01]})
+    cache = CompletionCache(MemoryBackend(10, 60), similarity=0.9)
+    _, probe = cache.lookup(chat("a"), 100, MODEL, embed)
+    cache.store(probe, "answer", embed)
+    clock.now += 61
+    assert cache.lookup(chat("b"), 100, MODEL, embed)[0] is None
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(completion_cache, "_cache", None)
+    for name in ("AI_CACHE", "AI_CACHE_SIMILARITY", "AI_CACHE_SIZE", "AI_CACHE_TTL"):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_similarity_zero_disables_near_matching(fresh_cache):
+    fresh_cache.setenv("AI_CACHE_SIMILARITY", "0")
+    cache = completion_cache.get_completion_cache()
+    assert cache._near is None
+    embed = embedder({"q": [1.0, 0.0]})
+    _, probe = cache.lookup(chat("q"), 100, MODEL, embed)
+    assert not probe.near and embed.calls == []
+
+
+def test_cache_settings_from_env(fresh_cache):
+    fresh_cache.setenv("AI_CACHE_SIMILARITY", "0.9")
+    fresh_cache.setenv("AI_CACHE_SIZE", "7")
+    cache = completion_cache.get_completion_cache()
+    assert cache.similarity == 0.9 and cache._near.capacity == 7
+    assert cache.backend.maxsize == 7
+
+
+def test_cache_off(fresh_cache):
+    fresh_cache.setenv("AI_CACHE", "off")
+    assert completion_cache.get_completion_cache() is None
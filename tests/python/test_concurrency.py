@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from allie.backend.concurrency import Admission, run_encode
+
+
+def test_admission_rejects_beyond_limit_and_queue():
+    async def scenario():
+        adm = Admission("encode", limit=2, max_waiting=3)
+        release = asyncio.Event()
+        entered = []
+
+        async def request(i):
+            async with adm:
+                entered.append(i)
+                await release.wait()
+
+        tasks = [asyncio.create_task(request(i)) for i in range(5)]
+        while adm.in_flight + adm.waiting < 5:
+            await asyncio.sleep(0)
+        assert (adm.in_flight, adm.waiting) == (2, 3)
+
+        with pytest.raises(HTTPException) as info:
+            async with adm:
+                pass
+        assert info.value.status_code == 503
+        assert info.value.headers == {"Retry-After": "1"}
+        assert adm.stats()["rejected"] == 1
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert sorted(entered) == list(range(5))
+        return adm.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats == {"limit": 2, "in_flight": 0, "waiting": 0, "max_waiting": 3, "rejected": 1}
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        adm = Admission("similar", limit=1, max_waiting=1)
+        release = asyncio.Event()
+
+        async def hold():
+            async with adm:
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert adm.waiting == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert adm.waiting == 0
+        # The freed queue place admits the next request
+        late = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert adm.waiting == 1
+        release.set()
+        await asyncio.gather(holder, late)
+        return adm.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["in_flight"], stats["waiting"], stats["rejected"]) == (0, 0, 0)
+
+
+def test_errors_inside_release_the_slot():
+    async def scenario():
+        adm = Admission("encode", limit=1, max_waiting=0)
+        with pytest.raises(ValueError):
+            async with adm:
+                raise ValueError("boom")
+        async with adm:
+            pass
+        return adm.stats()
+
+    assert asyncio.run(scenario())["in_flight"] == 0
+
+
+def test_run_encode_runs_off_the_loop():
+    async def scenario():
+        return await run_encode(lambda x: (x * 2, threading.current_thread().name), 21)
+
+    value, thread = asyncio.run(scenario())
+    assert value == 42 and thread.startswith("allie-encode")
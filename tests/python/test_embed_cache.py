@@ -0,0 +1,14 @@
+from allie.backend.embed_cache import cache_key
+
+
+def test_key_ignores_whitespace_edits():
+    a = cache_key("hello   world\n", "m", 512, "torch")
+    assert a == cache_key(" hello world", "m", 512, "torch")
+
+
+def test_key_separates_model_length_and_backend():
+    base = cache_key("hello world", "m", 512, "torch")
+    assert base != cache_key("hello world", "other", 512, "torch")
+    assert base != cache_key("hello world", "m", 256, "torch")
+    assert base != cache_key("hello world", "m", 512, "torch-int8")
+    assert cache_key("hello world", "m", 512, "onnx") != cache_key("hello world", "m", 512, "onnx-int8")
@@ -0,0 +1,25 @@
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def conf(monkeypatch):
+    # The config sets ALLIE_STARTUP as an import side effect
+    monkeypatch.setenv("ALLIE_STARTUP", "lazy")
+    return importlib.import_module("allie.backend.gunicorn_conf")
+
+
+def test_child_exit_removes_the_dead_workers_live_gauges(conf, tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    for name in ("gauge_livesum_41.db", "gauge_livesum_42.db", "gauge_liveall_42.db", "histogram_42.db"):
+        (tmp_path / name).write_bytes(b"")
+    conf.child_exit(None, SimpleNamespace(pid=42))
+    # Histograms and counters of dead workers still count; only live gauges go
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["gauge_livesum_41.db", "histogram_42.db"]
+
+
+def test_child_exit_without_multiproc_dir(conf, monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    conf.child_exit(None, SimpleNamespace(pid=42))
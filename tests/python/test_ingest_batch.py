@@ -0,0 +1,157 @@
+from contextlib import asynccontextmanager
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from allie.backend import app as app_mod
+
+
+class FakeDB:
+    """Records upserted ids; any upsert touching an id in `bad` fails."""
+
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.batches = []
+        self.written = []
+
+    @asynccontextmanager
+    async def conn(self):
+        yield FakeConn(self)
+
+
+class FakeConn:
+    def __init__(self, db):
+        self.db = db
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    @asynccontextmanager
+    async def cursor(self):
+        yield FakeCursor(self.db)
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+
+    async def execute(self, sql, params):
+        if sql == app_mod.UPSERT_VIDEOS_BATCH:
+            ids = list(params[0])
+            self.db.batches.append(ids)
+            bad = self.db.bad.intersection(ids)
+            if bad:
+                raise ValueError(f"invalid input for {sorted(bad)[0]}\nDETAIL: more")
+            self.db.written.extend(ids)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    encoded = []
+
+    def fake_embed(texts, batch_size=None):
+        encoded.append(list(texts))
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    monkeypatch.delenv("ALLIE_SEGMENTS", raising=False)
+    monkeypatch.delenv("ALLIE_INDEX_MODE", raising=False)
+    monkeypatch.setattr(app_mod, "cached_embed_texts", fake_embed)
+    c = TestClient(app_mod.app)
+    c.encoded = encoded
+    return c
+
+
+def use_db(monkeypatch, db):
+    monkeypatch.setattr(app_mod, "get_async_conn", db.conn)
+
+
+def item(vid, transcript="hello", **extra):
+    return {"youtube_id": vid, "transcript": transcript, **extra}
+
+
+def test_all_ok(client, monkeypatch):
+    db = FakeDB()
+    use_db(monkeypatch, db)
+    body = client.post("/ingest/batch", json={"items": [item("a"), item("b"), item("c")]}).json()
+    assert body["ok"] and body["ingested"] == 3
+    assert [r["video_id"] for r in body["results"]] == ["a", "b", "c"]
+    assert all(r["ok"] and "error" not in r for r in body["results"])
+    # One set-based upsert, one encode call
+    assert db.batches == [["a", "b", "c"]]
+    assert client.encoded == [["hello"] * 3]
+    assert sorted(db.written) == ["a", "b", "c"]
+
+
+def test_invalid_items_are_reported_in_place(client, monkeypatch):
+    db = FakeDB()
+    use_db(monkeypatch, db)
+    items = [item("a"), {"youtube_id": "b"}, {"transcript": "no id"}, item("d", duration_s="long")]
+    body = client.post("/ingest/batch", json={"items": items}).json()
+    results = body["results"]
+    assert (body["ok"], body["ingested"]) == (False, 1)
+    assert [r["video_id"] for r in results] == ["a", "b", None, "d"]
+    assert [r["ok"] for r in results] == [True, False, False, False]
+    assert results[1]["error"].startswith("transcript:")
+    assert results[2]["error"].startswith("youtube_id:")
+    assert results[3]["error"].startswith("duration_s:")
+    assert db.batches == [["a"]]
+
+
+def test_duplicate_id_supersedes_earlier_item(client, monkeypatch):
+    db = FakeDB()
+    use_db(monkeypatch, db)
+    items = [item("a", "first"), item("b"), item("a", "second")]
+    body = client.post("/ingest/batch", json={"items": items}).json()
+    results = body["results"]
+    assert [r["ok"] for r in results] == [False, True, True]
+    assert "superseded" in results[0]["error"]
+    assert body["ingested"] == 2
+    # Only the last copy is encoded and written, at its own position
+    assert client.encoded == [["hello", "second"]]
+    assert db.batches == [["b", "a"]]
+
+
+def test_failed_batch_falls_back_to_per_row_savepoints(client, monkeypatch):
+    db = FakeDB(bad={"b"})
+    use_db(monkeypatch, db)
+    body = client.post("/ingest/batch", json={"items": [item("a"), item("b"), item("c")]}).json()
+    results = body["results"]
+    assert (body["ok"], body["ingested"]) == (False, 2)
+    assert [r["ok"] for r in results] == [True, False, True]
+    # First line of the DB error only
+    assert results[1]["error"] == "invalid input for b"
+    assert db.batches == [["a", "b", "c"], ["a"], ["b"], ["c"]]
+    assert sorted(db.written) == ["a", "c"]
+
+
+def test_embedding_failure_marks_valid_items(client, monkeypatch):
+    db = FakeDB()
+    use_db(monkeypatch, db)
+
+    def broken(texts, batch_size=None):
+        raise RuntimeError("model gone")
+
+    monkeypatch.setattr(app_mod, "cached_embed_texts", broken)
+    body = client.post("/ingest/batch", json={"items": [item("a"), {"youtube_id": "b"}]}).json()
+    assert (body["ok"], body["ingested"]) == (False, 0)
+    assert body["results"][0]["error"] == "embedding failed"
+    assert body["results"][1]["error"].startswith("transcript:")
+    assert db.batches == []
+
+
+def test_successful_items_invalidate_the_similar_cache(client, monkeypatch):
+    use_db(monkeypatch, FakeDB(bad={"b"}))
+    cache = app_mod.get_similar_cache()
+    cache.put(("seed", 5), "seed", [{"video_id": "a"}])
+    cache.put(("other", 5), "other", [{"video_id": "b"}])
+    client.post("/ingest/batch", json={"items": [item("a"), item("b")]})
+    assert cache.get(("seed", 5)) is None
+    assert cache.get(("other", 5)) is not None
+    cache.clear()
+
+
+def test_batch_limits(client):
+    assert client.post("/ingest/batch", json={"items": []}).status_code == 422
+    assert client.post("/ingest/batch", json={"items": [item("a")], "batch_size": 0}).status_code == 422
@@ -0,0 +1,110 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+from onnx import TensorProto, helper, numpy_helper  # noqa: E402
+from tokenizers import Tokenizer, models, pre_tokenizers  # noqa: E402
+
+from allie.backend.backends import OnnxEncoder  # noqa: E402
+
+VOCAB = 200
+DIM = 8
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    # input_ids -> embedding lookup, mean-pooled: enough graph for OnnxEncoder
+    rng = np.random.default_rng(0)
+    table = numpy_helper.from_array(rng.standard_normal((VOCAB, DIM)).astype(np.float32), "table")
+    graph = helper.make_graph(
+        [helper.make_node("Gather", ["table", "input_ids"], ["hidden"])],
+        "toy",
+        [helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "seq"])],
+        [helper.make_tensor_value_info("hidden", TensorProto.FLOAT, ["batch", "seq", DIM])],
+        [table],
+    )
+    (tmp_path / "onnx").mkdir()
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)], ir_version=8)
+    onnx.save(model, str(tmp_path / "onnx" / "model.onnx"))
+
+    vocab = {"[PAD]": 0, "[UNK]": 1, **{f"w{i}": i + 2 for i in range(VOCAB - 2)}}
+    tok = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tok.pre_tokenizer = pre_tokenizers.Whitespace()
+    tok.save(str(tmp_path / "tokenizer.json"))
+    (tmp_path / "sentence_bert_config.json").write_text(json.dumps({"max_seq_length": 64}))
+    (tmp_path / "1_Pooling").mkdir()
+    (tmp_path / "1_Pooling" / "config.json").write_text(
+        json.dumps({"word_embedding_dimension": DIM, "pooling_mode_mean_tokens": True})
+    )
+    return str(tmp_path)
+
+
+def texts(n, seed):
+    rng = np.random.default_rng(seed)
+    return [" ".join(f"w{rng.integers(VOCAB - 2)}" for _ in range(rng.integers(1, 100))) for _ in range(n)]
+
+
+def test_truncates_and_pads(model_dir):
+    enc = OnnxEncoder(model_dir)
+    assert enc.max_seq_length == 64
+    long = " ".join(f"w{i}" for i in range(100))
+    out = enc.encode([long, "w1"], batch_size=2)
+    assert out.shape == (2, DIM)
+    # Padding is masked out: a short text pools the same alone or padded
+    np.testing.assert_allclose(out[1], enc.encode(["w1"])[0], rtol=1e-6)
+    enc.max_seq_length = 100
+    assert not np.allclose(enc.encode([long])[0], out[0])
+
+
+def test_concurrent_encodes(model_dir):
+    enc = OnnxEncoder(model_dir)
+    batches = [texts(16, seed) for seed in range(8)]
+    expected = [enc.encode(b, batch_size=4) for b in batches]
+    errors = []
+    results = {}
+    start = threading.Barrier(len(batches))
+
+    def run(i):
+        try:
+            start.wait()
+            for _ in range(20):
+                results[i] = enc.encode(batches[i], batch_size=4)
+        except Exception as exc:  # pragma: no cover - the failure being tested
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(batches))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    for i, exp in enumerate(expected):
+        np.testing.assert_allclose(results[i], exp, rtol=1e-5)
+
+
+def test_setting_max_seq_length_while_encoding(model_dir):
+    enc = OnnxEncoder(model_dir)
+    batch = texts(32, 1)
+    errors = []
+    done = threading.Event()
+
+    def encode():
+        try:
+            while not done.is_set():
+                enc.encode(batch, batch_size=8)
+        except Exception as exc:  # pragma: no cover - the failure being tested
+            errors.append(exc)
+
+    threads = [threading.Thread(target=encode) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for n in range(200):
+        enc.max_seq_length = 32 + n % 32
+    done.set()
+    for t in threads:
+        t.join()
+    assert errors == []
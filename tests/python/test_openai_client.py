@@ -0,0 +1,276 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from backend import openai_client
+from backend.openai_client import ChatStream, Gate, OpenAIGateway, Overloaded, TokenBucket
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+class Clock:
+    """Stands in for time.monotonic/time.sleep: sleeping advances the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(openai_client, "time", SimpleNamespace(monotonic=c.monotonic, sleep=c.sleep))
+    return c
+
+
+def status_error(code, retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after is not None else {}
+    response = httpx.Response(code, request=REQUEST, headers=headers)
+    return openai.APIStatusError(f"HTTP {code}", response=response, body=None)
+
+
+# TokenBucket ---------------------------------------------------------------
+
+
+def test_bucket_starts_full_then_refills(clock):
+    bucket = TokenBucket(rate=2.0, capacity=4)
+    for _ in range(4):
+        bucket.acquire(1, max_wait=0)
+    assert clock.sleeps == []
+    clock.now += 1.0  # two tokens back
+    bucket.acquire(2, max_wait=0)
+    assert clock.sleeps == []
+
+
+def test_bucket_sleeps_off_debt(clock):
+    bucket = TokenBucket(rate=2.0, capacity=4)
+    bucket.acquire(4, max_wait=0)
+    bucket.acquire(1, max_wait=10)
+    assert clock.sleeps == [pytest.approx(0.5)]
+    # The reservation is already paid for: the next caller queues behind it
+    bucket.acquire(1, max_wait=10)
+    assert clock.sleeps[-1] == pytest.approx(0.5)
+
+
+def test_bucket_refill_is_capped(clock):
+    bucket = TokenBucket(rate=2.0, capacity=4)
+    clock.now += 3600
+    bucket.acquire(4, max_wait=0)
+    with pytest.raises(Overloaded):
+        bucket.acquire(1, max_wait=0.1)
+
+
+def test_bucket_rejects_waits_beyond_budget(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    bucket.acquire(2, max_wait=0)
+    with pytest.raises(Overloaded) as info:
+        bucket.acquire(2, max_wait=1.0)
+    assert info.value.retry_after == 2
+    # A rejected caller reserves nothing
+    clock.now += 2.0
+    bucket.acquire(2, max_wait=0)
+
+
+def test_bucket_clamps_oversized_requests(clock):
+    bucket = TokenBucket(rate=1.0, capacity=5)
+    bucket.acquire(50, max_wait=0)
+    assert clock.sleeps == []
+
+
+# Gate ----------------------------------------------------------------------
+
+
+def test_gate_sheds_once_queue_is_full():
+    gate = Gate(limit=1, max_waiting=1)
+    gate.acquire(timeout=1)
+    waiter_in = threading.Event()
+
+    def waiter():
+        gate.acquire(timeout=5)
+        waiter_in.set()
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    while gate.stats()["waiting"] == 0:
+        time.sleep(0.001)
+    with pytest.raises(Overloaded, match="queue full"):
+        gate.acquire(timeout=5)
+    gate.release()
+    t.join()
+    assert waiter_in.is_set()
+    gate.release()
+    assert gate.stats() == {"limit": 1, "in_flight": 0, "waiting": 0, "max_waiting": 1, "rejected": 1}
+
+
+def test_gate_times_out_waiting():
+    gate = Gate(limit=1, max_waiting=4)
+    gate.acquire(timeout=1)
+    with pytest.raises(Overloaded, match="timed out"):
+        gate.acquire(timeout=0.01)
+    stats = gate.stats()
+    assert (stats["waiting"], stats["in_flight"], stats["rejected"]) == (0, 1, 1)
+
+
+def test_overloaded_rounds_retry_after_up():
+    assert Overloaded("x", retry_after=0.2).retry_after == 1
+    assert Overloaded("x", retry_after=2.01).retry_after == 3
+
+
+# Retries -------------------------------------------------------------------
+
+
+@pytest.mark.parametrize(
+    "exc,retry",
+    [
+        (status_error(429), True),
+        (status_error(500), True),
+        (status_error(503), True),
+        (status_error(408), True),
+        (status_error(400), False),
+        (status_error(401), False),
+        (status_error(404), False),
+        (openai.APIConnectionError(request=REQUEST), True),
+        (openai.APITimeoutError(request=REQUEST), True),
+        (ValueError("not an API error"), False),
+    ],
+)
+def test_retryable(exc, retry):
+    assert openai_client._retryable(exc) is retry
+
+
+@pytest.fixture
+def gateway(monkeypatch, clock):
+    monkeypatch.setenv("OPENAI_MAX_RETRIES", "3")
+    monkeypatch.setenv("OPENAI_BACKOFF_BASE", "0.5")
+    monkeypatch.setenv("OPENAI_BACKOFF_MAX", "8")
+    monkeypatch.setenv("OPENAI_CONCURRENCY", "1")
+    monkeypatch.setenv("OPENAI_RPM", "0")
+    monkeypatch.setenv("OPENAI_TPM", "0")
+    gw = OpenAIGateway("sk-test")
+    yield gw
+    gw.close()
+
+
+def flaky(*errors, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    fn.calls = calls
+    return fn
+
+
+def test_retries_then_succeeds(gateway, clock, monkeypatch):
+    monkeypatch.setattr(openai_client.random, "uniform", lambda lo, hi: hi)
+    fn = flaky(status_error(500), openai.APIConnectionError(request=REQUEST))
+    assert gateway._with_retries(fn) == "ok"
+    assert len(fn.calls) == 3
+    # Full-jitter upper bounds: base * 2 ** attempt
+    assert clock.sleeps == [0.5, 1.0]
+    assert gateway.stats()["retries"] == 2
+
+
+def test_retry_after_is_honoured_and_capped(gateway, clock):
+    fn = flaky(status_error(429, "2"), status_error(429, "120"))
+    assert gateway._with_retries(fn) == "ok"
+    assert clock.sleeps == [2.0, 8.0]
+
+
+def test_gives_up_after_max_retries(gateway, clock):
+    fn = flaky(*[status_error(503)] * 5)
+    with pytest.raises(openai.APIStatusError):
+        gateway._with_retries(fn)
+    assert len(fn.calls) == 4
+
+
+def test_client_errors_are_not_retried(gateway, clock):
+    fn = flaky(status_error(400))
+    with pytest.raises(openai.APIStatusError):
+        gateway._with_retries(fn)
+    assert len(fn.calls) == 1 and clock.sleeps == []
+
+
+# Streams -------------------------------------------------------------------
+
+
+class Chunk:
+    def __init__(self, text):
+        delta = type("Delta", (), {"content": text})()
+        self.choices = [type("Choice", (), {"delta": delta})()] if text is not None else []
+
+
+class Upstream:
+    def __init__(self, texts):
+        self.texts = texts
+        self.closed = False
+
+    def __iter__(self):
+        return iter([Chunk(t) for t in self.texts])
+
+    def close(self):
+        self.closed = True
+
+
+def fake_completions(gateway, upstream):
+    completions = type("Completions", (), {"create": staticmethod(lambda **kw: upstream)})()
+    gateway.client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+
+
+def test_stream_releases_its_slot_when_exhausted(gateway):
+    upstream = Upstream(["Hel", None, "", "lo"])
+    fake_completions(gateway, upstream)
+    stream = gateway.stream([{"role": "user", "content": "hi"}], max_tokens=5)
+    assert gateway.gate.stats()["in_flight"] == 1
+    assert "".join(stream) == "Hello"
+    assert upstream.closed
+    assert gateway.gate.stats()["in_flight"] == 0
+
+
+def test_stream_releases_its_slot_on_early_close(gateway):
+    upstream = Upstream(["a", "b", "c"])
+    fake_completions(gateway, upstream)
+    stream = gateway.stream([{"role": "user", "content": "hi"}], max_tokens=5)
+    it = iter(stream)
+    assert next(it) == "a"
+    it.close()
+    stream.close()  # idempotent
+    assert upstream.closed
+    assert gateway.gate.stats()["in_flight"] == 0
+    # The single slot is free for the next caller
+    gateway.gate.acquire(timeout=0)
+    gateway.gate.release()
+
+
+def test_failed_open_releases_its_slot(gateway, monkeypatch):
+    def boom(**kw):
+        raise status_error(400)
+
+    completions = type("Completions", (), {"create": staticmethod(boom)})()
+    gateway.client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    with pytest.raises(openai.APIStatusError):
+        gateway.stream([{"role": "user", "content": "hi"}], max_tokens=5)
+    assert gateway.gate.stats()["in_flight"] == 0
+
+
+def test_chat_stream_close_without_iterating():
+    released = []
+    upstream = Upstream(["a"])
+    stream = ChatStream(upstream, lambda: released.append(1))
+    stream.close()
+    stream.close()
+    assert released == [1] and upstream.closed
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from tokenizers import Tokenizer, models, pre_tokenizers
+
+from allie.backend import segments
+
+
+@pytest.fixture
+def word_tokenizer(monkeypatch):
+    # One token per "wN" word, with character offsets like a real fast tokenizer
+    vocab = {"[UNK]": 0, **{f"w{i}": i + 1 for i in range(1000)}}
+    tok = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tok.pre_tokenizer = pre_tokenizers.Whitespace()
+    monkeypatch.setattr(segments, "_tokenizer", tok)
+    monkeypatch.setattr(segments, "get_max_seq_length", lambda: 512)
+    monkeypatch.setenv("ALLIE_SEGMENT_TOKENS", "16")
+    monkeypatch.setenv("ALLIE_SEGMENT_OVERLAP", "4")
+    return tok
+
+
+def cues(n, words_per_cue=4, seconds=2.0):
+    return [
+        SimpleNamespace(
+            text=" ".join(f"w{i * words_per_cue + j}" for j in range(words_per_cue)) + "\n",
+            start=i * seconds,
+            duration=seconds,
+        )
+        for i in range(n)
+    ]
+
+
+def test_windows_overlap_and_cover_the_whole_transcript(word_tokenizer):
+    segs = segments.split("", cues(11))  # 44 tokens, window 16, step 12
+    assert [s.seg_no for s in segs] == list(range(len(segs)))
+    assert [s.tokens for s in segs] == [16, 16, 16, 8]
+    words = [s.text.split() for s in segs]
+    assert words[0] == [f"w{i}" for i in range(16)]
+    # Consecutive windows share ALLIE_SEGMENT_OVERLAP tokens
+    assert words[1][:4] == words[0][-4:]
+    assert words[-1][-1] == "w43"
+
+
+def test_windows_carry_the_time_range_of_their_cues(word_tokenizer):
+    segs = segments.split("", cues(10))
+    # Tokens 0-15 are cues 0-3 (4 words, 2s each): 0s to the end of cue 3
+    assert (segs[0].start_s, segs[0].end_s) == (0.0, 8.0)
+    # Tokens 12-27 start in cue 3 and end in cue 6
+    assert (segs[1].start_s, segs[1].end_s) == (6.0, 14.0)
+    assert segs[-1].end_s == 20.0
+
+
+def test_plain_transcript_has_no_timestamps(word_tokenizer):
+    segs = segments.split("w1 w2 w3")
+    assert len(segs) == 1
+    assert segs[0].text == "w1 w2 w3"
+    assert segs[0].start_s is None and segs[0].end_s is None
+
+
+def test_empty_transcript_yields_one_segment(word_tokenizer):
+    segs = segments.split("")
+    assert len(segs) == 1 and segs[0].tokens == 0
+
+
+def test_word_fallback_without_tokenizer(monkeypatch):
+    monkeypatch.setattr(segments, "_tokenizer", None)
+    monkeypatch.setattr(segments, "_tokenizer_failed", True)
+    monkeypatch.setattr(segments, "get_max_seq_length", lambda: 512)
+    monkeypatch.setenv("ALLIE_SEGMENT_TOKENS", "16")
+    monkeypatch.setenv("ALLIE_SEGMENT_OVERLAP", "0")
+    segs = segments.split(" ".join(f"x{i}" for i in range(30)))
+    # Word windows are shrunk to 3/4 of the token window
+    assert [s.tokens for s in segs] == [12, 12, 6]
+
+
+def test_window_is_capped_by_max_seq_length(monkeypatch):
+    monkeypatch.setattr(segments, "get_max_seq_length", lambda: 128)
+    monkeypatch.setenv("ALLIE_SEGMENT_TOKENS", "256")
+    assert segments.window_tokens() == 126
+
+
+def test_pool_vectors_single_segment_is_unchanged():
+    seg = [segments.Segment(0, "a", None, None, 3)]
+    v = np.array([[0.6, 0.8]], dtype=np.float32)
+    assert np.array_equal(segments.pool_vectors(v, seg), v[0])
+
+
+def test_pool_vectors_is_token_weighted_and_normalized():
+    segs = [segments.Segment(0, "a", None, None, 3), segments.Segment(1, "b", None, None, 1)]
+    emb = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+    v = segments.pool_vectors(emb, segs)
+    assert v.dtype == np.float32
+    assert np.isclose(np.linalg.norm(v), 1.0)
+    assert np.allclose(v, np.array([3.0, 1.0]) / np.sqrt(10.0))
+
+
+def test_segments_are_off_by_default(monkeypatch):
+    monkeypatch.delenv("ALLIE_SEGMENTS", raising=False)
+    assert not segments.segments_enabled()
+    monkeypatch.setenv("ALLIE_SEGMENTS", "1")
+    assert segments.segments_enabled()
@@ -0,0 +1,89 @@
+from allie.backend import cache as cache_mod
+from allie.backend.cache import SimilarCache
+
+
+def results(*ids):
+    return [{"video_id": v, "score": 1.0} for v in ids]
+
+
+def test_hit_and_miss():
+    c = SimilarCache(maxsize=10, ttl=60)
+    assert c.get("k") is None
+    c.put("k", "seed", results("a", "b"))
+    assert c.get("k") == results("a", "b")
+    assert (c.hits, c.misses) == (1, 1)
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_mod.time, "monotonic", lambda: now[0])
+    c = SimilarCache(maxsize=10, ttl=5)
+    c.put("k", "seed", results("a"))
+    now[0] = 104.9
+    assert c.get("k") is not None
+    now[0] = 105.1
+    assert c.get("k") is None
+    assert c.stats()["size"] == 0
+    # The expired entry's reverse index is gone too
+    assert c.invalidate(["a"]) == 0
+
+
+def test_lru_eviction_keeps_recently_used():
+    c = SimilarCache(maxsize=2, ttl=60)
+    c.put("k1", "s1", results("a"))
+    c.put("k2", "s2", results("b"))
+    assert c.get("k1") is not None
+    c.put("k3", "s3", results("c"))
+    assert c.get("k2") is None
+    assert c.get("k1") is not None and c.get("k3") is not None
+    assert c.invalidate(["b", "s2"]) == 0
+
+
+def test_invalidate_by_seed_or_result():
+    c = SimilarCache(maxsize=10, ttl=60)
+    c.put("k1", "s1", results("a", "b"))
+    c.put("k2", "s2", results("b", "c"))
+    c.put("k3", "s3", results("d"))
+    assert c.invalidate(["b"]) == 2
+    assert c.get("k1") is None and c.get("k2") is None
+    assert c.get("k3") is not None
+    assert c.invalidate(["s3"]) == 1
+    assert c.stats()["invalidations"] == 3
+
+
+def test_put_replaces_entry_and_its_refs():
+    c = SimilarCache(maxsize=10, ttl=60)
+    c.put("k", "s", results("a"))
+    c.put("k", "s", results("b"))
+    assert c.invalidate(["a"]) == 0
+    assert c.get("k") == results("b")
+
+
+def test_disabled():
+    c = SimilarCache(maxsize=0, ttl=60)
+    c.put("k", "s", results("a"))
+    assert not c.enabled
+    assert c.get("k") is None
+
+
+def test_put_after_racing_invalidate_is_dropped():
+    c = SimilarCache(maxsize=10, ttl=60)
+    # /similar reads the generation, then awaits its query...
+    generation = c.generation
+    # ...while /ingest rewrites a video the query is about to return
+    c.invalidate(["b"])
+    c.put("k", "s", results("a", "b"), generation)
+    assert c.get("k") is None
+    assert c.stats()["stale_puts"] == 1
+    # A query started after the invalidation is cached as usual
+    c.put("k", "s", results("a", "b"), c.generation)
+    assert c.get("k") == results("a", "b")
+
+
+def test_empty_invalidate_keeps_generation():
+    c = SimilarCache(maxsize=10, ttl=60)
+    generation = c.generation
+    assert c.invalidate([]) == 0
+    assert c.invalidate(iter(())) == 0
+    c.put("k", "s", results("a"), generation)
+    assert c.get("k") is not None
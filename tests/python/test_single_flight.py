@@ -0,0 +1,83 @@
+import threading
+
+from backend.single_flight import Flight, Flights
+
+
+def gated():
+    """A produce() that streams two deltas once the gate opens."""
+
+    gate = threading.Event()
+    calls = []
+
+    def produce(flight):
+        calls.append(flight)
+        gate.wait(5)
+        for text in ("Hel", "lo"):
+            if flight.cancelled:
+                return
+            flight.publish("delta", text)
+        flight.publish("done", "Hello")
+
+    return gate, calls, produce
+
+
+def test_identical_requests_share_one_call():
+    flights = Flights(timeout=5)
+    gate, calls, produce = gated()
+    leader, is_leader = flights.join("k", produce)
+    joiner, joined_leader = flights.join("k", produce)
+    assert joiner is leader
+    assert (is_leader, joined_leader) == (True, False)
+    gate.set()
+    expected = [("delta", "Hel"), ("delta", "lo"), ("done", "Hello")]
+    assert list(leader.subscribe(5)) == expected
+    # A late subscriber replays the whole log
+    assert list(joiner.subscribe(5)) == expected
+    assert len(calls) == 1
+    assert flights.stats()["leaders"] == 1 and flights.stats()["joined"] == 1
+
+
+def test_no_key_never_coalesces():
+    flights = Flights(timeout=5)
+    gate, calls, produce = gated()
+    a, a_leads = flights.join(None, produce)
+    b, b_leads = flights.join(None, produce)
+    assert a is not b and a_leads and b_leads
+    gate.set()
+    assert list(a.subscribe(5))[-1] == ("done", "Hello")
+    assert list(b.subscribe(5))[-1] == ("done", "Hello")
+
+
+def test_abandoned_flight_is_cancelled_and_replaced():
+    flights = Flights(timeout=5)
+    gate, calls, produce = gated()
+    flight, _ = flights.join("k", produce)
+    events = flight.subscribe(5)
+    flight.publish("delta", "x")
+    assert next(events) == ("delta", "x")
+    events.close()
+    assert flight.cancelled
+    # A new request for the same key starts a fresh call instead of joining
+    fresh, leads = flights.join("k", produce)
+    assert fresh is not flight and leads
+    gate.set()
+    assert list(fresh.subscribe(5))[-1] == ("done", "Hello")
+    assert len(calls) == 2
+
+
+def test_one_subscriber_leaving_keeps_the_flight():
+    flight = Flight("k")
+    first, second = flight.subscribe(5), flight.subscribe(5)
+    flight.publish("delta", "a")
+    assert next(first) == ("delta", "a")
+    assert next(second) == ("delta", "a")
+    first.close()
+    assert not flight.cancelled
+    flight.publish("done", "a")
+    assert next(second) == ("done", "a")
+
+
+def test_subscriber_times_out():
+    flight = Flight("k")
+    kind, (status, _) = next(flight.subscribe(0.05))
+    assert (kind, status) == ("error", 504)
@@ -0,0 +1,71 @@
+from pathlib import Path
+
+import pytest
+from flask import Flask, request
+
+from backend import static_assets
+
+
+@pytest.fixture
+def build(tmp_path):
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "index.html").write_text("<html>" + "x" * 2000 + "</html>")
+    (tmp_path / "assets" / "index-B1x9kQ2a.js").write_text("console.log(1);" * 200)
+    (tmp_path / "logo.png").write_bytes(bytes(range(256)) * 4)
+    return tmp_path
+
+
+@pytest.fixture
+def client(build):
+    manifest = static_assets.Manifest(build, build / "index.html")
+    app = Flask(__name__)
+
+    @app.route("/<path:rel>")
+    def serve(rel):
+        return static_assets.respond(manifest.lookup(rel), request)
+
+    return app.test_client()
+
+
+def test_cache_headers(client):
+    hashed = client.get("/assets/index-B1x9kQ2a.js")
+    assert hashed.headers["Cache-Control"] == static_assets.IMMUTABLE
+    assert client.get("/index.html").headers["Cache-Control"] == static_assets.REVALIDATE
+
+
+def test_not_modified_skips_the_file(client, monkeypatch):
+    etag = client.get("/index.html").headers["ETag"]
+
+    def no_open(*args, **kwargs):
+        raise AssertionError("a 304 must not open the file")
+
+    monkeypatch.setattr(Path, "open", no_open)
+    resp = client.get("/index.html", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.data == b""
+    assert resp.headers["ETag"] == etag
+    assert "Content-Type" not in resp.headers
+
+
+def test_not_modified_per_encoding(client):
+    first = client.get("/index.html", headers={"Accept-Encoding": "gzip"})
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert first.headers["Vary"] == "Accept-Encoding"
+    etag = first.headers["ETag"]
+    assert client.get("/index.html", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+    # The identity body has a different tag, so it is sent in full
+    assert client.get("/index.html", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_range(client):
+    resp = client.get("/logo.png", headers={"Range": "bytes=10-19"})
+    assert resp.status_code == 206
+    assert resp.data == bytes(range(10, 20))
+    assert resp.headers["Content-Range"] == "bytes 10-19/1024"
+
+
+def test_range_ignores_compressed_variants(client):
+    resp = client.get("/index.html", headers={"Range": "bytes=0-5", "Accept-Encoding": "gzip"})
+    assert resp.status_code == 206
+    assert "Content-Encoding" not in resp.headers
+    assert resp.data == b"<html>"
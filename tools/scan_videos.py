@@ -1,12 +1,42 @@
 #!/usr/bin/env python3
-import os, sys, json, subprocess, shlex, re, time
+"""Scan media folders for lesson videos and suggest lesson/video matches.
+
+The directory walk runs on a thread pool (one `scandir` per directory) and
+`ffprobe` title probes run in a bounded process pool. Probe results are kept
+in a scan cache keyed by path, size and mtime, so a re-scan only probes new or
+changed files. The cache is saved every few hundred probes, so an interrupted
+scan resumes where it stopped.
+
+Lessons come from `lessons/manifest.json` and the headings of
+`public/course_content/lessons/*.md`. Each title is tokenized once into an
+inverted index, so a video is only scored (Jaccard over title tokens) against
+lessons that share a token with it. With `--rerank` the top
+candidates of each lesson are reordered by cosine similarity of
+`allie/backend/model.py` embeddings, computed in one batched `embed_texts` call.
+
+Usage:
+  python tools/scan_videos.py --root /srv/media --root ~/Archive --exclude 'tmp*'
+  python tools/scan_videos.py --workers 16 --no-cache
+  python tools/scan_videos.py --rerank --rerank-k 20 --top 10
+"""
+import os, sys, json, subprocess, re, time, argparse, fnmatch, heapq
+from collections import Counter, defaultdict
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
 OUT = ROOT / 'tools' / 'suggested_lesson_video_matches.json'
+CACHE = ROOT / 'tools' / '.scan_cache.json'
+MANIFEST = ROOT / 'lessons' / 'manifest.json'
+LESSONS_DIR = ROOT / 'public' / 'course_content' / 'lessons'
 LOG_DIR = ROOT / 'reorg_logs'
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+CACHE_VERSION = 1
+SAVE_EVERY = 500
+PROBE_TIMEOUT = 30
+
 def log(msg):
     ts = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
     print(f"[{ts}] {msg}", file=sys.stderr)
@@ -15,56 +45,281 @@ def have(cmd):
     from shutil import which
     return which(cmd) is not None
 
-def list_lessons():
-    # Placeholder list; adjust to fetch from Firestore on deploy
-    return [
-        'The AI Revolution: An Introductory Overview',
-        'Future Trends and Next Frontiers in AI Investments',
-    ]
+def list_lessons(manifest=MANIFEST, lessons_dir=LESSONS_DIR):
+    """Lesson titles from the lesson manifest and the course-content markdown headings."""
+    titles = []
+    try:
+        tiers = json.loads(Path(manifest).read_text())
+    except (OSError, ValueError) as e:
+        log(f"no lesson manifest at {manifest}: {e}")
+        tiers = {}
+    for entries in tiers.values():
+        titles.extend(e['title'] for e in entries if e.get('title'))
+    for md in sorted(Path(lessons_dir).glob('*.md')):
+        with md.open(encoding='utf-8') as f:
+            heading = next((line for line in f if line.startswith('# ')), '')
+        # "# Lesson 10: Identifying ..." -> "Identifying ..."
+        title = re.sub(r'^#\s*(lesson\s*\d+\s*:\s*)?', '', heading.strip(), flags=re.I)
+        titles.append(title or md.stem.replace('_', ' '))
+    seen, out = set(), []
+    for t in titles:
+        if norm(t) not in seen:
+            seen.add(norm(t))
+            out.append(t)
+    return out
 
 VIDEO_EXTS = {'.mp4','.mov','.mkv','.webm'}
+DEFAULT_EXCLUDES = ['.cache','.local','snap','.nvm','.rustup','.cargo','.conda','.pyenv','node_modules','.git']
+
+def excluded(entry, excludes):
+    # Patterns match a directory's name ('node_modules', 'tmp*') or its full path
+    return any(fnmatch.fnmatch(entry.name, pat) or fnmatch.fnmatch(entry.path, pat) for pat in excludes)
+
+def scan_dir(path, excludes, exts):
+    """List one directory: (subdirectories to walk, [(path, size, mtime_ns)])."""
+    dirs, files = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not excluded(entry, excludes):
+                            dirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and os.path.splitext(entry.name)[1].lower() in exts:
+                        st = entry.stat(follow_symlinks=False)
+                        files.append((entry.path, st.st_size, st.st_mtime_ns))
+                except OSError:
+                    continue
+    except OSError as e:
+        log(f"skip {path}: {e.strerror or e}")
+    return dirs, files
 
-def iter_videos(home):
-    for root, dirs, files in os.walk(home):
-        if any(part in {'.cache','.local','snap','.nvm','.rustup','.cargo','.conda','.pyenv','node_modules','.git'} for part in root.split(os.sep)):
-            continue
-        for f in files:
-            p = Path(root)/f
-            if p.suffix.lower() in VIDEO_EXTS:
-                yield p
+def iter_videos(roots, excludes=DEFAULT_EXCLUDES, exts=VIDEO_EXTS, workers=8):
+    """Yield (path, size, mtime_ns) for every video under `roots`, walking directories in parallel."""
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for r in roots:
+            real = os.path.realpath(r)
+            if real not in seen and os.path.isdir(real):
+                seen.add(real)
+                pending.add(pool.submit(scan_dir, real, excludes, exts))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                dirs, files = fut.result()
+                for d in dirs:
+                    # Symlinks are never followed, so only overlapping roots can repeat
+                    if d not in seen:
+                        seen.add(d)
+                        pending.add(pool.submit(scan_dir, d, excludes, exts))
+                yield from files
 
 def ffprobe_title(path):
-    if not have('ffprobe'): return None
+    """Container title tag, or None. Raises TimeoutExpired so a hung probe isn't cached."""
     try:
-        cmd = f"ffprobe -v error -show_entries format_tags=title -of default=noprint_wrappers=1:nokey=1 {shlex.quote(str(path))}"
-        out = subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL, text=True).strip()
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format_tags=title',
+             '-of', 'default=noprint_wrappers=1:nokey=1', str(path)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=PROBE_TIMEOUT,
+        ).stdout.strip()
         return out or None
+    except subprocess.TimeoutExpired:
+        raise
     except Exception:
         return None
 
+def _probe(path):
+    try:
+        return path, True, ffprobe_title(path)
+    except subprocess.TimeoutExpired:
+        return path, False, None
+
+def load_cache(path):
+    try:
+        data = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != CACHE_VERSION:
+        return {}
+    return data.get('files', {})
+
+def save_cache(path, files):
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps({'version': CACHE_VERSION, 'files': files}, separators=(',', ':')))
+    os.replace(tmp, path)
+
+def under(path, roots):
+    return any(path == r or path.startswith(r.rstrip(os.sep) + os.sep) for r in roots)
+
+def scan(roots, excludes, workers, walk_workers, cache_path=None):
+    """Return {path: title or None} for every video under `roots`, probing only changed files."""
+    cache = load_cache(cache_path) if cache_path else {}
+    real_roots = [os.path.realpath(r) for r in roots]
+    # Entries outside this scan's roots are kept as-is for other invocations
+    fresh = {p: e for p, e in cache.items() if not under(p, real_roots)}
+    titles, todo = {}, []
+    for path, size, mtime_ns in iter_videos(real_roots, excludes, workers=walk_workers):
+        e = cache.get(path)
+        if e is not None and e['size'] == size and e['mtime_ns'] == mtime_ns:
+            fresh[path] = e
+            titles[path] = e['title']
+        else:
+            todo.append((path, size, mtime_ns))
+    log(f"{len(titles) + len(todo)} videos, {len(titles)} unchanged, {len(todo)} to probe")
+
+    if todo and have('ffprobe'):
+        stat = {p: (s, m) for p, s, m in todo}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for n, (path, ok, title) in enumerate(pool.map(_probe, list(stat), chunksize=8), 1):
+                titles[path] = title
+                if ok:
+                    size, mtime_ns = stat[path]
+                    fresh[path] = {'size': size, 'mtime_ns': mtime_ns, 'title': title}
+                if cache_path and n % SAVE_EVERY == 0:
+                    save_cache(cache_path, fresh)
+                    log(f"probed {n}/{len(todo)}")
+    else:
+        if todo:
+            log("ffprobe not found; using file names")
+        # Not cached, so they are probed once ffprobe is installed
+        titles.update((p, None) for p, _, _ in todo)
+
+    if cache_path:
+        save_cache(cache_path, fresh)
+    return titles
+
 def norm(s):
     return re.sub(r"[^a-z0-9]+"," ", s.lower()).strip()
 
-def score(a,b):
-    ta = set(norm(a).split()); tb = set(norm(b).split())
+def tokens(s):
+    return frozenset(norm(s).split())
+
+def jaccard(ta, tb):
     if not ta or not tb: return 0.0
-    inter = len(ta & tb); union = len(ta | tb)
-    return inter/union
-
-def main():
-    home = Path.home()
-    lessons = list_lessons()
-    result = {t: [] for t in lessons}
-    for p in iter_videos(home):
-        meta = ffprobe_title(p) or p.stem
-        for t in lessons:
-            s = score(t, meta)
-            if s >= 0.10:
-                result[t].append({"path": str(p), "score": round(s,3)})
-    OUT.parent.mkdir(parents=True, exist_ok=True)
-    OUT.write_text(json.dumps(result, indent=2))
-    log(f"Wrote {OUT}")
+    inter = len(ta & tb)
+    return inter/(len(ta) + len(tb) - inter)
+
+def score(a,b):
+    return jaccard(tokens(a), tokens(b))
+
+class LessonIndex:
+    """Inverted index from title token to the lessons containing it."""
+
+    def __init__(self, titles):
+        self.titles = list(titles)
+        self.sizes = [len(tokens(t)) for t in self.titles]
+        self.postings = defaultdict(list)
+        for i, t in enumerate(self.titles):
+            for tok in tokens(t):
+                self.postings[tok].append(i)
+
+    def match(self, meta_tokens, threshold):
+        """[(lesson index, score)] for lessons scoring at least `threshold`.
+
+        Counting postings gives each candidate's intersection size directly,
+        so only lessons sharing a token are visited and scores equal `jaccard`.
+        """
+        postings = self.postings
+        inter = Counter(chain.from_iterable(postings[t] for t in meta_tokens if t in postings))
+        n = len(meta_tokens)
+        out = []
+        for i, k in inter.items():
+            s = k/(n + self.sizes[i] - k)
+            if s >= threshold:
+                out.append((i, s))
+        return out
+
+def match_videos(titles, lessons, threshold=0.10, top=0):
+    """{lesson title: [{"path", "score", "title"}]} best first; `titles` maps path -> probed title or None."""
+    index = LessonIndex(lessons)
+    found = [[] for _ in lessons]
+    tok_cache = {}
+    for p, title in titles.items():
+        meta = title or Path(p).stem
+        # Copies of one video share a name; tokenize it once
+        ts = tok_cache.get(meta)
+        if ts is None:
+            ts = tok_cache[meta] = tokens(meta)
+        for i, s in index.match(ts, threshold):
+            rows = found[i]
+            if not top or len(rows) < top:
+                heapq.heappush(rows, (s, p, meta)) if top else rows.append((s, p, meta))
+            elif s > rows[0][0]:
+                # Keep only the best `top` per lesson instead of every weak match
+                heapq.heapreplace(rows, (s, p, meta))
+    result = {}
+    for t, rows in zip(lessons, found):
+        rows.sort(key=lambda r: (-r[0], r[1]))
+        result[t] = [{"path": p, "score": round(s,3), "title": meta} for s, p, meta in rows]
+    return result
+
+def rerank(result, k, batch_size=None):
+    """Reorder each lesson's top `k` candidates by embedding cosine similarity."""
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    try:
+        from allie.backend.model import embed_texts
+    except ImportError as e:
+        raise SystemExit(f"--rerank needs the Allie backend requirements (allie/backend/requirements.txt): {e}")
+    lessons = [t for t, rows in result.items() if rows]
+    metas = sorted({r["title"] for t in lessons for r in result[t][:k]})
+    if not metas:
+        return result
+    # One batched encode for all lessons and candidate titles
+    emb = embed_texts(lessons + metas, batch_size=batch_size)
+    lesson_vec = dict(zip(lessons, emb[:len(lessons)]))
+    meta_vec = dict(zip(metas, emb[len(lessons):]))
+    for t in lessons:
+        head, tail = result[t][:k], result[t][k:]
+        for r in head:
+            r["similarity"] = round(float(lesson_vec[t] @ meta_vec[r["title"]]), 4)
+        head.sort(key=lambda r: -r["similarity"])
+        result[t] = head + tail
+    log(f"reranked {sum(min(k, len(result[t])) for t in lessons)} candidates with {len(metas)} embedded titles")
+    return result
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--root', action='append', help='directory to scan (repeatable; default: home directory)')
+    ap.add_argument('--exclude', action='append', default=[],
+                    help='directory name or path glob to skip (repeatable; added to the defaults)')
+    ap.add_argument('--no-default-excludes', action='store_true', help='only use --exclude patterns')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='parallel ffprobe processes')
+    ap.add_argument('--walk-workers', type=int, default=8, help='threads listing directories')
+    ap.add_argument('--cache', default=str(CACHE), help='scan cache file')
+    ap.add_argument('--no-cache', action='store_true', help='probe every file and do not write the cache')
+    ap.add_argument('--out', default=str(OUT))
+    ap.add_argument('--manifest', default=str(MANIFEST), help='lesson manifest (lessons/manifest.json)')
+    ap.add_argument('--lessons-dir', default=str(LESSONS_DIR), help='course-content markdown lessons')
+    ap.add_argument('--threshold', type=float, default=0.10, help='minimum title-token Jaccard score')
+    ap.add_argument('--top', type=int, default=50, help='matches kept per lesson (0 = all)')
+    ap.add_argument('--rerank', action='store_true', help='reorder top candidates by embedding similarity')
+    ap.add_argument('--rerank-k', type=int, default=20, help='candidates per lesson to rerank')
+    ap.add_argument('--batch-size', type=int, help='texts per embedding forward pass')
+    args = ap.parse_args(argv)
+
+    roots = [os.path.expanduser(r) for r in (args.root or [str(Path.home())])]
+    excludes = ([] if args.no_default_excludes else DEFAULT_EXCLUDES) + args.exclude
+    started = time.monotonic()
+    titles = scan(roots, excludes, max(1, args.workers), max(1, args.walk_workers),
+                  None if args.no_cache else args.cache)
+    log(f"scanned {len(titles)} videos in {time.monotonic() - started:.1f}s")
+
+    lessons = list_lessons(args.manifest, args.lessons_dir)
+    started = time.monotonic()
+    keep = max(args.top, args.rerank_k) if args.rerank and args.top else args.top
+    result = match_videos(titles, lessons, args.threshold, keep)
+    log(f"matched {len(titles)} videos against {len(lessons)} lessons in {time.monotonic() - started:.2f}s")
+    if args.rerank:
+        result = rerank(result, args.rerank_k, args.batch_size)
+        if args.top:
+            result = {t: rows[:args.top] for t, rows in result.items()}
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2))
+    log(f"Wrote {out}")
 
 if __name__ == '__main__':
     main()
-